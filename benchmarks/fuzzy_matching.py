@@ -0,0 +1,43 @@
+"""
+benchmark of fuzzy matching a started word against all names and long forms, with the character mask prefilter of
+FuzzyIndex and with scoring every candidate
+
+run from the base directory of the project with
+`python3 -m benchmarks.fuzzy_matching`
+"""
+import timeit
+
+from src.autocompletion import FUZZY_MATCHING_LIMIT, FuzzyIndex, _rank_fuzzy_matches
+
+RULE_COUNTS = [100, 1_000, 10_000, 100_000]
+REPETITIONS = 10
+QUERY = "gopt1x"
+
+
+def main():
+    print(f"{'rules':>8} {'build':>12} {'prefiltered':>14} {'all scored':>14}")
+    for rule_count in RULE_COUNTS:
+        words = []
+        for i in range(rule_count):
+            words.extend([f"command_{i}", f"-o_{i}", f"--option_{i}", f"-go_{i}", f"--global_option_{i}"])
+        entries = [(word, position) for position, word in enumerate(words)]
+
+        build_time = timeit.timeit(lambda: FuzzyIndex(entries), number=1)
+        fuzzy_index = FuzzyIndex(entries)
+        prefiltered_time = timeit.timeit(
+            lambda: fuzzy_index.find(QUERY, limit=FUZZY_MATCHING_LIMIT),
+            number=REPETITIONS,
+        )
+        all_scored_time = timeit.timeit(
+            lambda: _rank_fuzzy_matches(QUERY, entries, limit=FUZZY_MATCHING_LIMIT),
+            number=REPETITIONS,
+        )
+        print(
+            f"{rule_count:>8} {build_time * 1e3:>9.2f} ms "
+            f"{prefiltered_time / REPETITIONS * 1e3:>11.2f} ms "
+            f"{all_scored_time / REPETITIONS * 1e3:>11.2f} ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+"""
+benchmark of loading the rules of a configuration, building them from the configuration file and mapping them from
+the rule index - parsing the JSON alone is shown for comparison
+
+run from the base directory of the project with
+`python3 -m benchmarks.rule_cache`
+"""
+import json
+import tempfile
+import timeit
+
+from src.autocompletion import compile_rule_index, load_rules
+
+from .synthetic_config import write_synthetic_config
+
+RULE_COUNTS = [100, 1_000, 10_000, 100_000]
+REPETITIONS = 3
+
+
+def main():
+    with tempfile.TemporaryDirectory() as directory:
+        print(f"{'rules':>8} {'json only':>12} {'uncached':>12} {'cached':>12}")
+        for rule_count in RULE_COUNTS:
+            config_path = write_synthetic_config(directory, rule_count)
+            compile_rule_index(config_path=config_path, cache_dir=directory)
+
+            def parse_json():
+                with open(config_path, "rb") as config:
+                    json.loads(config.read())
+
+            json_time = min(timeit.repeat(parse_json, number=1, repeat=REPETITIONS))
+            uncached_time = min(
+                timeit.repeat(
+                    lambda: load_rules(config_path=config_path, use_cache=False), number=1, repeat=REPETITIONS
+                )
+            )
+            cached_time = min(
+                timeit.repeat(
+                    lambda: load_rules(config_path=config_path, cache_dir=directory), number=1, repeat=REPETITIONS
+                )
+            )
+            print(
+                f"{rule_count:>8} {json_time * 1e3:>9.1f} ms "
+                f"{uncached_time * 1e3:>9.1f} ms "
+                f"{cached_time * 1e3:>9.1f} ms"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+"""
+benchmark of completing with rules built from the configuration and with rules mapped from the rule index, the rule
+index is memory mapped so loading it should neither take time nor allocate memory no matter how many rules the
+configuration contains
+
+run from the base directory of the project with
+`python3 -m benchmarks.rule_index`
+"""
+import tempfile
+import time
+import tracemalloc
+
+from src import complete, load_rule_index, load_rules
+
+from .synthetic_config import write_synthetic_config
+
+RULE_COUNTS = [100, 1_000, 10_000, 100_000]
+
+
+def measure(load):
+    """
+    :return: time in seconds and memory in bytes allocated by loading the rules and completing a started parameter
+    """
+    tracemalloc.start()
+    start = time.perf_counter()
+    complete(args=["command_1", "-o_2", "parameter", "pa"], rules=load())
+    duration = time.perf_counter() - start
+    allocated = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return duration, allocated
+
+
+def main():
+    with tempfile.TemporaryDirectory() as directory:
+        print(f"{'rules':>8} {'built':>12} {'built memory':>14} {'index':>12} {'index memory':>14}")
+        for rule_count in RULE_COUNTS:
+            config_path = write_synthetic_config(directory, rule_count)
+            # the index is written before measuring
+            load_rule_index(config_path=config_path, cache_dir=directory)
+
+            built_time, built_memory = measure(lambda: load_rules(config_path=config_path, use_cache=False))
+            index_time, index_memory = measure(lambda: load_rule_index(config_path=config_path, cache_dir=directory))
+            print(
+                f"{rule_count:>8} {built_time * 1e3:>9.2f} ms {built_memory / 1e6:>11.2f} MB "
+                f"{index_time * 1e3:>9.2f} ms {index_memory / 1e6:>11.2f} MB"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+import json
+import os
+
+
+def write_synthetic_config(
+    directory: str,
+    rule_count: int,
+):
+    """
+    writes a configuration with rule_count commands, rule_count command options and rule_count global options, every
+    command has ten of the options
+    :param directory: directory the configuration is written to
+    :param rule_count: amount of rules of each kind
+    :return: path to the written configuration
+    """
+    parameters = {
+        "min_amnt": 0,
+        "max_amnt": 1,
+        "type_options": [
+            {
+                "type": "ANY",
+                "optional": True,
+            }
+        ],
+    }
+    config = {
+        "default": "ANY",
+        "command_rules": {
+            f"command_{i}": {
+                "parameters": parameters,
+                "options": [f"-o_{(i + j) % rule_count}" for j in range(10)],
+            }
+            for i in range(rule_count)
+        },
+        "command_option_rules": {
+            f"-o_{i}": {
+                "long": f"--option_{i}",
+                "parameters": parameters,
+            }
+            for i in range(rule_count)
+        },
+        "global_option_rules": {
+            f"-go_{i}": {
+                "long": f"--global_option_{i}",
+                "parameters": parameters,
+            }
+            for i in range(rule_count)
+        },
+    }
+
+    config_path = os.path.join(directory, f"config_{rule_count}.json")
+    with open(config_path, "w") as config_file:
+        json.dump(config, config_file)
+
+    return config_path
@@ -0,0 +1,58 @@
+"""
+benchmark of resolving the typed words of a command line to rules, the time per command line should stay the same no
+matter how many rules the configuration contains
+
+run from the base directory of the project with
+`python3 -m benchmarks.token_resolution`
+"""
+import tempfile
+import timeit
+
+from src import AutoCompletion
+
+from .synthetic_config import write_synthetic_config
+
+RULE_COUNTS = [100, 1_000, 10_000, 100_000]
+REPETITIONS = 1_000
+
+
+def main():
+    with tempfile.TemporaryDirectory() as directory:
+        print(f"{'rules':>8} {'get_last_command_global_option':>32} {'get_command_option_list':>25}")
+        for rule_count in RULE_COUNTS:
+            last = rule_count - 1
+            current_input = [
+                f"command_{last}",
+                "parameter",
+                f"-o_{last}",
+                "parameter",
+                f"--global_option_{last}",
+                "parameter",
+                "unknown_1",
+                "unknown_2",
+            ]
+            autocompletion = AutoCompletion(
+                config_path=write_synthetic_config(directory, rule_count),
+                args=current_input,
+                use_cache=False,
+            )
+            # the lookup dictionaries are built on first use, only the lookups themselves are timed
+            autocompletion.get_last_command_global_option(current_input)
+            autocompletion.get_command_option_list(current_input)
+
+            last_rule_time = timeit.timeit(
+                lambda: autocompletion.get_last_command_global_option(current_input),
+                number=REPETITIONS,
+            )
+            option_list_time = timeit.timeit(
+                lambda: autocompletion.get_command_option_list(current_input),
+                number=REPETITIONS,
+            )
+            print(
+                f"{rule_count:>8} {last_rule_time / REPETITIONS * 1e6:>29.2f} us "
+                f"{option_list_time / REPETITIONS * 1e6:>22.2f} us"
+            )
+
+
+if __name__ == "__main__":
+    main()
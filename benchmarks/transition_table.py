@@ -0,0 +1,71 @@
+"""
+benchmark of compiling the rules into the transition table and of completing with it, compiling grows with the amount
+of rules while completing what follows a typed command/option should take the same time for any amount of rules
+
+run from the base directory of the project with
+`python3 -m benchmarks.transition_table`
+"""
+import tempfile
+import timeit
+
+from src import AutoCompletion, ConfigLoader, RuleSet
+from src.autocompletion import TransitionTable
+
+from .synthetic_config import write_synthetic_config
+
+RULE_COUNTS = [100, 1_000, 10_000, 100_000]
+REPETITIONS = 1_000
+
+
+def main():
+    with tempfile.TemporaryDirectory() as directory:
+        print(f"{'rules':>8} {'compile':>12} {'parse input':>14} {'complete next':>16}")
+        for rule_count in RULE_COUNTS:
+            rules = RuleSet.from_config_loader(
+                ConfigLoader(config_path=write_synthetic_config(directory, rule_count))
+            )
+            last = rule_count - 1
+            current_input = [
+                f"command_{last}",
+                "parameter",
+                f"-o_{last}",
+                "parameter",
+                f"--global_option_{last}",
+                "parameter",
+            ]
+            autocompletion = AutoCompletion(
+                config_path=None,
+                args=current_input,
+                rules=rules,
+            )
+            command = rules.commands[-1]
+
+            compile_time = timeit.timeit(
+                lambda: TransitionTable(
+                    commands=rules.commands,
+                    options=rules.options,
+                    global_options=rules.global_options,
+                ),
+                number=1,
+            )
+            parse_time = timeit.timeit(
+                lambda: autocompletion.parse_input(current_input),
+                number=REPETITIONS,
+            )
+            next_time = timeit.timeit(
+                lambda: autocompletion.complete_next(
+                    last_word_command=command,
+                    last_word_option=None,
+                    parameter_count=1,
+                ),
+                number=REPETITIONS,
+            )
+            print(
+                f"{rule_count:>8} {compile_time * 1e3:>9.2f} ms "
+                f"{parse_time / REPETITIONS * 1e6:>11.2f} us "
+                f"{next_time / REPETITIONS * 1e6:>13.2f} us"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+"""
+benchmark of reading the usage history for the usage ranking, right after a compaction (only the snapshot is read) and
+with a log just below USAGE_COMPACT_SIZE - read by a new process (the script) and again by the same process (the daemon,
+which keeps the scores until the history changes)
+
+run from the base directory of the project with
+`python3 -m benchmarks.usage_history`
+"""
+import os
+import tempfile
+import timeit
+
+from src import autocompletion as autocompletion_module
+from src.autocompletion import USAGE_COMPACT_SIZE, UsageHistory
+
+RULE_COUNTS = [100, 1_000, 10_000]
+REPETITIONS = 100
+
+
+def read_cold(usage_history):
+    # forget the scores kept by this process, like a new process would start out
+    autocompletion_module._usage_scores.clear()
+    return usage_history.get_scores()
+
+
+def main():
+    print(f"{'rules':>8} {'snapshot':>12} {'full log':>12} {'kept':>12}")
+    for rule_count in RULE_COUNTS:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            usage_history = UsageHistory(path=os.path.join(tmp_dir, "history"), compact_size=float("inf"))
+            usage_history.record([f"command_{i}" for i in range(rule_count)])
+            usage_history.compact()
+            snapshot_time = timeit.timeit(lambda: read_cold(usage_history), number=REPETITIONS)
+
+            # fill the log up to the size it gets compacted at
+            names = [f"command_{i % rule_count}" for i in range(USAGE_COMPACT_SIZE // 25)]
+            usage_history.record(names)
+            full_log_time = timeit.timeit(lambda: read_cold(usage_history), number=REPETITIONS)
+            kept_time = timeit.timeit(usage_history.get_scores, number=REPETITIONS)
+
+        print(
+            f"{rule_count:>8} {snapshot_time / REPETITIONS * 1e3:>9.3f} ms "
+            f"{full_log_time / REPETITIONS * 1e3:>9.3f} ms "
+            f"{kept_time / REPETITIONS * 1e3:>9.3f} ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
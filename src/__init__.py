@@ -1 +1,18 @@
-from .autocompletion import AutoCompletion, Command, CommandOptionBase, Option, ParameterTypeOptions, ParameterTypes
+from .autocompletion import (
+    AutoCompletion,
+    Command,
+    CommandOptionBase,
+    ConfigLoader,
+    MappedRuleSet,
+    Option,
+    ParameterTypeOptions,
+    ParameterTypes,
+    Provider,
+    RuleSet,
+    ValueFile,
+    ValueList,
+    complete,
+    complete_with_status,
+    load_rule_index,
+    load_rules,
+)
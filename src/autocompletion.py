@@ -2,11 +2,289 @@ import json
 import sys
 import enum
 import os
+import hashlib
+import pickle
+import tempfile
+import bisect
+import socket
+import socketserver
+import signal
+import gc
+import itertools
+import threading
+import time
+import collections
+import importlib
+import subprocess
+import mmap
+import fcntl
+import heapq
+import queue
+import struct
+import functools
+
+# time in seconds a DYNAMIC provider may take if it does not set a timeout - well below the time the client waits for
+# an answer of the daemon (autocompletion_client.RESPONSE_TIMEOUT)
+PROVIDER_TIMEOUT = 0.5
+
+# share of the time the client waits for an answer the daemon may complete for, the rest is left for the answer to
+# reach the client
+DAEMON_RESPONSE_SHARE = 0.8
+
+# bump whenever the layout of the persisted result cache changes, older caches are then dropped
+CACHE_FORMAT_VERSION = 1
+
+# maximum amount of file paths completed if the configuration does not set file_completion_limit
+FILE_COMPLETION_LIMIT = 1000
+
+# maximum amount of values completed for an ENUM parameter
+ENUM_COMPLETION_LIMIT = 1000
+
+# maximum amount of fuzzy matches completed if the configuration does not set fuzzy_matching_limit
+FUZZY_MATCHING_LIMIT = 20
+
+# time in seconds after which a use of a command/option counts half for the usage ranking
+USAGE_HALF_LIFE = 30 * 24 * 60 * 60
+# size in bytes the usage log may grow to before it is compacted into the usage snapshot
+USAGE_COMPACT_SIZE = 4 * 1024
+
+# delimiters of the completions for each output mode of the script, see write_completion
+OUTPUT_DELIMITERS = {"lines": b"\n", "nul": b"\0"}
+
+# amount of completion sessions (shells) the daemon keeps, the least recently used session is dropped first
+SESSION_LIMIT = 64
+
+# amount of completions of commands/options the result cache keeps, the least recently used one is dropped first
+RESULT_CACHE_SIZE = 4096
 
 
 class ParameterTypes(str, enum.Enum):
     any = "ANY"
     file = "FILE"
+    dynamic = "DYNAMIC"
+    enum = "ENUM"
+
+
+# the parameter types as they appear among the completions before they are completed, for removing them in one lookup
+PARAMETER_TYPE_NAMES = frozenset(parameter_type.value for parameter_type in ParameterTypes)
+
+
+class Provider:
+    def __init__(
+        self,
+        command: list[str] | None = None,
+        function: str | None = None,
+        timeout: float = PROVIDER_TIMEOUT,
+        ttl: float = 60.0,
+    ):
+        """
+        provides the values of a DYNAMIC parameter - either the lines printed by a command or the strings returned by a
+        python function, exactly one of both has to be set
+        :param command: the command and its arguments, it is run in the working directory of the completion
+        :param function: "module:function" - the function is called with the working directory of the completion
+        :param timeout: time in seconds the provider may take, a provider that takes longer provides nothing
+        :param ttl: time in seconds the provided values are cached for
+        """
+        if (command is None) == (function is None):
+            raise ValueError("a provider needs either a command or a function")
+
+        self.command = command
+        self.function = function
+        self.timeout = timeout
+        self.ttl = ttl
+
+    @property
+    def key(self):
+        """
+        identifies the values of the provider in the provider cache
+        """
+        return json.dumps([self.command, self.function])
+
+    def get_values(
+        self,
+        cwd: str | None,
+    ):
+        """
+        runs the provider
+        :param cwd: working directory of the completion
+        :return: a list of the provided values, None if the provider failed or did not finish in time
+        """
+        if self.command is not None:
+            try:
+                process = subprocess.run(
+                    self.command,
+                    cwd=cwd,
+                    stdin=subprocess.DEVNULL,
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.DEVNULL,
+                    timeout=self.timeout,
+                    text=True,
+                )
+            except (OSError, subprocess.SubprocessError):
+                return None
+            if process.returncode != 0:
+                return None
+            return [line for line in process.stdout.splitlines() if line]
+
+        module_name, _, function_name = self.function.partition(":")
+
+        def call_function():
+            yield from getattr(importlib.import_module(module_name), function_name)(cwd)
+
+        try:
+            values, finished = _collect_within(call_function(), self.timeout)
+        except Exception:
+            return None
+        if not finished:
+            return None
+        return [str(value) for value in values]
+
+    def __eq__(self, obj):
+        if type(self) == type(obj):
+            if (
+                self.command == obj.command
+                and self.function == obj.function
+                and self.timeout == obj.timeout
+                and self.ttl == obj.ttl
+            ):
+                return True
+        return False
+
+
+class ValueList:
+    def __init__(
+        self,
+        values: list[str],
+    ):
+        """
+        values of an ENUM parameter given inline in the configuration
+        :param values: the values, in any order
+        """
+        self.values = tuple(sorted(values))
+
+    def find(
+        self,
+        prefix: str,
+        limit: int,
+    ):
+        """
+        :param prefix: the started value
+        :param limit: maximum amount of returned values
+        :return: a list of the values starting with the prefix, sorted
+        """
+        values = []
+        position = bisect.bisect_left(self.values, prefix)
+        while position < len(self.values) and len(values) < limit and self.values[position].startswith(prefix):
+            values.append(self.values[position])
+            position += 1
+
+        return values
+
+    def __eq__(self, obj):
+        return type(self) == type(obj) and self.values == obj.values
+
+
+# path -> (mtime, size, memory map) of the value files mapped by this process
+_mapped_value_files = {}
+_mapped_value_files_lock = threading.Lock()
+
+
+class ValueFile:
+    def __init__(
+        self,
+        path: str,
+    ):
+        """
+        values of an ENUM parameter read from a file - one value per line, sorted by bytes (e.g. `LC_ALL=C sort`)
+        the file is memory mapped and searched with a binary search, only the matching values are ever read into python
+        strings, so the file can contain any amount of values
+        :param path: path to the value file
+        """
+        self.path = path
+
+    def _get_memory_map(self):
+        """
+        :return: the memory map of the value file, mapped again if the file changed - None for an empty file
+        """
+        file_stat = os.stat(self.path)
+        with _mapped_value_files_lock:
+            mapped = _mapped_value_files.get(self.path)
+            if mapped is None or mapped[:2] != (file_stat.st_mtime_ns, file_stat.st_size):
+                memory_map = None
+                if file_stat.st_size > 0:
+                    with open(self.path, "rb") as value_file:
+                        memory_map = mmap.mmap(value_file.fileno(), 0, access=mmap.ACCESS_READ)
+                # the map of the old file is not needed anymore, a long running daemon would keep one per change
+                if mapped is not None and mapped[2] is not None:
+                    mapped[2].close()
+                mapped = (file_stat.st_mtime_ns, file_stat.st_size, memory_map)
+                _mapped_value_files[self.path] = mapped
+
+        return mapped[2]
+
+    def find(
+        self,
+        prefix: str,
+        limit: int,
+    ):
+        """
+        :param prefix: the started value
+        :param limit: maximum amount of returned values
+        :return: a list of the values starting with the prefix, sorted
+        :raises OSError: if the value file can not be read
+        """
+        while True:
+            memory_map = self._get_memory_map()
+            if memory_map is None:
+                return []
+            try:
+                return self._find_in(memory_map=memory_map, prefix=prefix.encode(), limit=limit)
+            except ValueError:
+                # the file changed and its old map was closed by another thread while it was searched, search again
+                if not memory_map.closed:
+                    raise
+
+    @staticmethod
+    def _find_in(
+        memory_map: mmap.mmap,
+        prefix: bytes,
+        limit: int,
+    ):
+        """
+        :return: a list of the values of the mapped value file starting with the prefix, sorted
+        :raises ValueError: if the map was closed
+        """
+        size = len(memory_map)
+
+        # binary search for the first line that is not smaller than the prefix, low and high are always line starts
+        low, high = 0, size
+        while low < high:
+            middle = (low + high) // 2
+            line_start = memory_map.rfind(b"\n", low, middle) + 1 or low
+            line_end = memory_map.find(b"\n", line_start)
+            if line_end == -1:
+                line_end = size
+            if memory_map[line_start:line_end] < prefix:
+                low = line_end + 1
+            else:
+                high = line_start
+
+        values = []
+        while low < size and len(values) < limit:
+            line_end = memory_map.find(b"\n", low)
+            if line_end == -1:
+                line_end = size
+            line = memory_map[low:line_end]
+            if not line.startswith(prefix):
+                break
+            if line:
+                values.append(line.decode(errors="replace"))
+            low = line_end + 1
+
+        return values
+
+    def __eq__(self, obj):
+        return type(self) == type(obj) and self.path == obj.path
 
 
 class ParameterTypeOptions:
@@ -14,9 +292,15 @@ class ParameterTypeOptions:
         self,
         parameter_type: ParameterTypes,
         optional: bool,
+        provider: Provider | None = None,
+        values: ValueList | ValueFile | None = None,
     ):
         self.parameter_type = parameter_type
         self.optional = optional
+        # only set for DYNAMIC parameters
+        self.provider = provider
+        # only set for ENUM parameters
+        self.values = values
 
     def print(self):
         print(f"  - type: {self.parameter_type}\n    optional: {self.optional}\n")
@@ -26,6 +310,8 @@ class ParameterTypeOptions:
             if (
                 self.parameter_type == obj.parameter_type
                 and self.optional == obj.optional
+                and self.provider == obj.provider
+                and self.values == obj.values
             ):
                 return True
         return False
@@ -53,8 +339,21 @@ class Command(CommandOptionBase):
         param_min_amnt: int,
         param_max_amnt: int,
         parameter_type_options: list[ParameterTypeOptions],
+        subcommand_rules: dict | None = None,
+        config_dir: str = "",
+        path: tuple[str, ...] | None = None,
     ):
+        """
+        :param subcommand_rules: the subcommands as in the configuration (name -> command rule), they are only built
+            when they are asked for, see get_subcommand
+        :param config_dir: directory of the configuration, relative value files of subcommands are relative to it
+        :param path: names of the parent commands and this command, (name,) for a top level command
+        """
         self.options = options
+        self.subcommand_rules = subcommand_rules or {}
+        self.config_dir = config_dir
+        self.path = path or (name,)
+        self._subcommands = {}
         super().__init__(
             name=name,
             param_min_amnt=param_min_amnt,
@@ -62,6 +361,31 @@ class Command(CommandOptionBase):
             parameter_type_options=parameter_type_options,
         )
 
+    @property
+    def subcommand_names(self):
+        return tuple(self.subcommand_rules)
+
+    def get_subcommand(
+        self,
+        name: str,
+    ):
+        """
+        :param name: name of a subcommand
+        :return: the subcommand, built from its rule the first time it is asked for - None if there is no such
+            subcommand
+        """
+        subcommand = self._subcommands.get(name)
+        if subcommand is None and name in self.subcommand_rules:
+            subcommand = _build_command(
+                name=name,
+                command_rule=self.subcommand_rules[name],
+                config_dir=self.config_dir,
+                path=self.path + (name,),
+            )
+            self._subcommands[name] = subcommand
+
+        return subcommand
+
     def __eq__(self, obj):
         if type(self) == type(obj):
             if len(self.options) == len(obj.options):
@@ -82,6 +406,8 @@ class Command(CommandOptionBase):
                 self.name == obj.name
                 and self.param_min_amnt == obj.param_min_amnt
                 and self.param_max_amnt == obj.param_max_amnt
+                and self.subcommand_rules == obj.subcommand_rules
+                and self.path == obj.path
             ):
                 return True
 
@@ -99,6 +425,110 @@ class Command(CommandOptionBase):
             print("options:")
             for option in self.options:
                 print(option)
+        if len(self.subcommand_rules) > 0:
+            print("subcommands:")
+            for subcommand in self.subcommand_rules:
+                print(subcommand)
+
+
+class ShardedCommand(Command):
+    def __init__(
+        self,
+        name: str,
+        shard_path: str,
+    ):
+        """
+        a command whose rule is kept in a shard file of its own, see ConfigLoader.get_commands
+        the shard is only read once anything but the name of the command is needed, e.g. once the command is typed
+        :param name: name of the command
+        :param shard_path: path to the shard file, it contains the rule of the command as in the configuration
+        """
+        self.name = name
+        self.shard_path = shard_path
+        self.path = (name,)
+        # ((mtime, size) of the shard file when it was read - None if it could not be read, the command built from it),
+        # set once and never changed, so completions running at the same time can share the command without a lock
+        self._built = None
+
+    def _get_shard_stat(self):
+        try:
+            shard_stat = os.stat(self.shard_path)
+        except OSError:
+            return None
+        return shard_stat.st_mtime_ns, shard_stat.st_size
+
+    def _get_command(self):
+        """
+        :return: the command built from the shard file, the file is read on the first call - a missing or broken shard
+            is a command without options, parameters and subcommands
+        """
+        built = self._built
+        if built is None:
+            shard_stat = self._get_shard_stat()
+            try:
+                with open(self.shard_path, "rb") as shard:
+                    command_rule = json.load(shard)
+                # relative value files of a shard are relative to the shard
+                command = _build_command(
+                    name=self.name,
+                    command_rule=command_rule,
+                    config_dir=os.path.dirname(self.shard_path),
+                )
+            except (OSError, ValueError, LookupError, TypeError):
+                command = Command(
+                    options=(),
+                    name=self.name,
+                    param_min_amnt=0,
+                    param_max_amnt=0,
+                    parameter_type_options=[],
+                )
+            # two completions reading the shard at the same time both build it, the last one is kept
+            built = (shard_stat, command)
+            self._built = built
+
+        return built[1]
+
+    @property
+    def is_built(self):
+        return self._built is not None
+
+    def shard_changed(self):
+        """
+        the command is never built again, rules with a changed shard are loaded anew (see CompletionServer.get_rules)
+        :return: True if the shard file changed since the command was built from it
+        """
+        built = self._built
+        return built is not None and self._get_shard_stat() != built[0]
+
+    @property
+    def options(self):
+        return self._get_command().options
+
+    @property
+    def param_min_amnt(self):
+        return self._get_command().param_min_amnt
+
+    @property
+    def param_max_amnt(self):
+        return self._get_command().param_max_amnt
+
+    @property
+    def parameter_type_options(self):
+        return self._get_command().parameter_type_options
+
+    @property
+    def subcommand_rules(self):
+        return self._get_command().subcommand_rules
+
+    @property
+    def config_dir(self):
+        return self._get_command().config_dir
+
+    def get_subcommand(
+        self,
+        name: str,
+    ):
+        return self._get_command().get_subcommand(name)
 
 
 class Option(CommandOptionBase):
@@ -150,250 +580,2770 @@ class Option(CommandOptionBase):
                 parameter_type_option.print()
 
 
-class AutoCompletion:
-    config_path = ""
+def _parse_parameter_type_options(
+    type_options: list[dict],
+    config_dir: str,
+):
+    """
+    :param type_options: the type_options of a command/option as in the configuration
+    :param config_dir: directory relative value files are relative to
+    :return: a list of all parameters, containing the type and if the parameter is optional
+    """
+    parameter_type_options = []
+    for type_option in type_options:
+        provider = None
+        if "provider" in type_option:
+            provider = Provider(**type_option["provider"])
+
+        values = None
+        if "values" in type_option:
+            values = ValueList(type_option["values"])
+        elif "values_file" in type_option:
+            # relative value files are relative to the configuration file
+            values = ValueFile(os.path.join(config_dir, type_option["values_file"]))
+
+        parameter_type_options.append(
+            ParameterTypeOptions(
+                parameter_type=type_option["type"],
+                optional=type_option["optional"],
+                provider=provider,
+                values=values,
+            )
+        )
 
-    commands: list[Command] = []
-    options: list[Option] = []
-    global_options: list[Option] = []
-    default: ParameterTypes = ParameterTypes.file
+    return parameter_type_options
 
+
+def _build_command(
+    name: str,
+    command_rule: dict,
+    config_dir: str,
+    path: tuple[str, ...] | None = None,
+):
+    """
+    :param name: name of the command
+    :param command_rule: the rule of the command as in the configuration
+    :param config_dir: directory relative value files are relative to
+    :param path: names of the parent commands and the command, see Command
+    :return: the command, its subcommands are not built yet
+    """
+    parameters = command_rule["parameters"]
+    return Command(
+        options=tuple(command_rule["options"]),
+        name=name,
+        param_min_amnt=parameters["min_amnt"],
+        param_max_amnt=parameters["max_amnt"],
+        parameter_type_options=_parse_parameter_type_options(
+            type_options=parameters["type_options"],
+            config_dir=config_dir,
+        ),
+        subcommand_rules=command_rule.get("subcommands"),
+        config_dir=config_dir,
+        path=path,
+    )
+
+
+class ConfigLoader:
     def __init__(
         self,
-        config_path,
-        args,
+        config_path: str,
     ):
         """
-        initializes completion
-            - sets config file that should be used
-            - loads commands, global options and options from configuration file
-        :param config_path:
-            - if this variable is set, this configuration gets used (mainly for test purposes)
-            - if this variable is not set, the configuration is set statically (for Elektra project set using KDB)
-        :param args:
-            this variable should only be set for testing from pytests
-            - if this variable is set, the autocompletion will be done with using this list as the previously typed commands/options
-            - if this variable is not set, the autocompletion will be done based on the arguements passed via command line
+        loads a configuration file - the file is read and parsed only once, each section (commands, command options and
+        global options) is built from that parse the first time it is requested
+        :param config_path: path to the configuration file
         """
-        if config_path:
-            self.config_path = config_path
-        else:
-            self.config_path = "config.json"
-            # TODO set using kdb
+        self.config_path = config_path
+        self._content = None
+        self._config_json = None
+        self._sections = {}
 
-        self.commands = self.get_commands()
-        self.options = self.get_options(option_type="command_option_rules")
-        self.global_options = self.get_options(option_type="global_option_rules")
-        if args is None:
-            # when in command line read in args
-            self.current_input = sys.argv[1:]
-        else:
-            # only for testing via pytest
-            self.current_input = args
+    @property
+    def content(self):
+        """
+        the raw bytes of the configuration file, the file is only read on first access
+        """
+        if self._content is None:
+            with open(self.config_path, "rb") as config:
+                self._content = config.read()
 
-        if len(self.current_input) > 0:
-            self.current_word = self.current_input[-1]
-        else:
-            self.current_word = None
+        return self._content
+
+    @property
+    def config_json(self):
+        """
+        the parsed configuration file, the file is only parsed on first access
+        """
+        if self._config_json is None:
+            self._config_json = json.loads(self.content)
+
+        return self._config_json
 
     def _get_parameter_type_options(
         self,
         parameters,
     ):
-        parameter_type_options = []
         """
         private method used by get_options and get_commands
         :param parameters: part of a JSON containing the parameters for any option/command
         :return: a list of all parameters, containing the type and if the parameter is optional
         """
-        for cnt, _ in enumerate(parameters["type_options"]):
-            parameter_type_options.append(
-                ParameterTypeOptions(
-                    parameter_type=parameters["type_options"][cnt]["type"],
-                    optional=parameters["type_options"][cnt]["optional"],
-                )
-            )
+        return _parse_parameter_type_options(
+            type_options=parameters["type_options"],
+            config_dir=os.path.dirname(os.path.abspath(self.config_path)),
+        )
+
+    def get_default(self):
+        """
+        get the default completion type from the config file
+        :return: the default parameter type, FILE if not specified
+        """
+        if self.config_json.get("default") == "ANY":
+            return ParameterTypes.any
+
+        return ParameterTypes.file
+
+    def get_file_completion_limit(self):
+        """
+        get the maximum amount of completed file paths from the config file
+        :return: the limit, FILE_COMPLETION_LIMIT if not specified
+        """
+        return self.config_json.get("file_completion_limit", FILE_COMPLETION_LIMIT)
+
+    def get_file_completion_timeout(self):
+        """
+        get the time in seconds file paths may be completed for from the config file
+        :return: the timeout, None (no timeout) if not specified
+        """
+        return self.config_json.get("file_completion_timeout")
+
+    def get_latency_budget(self):
+        """
+        get the time in seconds a whole completion may take from the config file
+        :return: the latency budget, None (no budget, all parts completed one after another) if not specified
+        """
+        return self.config_json.get("latency_budget")
+
+    def get_fuzzy_matching(self):
+        """
+        get if started words are completed with fuzzy matches from the config file
+        :return: True if fuzzy matching is enabled, False if not specified
+        """
+        return self.config_json.get("fuzzy_matching", False)
+
+    def get_fuzzy_matching_limit(self):
+        """
+        get the maximum amount of completed fuzzy matches from the config file
+        :return: the limit, FUZZY_MATCHING_LIMIT if not specified
+        """
+        return self.config_json.get("fuzzy_matching_limit", FUZZY_MATCHING_LIMIT)
+
+    def get_ignore_case(self):
+        """
+        get if typed words are matched ignoring case from the config file
+        :return: True if case is ignored, False if not specified
+        """
+        return self.config_json.get("ignore_case", False)
+
+    def get_abbreviations(self):
+        """
+        get if unambiguous prefixes of long forms stand for the long forms from the config file
+        :return: True if abbreviations are resolved, False if not specified
+        """
+        return self.config_json.get("abbreviations", False)
 
-        return parameter_type_options
+    def get_usage_ranking(self):
+        """
+        get if completions are ranked by how often and how recently they were used from the config file
+        :return: True if completions are ranked, False if not specified
+        """
+        return self.config_json.get("usage_ranking", False)
 
     def get_commands(self):
         """
-        get commands form the config file
+        get commands form the config file, the commands only get built on the first call - the shards of sharded
+        commands are not read
         :return: a list of all commands
         """
-        with open(self.config_path) as config:
-            config_json = json.loads(config.read())
-            if "default" in config_json:
-                if config_json["default"] == "FILE":
-                    self.default = ParameterTypes.file
-                elif config_json["default"] == "ANY":
-                    self.default = ParameterTypes.any
-            else:
-                self.default = ParameterTypes.file
-
+        if "command_rules" not in self._sections:
             command_list = []
-            if "command_rules" in config_json:
-                command_rules = config_json["command_rules"]
-
-                for command in command_rules:
-                    parameter_type_options = self._get_parameter_type_options(
-                        parameters=command_rules[command]["parameters"]
-                    )
+            command_rules = self.config_json.get("command_rules", {})
 
+            config_dir = os.path.dirname(os.path.abspath(self.config_path))
+            # subcommands are kept as they are in the configuration and only built once they are typed
+            for command, command_rule in command_rules.items():
+                # a path instead of a rule points to a shard file holding the rule, relative to the configuration
+                if isinstance(command_rule, str):
                     command_list.append(
-                        Command(
-                            options=command_rules[command]["options"],
+                        ShardedCommand(
                             name=command,
-                            param_min_amnt=command_rules[command]["parameters"][
-                                "min_amnt"
-                            ],
-                            param_max_amnt=command_rules[command]["parameters"][
-                                "max_amnt"
-                            ],
-                            parameter_type_options=parameter_type_options,
+                            shard_path=os.path.join(config_dir, command_rule),
                         )
                     )
+                    continue
+
+                command_list.append(
+                    _build_command(
+                        name=command,
+                        command_rule=command_rule,
+                        config_dir=config_dir,
+                    )
+                )
 
-            return command_list
+            self._sections["command_rules"] = command_list
+
+        return self._sections["command_rules"]
 
     def get_options(
         self,
         option_type,
     ):
         """
-        get options form the config file
+        get options form the config file, the options of each option_type only get built on the first call
         :param option_type:
             command_option_rules for options following a command
             global_option_rules for gloabl options
         :return: a list of all options of that option_type, no duplicates
         """
-        with open(self.config_path) as config:
-            config_json = json.loads(config.read())
+        if option_type not in self._sections:
             command_option_list = []
-            if option_type in config_json:
-                command_option_rules = config_json[option_type]
+            command_option_rules = self.config_json.get(option_type, {})
 
-                for option in command_option_rules:
-                    parameter_type_options = self._get_parameter_type_options(
-                        parameters=command_option_rules[option]["parameters"]
+            for option, option_rule in command_option_rules.items():
+                parameters = option_rule["parameters"]
+                command_option_list.append(
+                    Option(
+                        name=option,
+                        long=option_rule.get("long", ""),
+                        param_min_amnt=parameters["min_amnt"],
+                        param_max_amnt=parameters["max_amnt"],
+                        parameter_type_options=self._get_parameter_type_options(
+                            parameters=parameters
+                        ),
+                        global_option=(option_type == "global_option_rules"),
                     )
+                )
 
-                    long = ""
-                    if "long" in command_option_rules[option]:
-                        long = command_option_rules[option]["long"]
-
-                    command_option_list.append(
-                        Option(
-                            name=option,
-                            long=long,
-                            param_min_amnt=command_option_rules[option]["parameters"][
-                                "min_amnt"
-                            ],
-                            param_max_amnt=command_option_rules[option]["parameters"][
-                                "max_amnt"
-                            ],
-                            parameter_type_options=parameter_type_options,
-                            global_option=(option_type == "global_option_rules"),
-                        )
-                    )
+            self._sections[option_type] = command_option_list
 
-            return command_option_list
+        return self._sections[option_type]
 
-    def complete_file_path(
+
+class PrefixIndex:
+    def __init__(
         self,
-        current_word: str | None,
+        entries,
     ):
         """
-        completes a file path
-        :param current_word: 
-        :return: 
+        sorted array of keys, all values whose key starts with a prefix are found with a binary search
+        :param entries: iterable of (key, value) tuples, keys may appear more than once
         """
-        file_list = []
-
-        for path in os.scandir(current_word):
-            file_list.append(path.name)
+        # sorting is stable, values of equal keys keep the order they were passed in
+        sorted_entries = sorted(entries, key=lambda entry: entry[0])
+        self.keys = tuple(key for key, _ in sorted_entries)
+        self.values = tuple(value for _, value in sorted_entries)
 
-        return file_list
+    def __len__(self):
+        return len(self.keys)
 
-    def complete_current(
+    def find(
         self,
-        current_word,
-        input,
+        prefix: str,
     ):
         """
-        completes an input, that has already been started to be typed, if the command/option is already complete it will
-        not be returned - instead the option or command will be returned. does not take into consideration already typed
-        commands/options/parameters, so if a command gets typed before and the option would not be valid it will still
-        be completed
-        :param current_word: the started word
-        :return: a list of possible completions (strings, last command, last global option, last option) of the current
-            word and a bool if the current word is an exact match
+        :param prefix: the prefix keys have to start with
+        :return: a generator of the values of all keys starting with the prefix, ordered by key
         """
-        if current_word is None:
-            return [], False
+        position = bisect.bisect_left(self.keys, prefix)
+        while position < len(self.keys) and self.keys[position].startswith(prefix):
+            yield self.values[position]
+            position += 1
 
-        completion = []
-        exact_match = False
-        for command in self.commands:
-            if command.name == current_word:
-                exact_match = True
-            if command.name.startswith(current_word) and command.name not in input:
-                completion.append(command.name)
 
-        for option in self.options:
-            if option.name == current_word or option.long == current_word:
-                exact_match = True
-            if option.name.startswith(current_word):
-                completion.append(option.name)
-            if option.long.startswith(current_word):
-                completion.append(option.long)
+def _get_character_mask(
+    word: str,
+):
+    """
+    :return: a 64 bit mask of the (case folded) characters of the word, characters can share a bit
+    """
+    mask = 0
+    for character in word.lower():
+        mask |= 1 << (ord(character) % 64)
+    return mask
 
-        for option in self.global_options:
-            if option.name == current_word or option.long == current_word:
-                exact_match = True
-            if option.name.startswith(current_word) and option.name not in input:
-                completion.append(option.name)
-            if option.long.startswith(current_word) and option.long not in input:
-                completion.append(option.long)
 
-        return completion, exact_match
+def _score_fuzzy_match(
+    query: str,
+    candidate: str,
+):
+    """
+    scores the query as a case insensitive subsequence of the candidate, e.g. gopt1 matches --global_option_1
+    characters score more if they follow the previous match or start a part of the candidate (after - or _), skipped
+    characters score less and a candidate starting with the query scores most
+    :param query: the started word
+    :param candidate: a name or long form
+    :return: the score, higher is better - None if the query is no subsequence of the candidate
+    """
+    lowered_query = query.lower()
+    lowered = candidate.lower()
+    score = 0
+    position = 0
+    for character in lowered_query:
+        found = lowered.find(character, position)
+        if found == -1:
+            return None
 
-    def get_last_command_global_option(
+        score += 1
+        if found == position and position > 0:
+            score += 3
+        else:
+            score -= min(found - position, 3)
+        if found == 0 or not lowered[found - 1].isalnum():
+            score += 2
+        position = found + 1
+
+    if lowered.startswith(lowered_query):
+        score += 10
+
+    return score
+
+
+def _rank_fuzzy_matches(
+    query: str,
+    candidates,
+    limit: int,
+):
+    """
+    :param query: the started word
+    :param candidates: iterable of (word, value) tuples, the value orders matches of the same score
+    :param limit: maximum amount of returned matches
+    :return: the values of the best matching candidates, best first
+    """
+    scored = []
+    for word, value in candidates:
+        score = _score_fuzzy_match(query, word)
+        if score is not None:
+            scored.append((-score, value))
+
+    return [value for _, value in heapq.nsmallest(limit, scored)]
+
+
+class FuzzyIndex:
+    def __init__(
         self,
-        current_input,
+        entries,
     ):
         """
-        gets last command, option or global option - whichever appears later in input and all following input
-        :param current_input: parameters passed by command line script, those are the entered words in order by the user
-        :return: either command or option (as a tuple - COMMAND, OPTION) - max one will be not none
+        candidates for fuzzy matching grouped by the mask of their characters (see _get_character_mask), a query is only
+        scored against the groups whose mask contains all characters of the query
+        :param entries: iterable of (word, value) tuples
         """
-        for word in reversed(current_input):
-            command = next(
-                (command for command in self.commands if command.name == word),
-                None,
-            )
-            if command is not None:
-                return command, None
+        groups = {}
+        for word, value in entries:
+            groups.setdefault(_get_character_mask(word), []).append((word, value))
+        self.masks = tuple(groups)
+        self.groups = tuple(tuple(group) for group in groups.values())
 
-            global_option = next(
-                (
-                    option
-                    for option in self.global_options
-                    if option.name == word or option.long == word
-                ),
-                None,
-            )
-            if global_option is not None:
-                return None, global_option
+    def find(
+        self,
+        query: str,
+        limit: int,
+    ):
+        """
+        :param query: the started word
+        :param limit: maximum amount of returned matches
+        :return: the values of the best matching words, best first
+        """
+        query_mask = _get_character_mask(query)
+        return _rank_fuzzy_matches(
+            query=query,
+            candidates=(
+                entry
+                for mask, group in zip(self.masks, self.groups)
+                if query_mask & ~mask == 0
+                for entry in group
+            ),
+            limit=limit,
+        )
 
-            option = next(
-                (
-                    option
-                    for option in self.options
-                    if option.name == word or option.long == word
-                ),
-                None,
+
+class TransitionTable:
+    # state before any command/option has been typed
+    START = 0
+
+    def __init__(
+        self,
+        commands: list[Command],
+        options: list[Option],
+        global_options: list[Option],
+    ):
+        """
+        the rules compiled into a flat table of states, one state per command/option (and the start state), so that
+        completing what can follow a typed command/option is a lookup instead of walking the rules
+        for every state the table holds the rule, the tokens that can follow it (for the start state all commands and
+        global options, for a command its subcommands and options), the types of its parameters and their
+        minimum/maximum amount
+        :param commands: all commands
+        :param options: all command options
+        :param global_options: all global options
+        """
+        self.rules = [None]
+        self.next_tokens = [
+            tuple(option.name for option in global_options) + tuple(command.name for command in commands)
+        ]
+        self.parameter_types = [()]
+        self.min_amnt = [0]
+        self.max_amnt = [0]
+        # id of the rule -> state, names can belong to more than one rule but every rule has its own state
+        self.state_by_rule = {}
+
+        # name/long form -> state, if a word belongs to more than one rule the first rule wins
+        self.command_states = {}
+        self.option_states = {}
+        self.global_option_states = {}
+        for rules, states in [
+            (commands, self.command_states),
+            (options, self.option_states),
+            (global_options, self.global_option_states),
+        ]:
+            for rule in rules:
+                state = self._add_state(rule)
+                states.setdefault(rule.name, state)
+                # an empty long form means the option has none
+                if getattr(rule, "long", None):
+                    states.setdefault(rule.long, state)
+
+        # typed word -> state it leads to, commands take precedence over global options and those over options
+        self.state_by_word = {
+            **self.option_states,
+            **self.global_option_states,
+            **self.command_states,
+        }
+
+        self.rules = tuple(self.rules)
+        self.next_tokens = tuple(self.next_tokens)
+        self.parameter_types = tuple(self.parameter_types)
+        self.min_amnt = tuple(self.min_amnt)
+        self.max_amnt = tuple(self.max_amnt)
+
+    def _add_state(
+        self,
+        rule: CommandOptionBase,
+    ):
+        self.state_by_rule[id(rule)] = len(self.rules)
+        self.rules.append(rule)
+        if isinstance(rule, ShardedCommand):
+            # the shard is not read for compiling, the rule is looked at once the command is typed
+            self.next_tokens.append(())
+            self.parameter_types.append(())
+            self.min_amnt.append(0)
+            self.max_amnt.append(0)
+            return len(self.rules) - 1
+
+        if isinstance(rule, Command):
+            self.next_tokens.append(rule.subcommand_names + tuple(rule.options))
+        else:
+            self.next_tokens.append(())
+        self.parameter_types.append(
+            tuple(parameter_type_option.parameter_type for parameter_type_option in rule.parameter_type_options)
+        )
+        self.min_amnt.append(rule.param_min_amnt)
+        self.max_amnt.append(rule.param_max_amnt)
+        return len(self.rules) - 1
+
+    def __len__(self):
+        return len(self.rules)
+
+    def get_state(
+        self,
+        rule: CommandOptionBase,
+    ):
+        """
+        :param rule: a command, option or global option of the compiled rules
+        :return: the state of the rule, None for subcommands and sharded commands - they are built lazily and their
+            states hold nothing but the rule
+        """
+        if isinstance(rule, Command) and (len(rule.path) > 1 or isinstance(rule, ShardedCommand)):
+            return None
+        return self.state_by_rule[id(rule)]
+
+
+class RuleSet:
+    def __init__(
+        self,
+        default: ParameterTypes,
+        commands: list[Command],
+        options: list[Option],
+        global_options: list[Option],
+        file_completion_limit: int = FILE_COMPLETION_LIMIT,
+        file_completion_timeout: float | None = None,
+        latency_budget: float | None = None,
+        fuzzy_matching: bool = False,
+        fuzzy_matching_limit: int = FUZZY_MATCHING_LIMIT,
+        ignore_case: bool = False,
+        abbreviations: bool = False,
+        usage_ranking: bool = False,
+        fingerprint: str | None = None,
+    ):
+        """
+        all rules of one configuration file, fully built - this is what gets written to the rule index
+        a rule set can not be changed once it is built, so one rule set can be shared by any amount of completions
+        running at the same time (threads, asyncio tasks), the state of a single completion is kept by AutoCompletion
+        :param default: the default completion type
+        :param commands: all commands
+        :param options: all command options
+        :param global_options: all global options
+        :param file_completion_limit: maximum amount of completed file paths
+        :param file_completion_timeout: time in seconds file paths may be completed for, None for no timeout
+        :param latency_budget: time in seconds a whole completion may take, None for no budget
+        :param fuzzy_matching: if started words are completed with fuzzy matches instead of the words they start
+        :param fuzzy_matching_limit: maximum amount of completed fuzzy matches
+        :param ignore_case: if typed words are matched ignoring case
+        :param abbreviations: if unambiguous prefixes of long forms stand for the long forms, like getopt_long does
+        :param usage_ranking: if completions are ranked by their use, see UsageHistory
+        :param fingerprint: identifies the configuration the rules were built from, completions are only kept in a
+            ResultCache for rules with a fingerprint
+        """
+        self.default = default
+        self.file_completion_limit = file_completion_limit
+        self.file_completion_timeout = file_completion_timeout
+        self.latency_budget = latency_budget
+        self.fuzzy_matching = fuzzy_matching
+        self.fuzzy_matching_limit = fuzzy_matching_limit
+        self.ignore_case = ignore_case
+        self.abbreviations = abbreviations
+        self.usage_ranking = usage_ranking
+        self.fingerprint = fingerprint
+        self.commands = tuple(commands)
+        self.options = tuple(options)
+        self.global_options = tuple(global_options)
+
+        # the indexes below are built the first time they are used, building them takes longer than loading the rules
+        self._frozen = True
+
+    def _get_completion_entries(self):
+        """
+        :return: every name and long form with whether it is left out once it has been typed (commands and global
+            options), in the order the rules are iterated in
+        """
+        completion_entries = []
+        for command in self.commands:
+            completion_entries.append((command.name, True))
+        # an empty long form means the option has none, it must not match an empty word
+        for option in self.options:
+            completion_entries.append((option.name, False))
+            if option.long:
+                completion_entries.append((option.long, False))
+        for option in self.global_options:
+            completion_entries.append((option.name, True))
+            if option.long:
+                completion_entries.append((option.long, True))
+
+        return completion_entries
+
+    @functools.cached_property
+    def completion_index(self):
+        """
+        index for completing started words: every name and long form with its position in the order the rules are
+        iterated in, if case is ignored the words are found by their case folded form (see get_key)
+        """
+        return PrefixIndex(
+            (self.get_key(word), (position, word, skip_typed))
+            for position, (word, skip_typed) in enumerate(self._get_completion_entries())
+        )
+
+    @functools.cached_property
+    def exact_words(self):
+        return frozenset(self.completion_index.keys)
+
+    @functools.cached_property
+    def fuzzy_index(self):
+        """
+        the same entries as the completion index, None if fuzzy matching is not enabled
+        """
+        if not self.fuzzy_matching:
+            return None
+
+        return FuzzyIndex(
+            (word, (position, word, skip_typed))
+            for position, (word, skip_typed) in enumerate(self._get_completion_entries())
+        )
+
+    @functools.cached_property
+    def command_by_word(self):
+        """
+        lookup of typed words, if a word belongs to more than one rule the first rule wins
+        """
+        command_by_word = {}
+        for command in self.commands:
+            command_by_word.setdefault(command.name, command)
+        return command_by_word
+
+    @functools.cached_property
+    def option_by_word(self):
+        return self._get_option_by_word(self.options)
+
+    @functools.cached_property
+    def global_option_by_word(self):
+        return self._get_option_by_word(self.global_options)
+
+    @functools.cached_property
+    def transitions(self):
+        return TransitionTable(
+            commands=self.commands,
+            options=self.options,
+            global_options=self.global_options,
+        )
+
+    def __setattr__(self, name, value):
+        if getattr(self, "_frozen", False):
+            raise AttributeError(f"rule set can not be changed, {name} is read only")
+        super().__setattr__(name, value)
+
+    def get_key(
+        self,
+        word: str,
+    ):
+        """
+        :param word: a typed word
+        :return: the form the word is looked up by in completion_index and exact_words
+        """
+        return word.casefold() if self.ignore_case else word
+
+    def resolve_word(
+        self,
+        word: str,
+        abbreviations: bool = True,
+    ):
+        """
+        finds the name/long form a typed word stands for - the word typed in another case if case is ignored, or the
+        only long form the word is a prefix of if abbreviations are resolved (--glob for --global_option_1)
+        both are looked up in completion_index, the lookup stops as soon as a second long form starts with the word
+        :param word: a typed word
+        :param abbreviations: if False only the case of the word is ignored
+        :return: the name/long form as in the configuration, None if the word stands for none
+        """
+        if not self.ignore_case and not (abbreviations and self.abbreviations):
+            # a plain lookup, the completion index is only built once a started word is completed
+            return word if word in self.transitions.state_by_word else None
+
+        key = self.get_key(word)
+
+        resolved = None
+        for _, candidate, _ in self.completion_index.find(key):
+            # the index is sorted, the word itself comes before all longer words it is a prefix of
+            if self.get_key(candidate) == key:
+                return candidate
+            if not (abbreviations and self.abbreviations and key.startswith("--") and len(key) > 2):
+                return None
+            if resolved is not None and candidate != resolved:
+                return None
+            resolved = candidate
+
+        return resolved
+
+    def get_subcommand(
+        self,
+        command: Command,
+        word: str,
+    ):
+        """
+        :param command: the active command
+        :param word: a typed word
+        :return: the subcommand of the command the word stands for - the word typed in another case if case is ignored,
+            None if the word stands for none
+        """
+        subcommand = command.get_subcommand(word)
+        if subcommand is None and self.ignore_case:
+            key = self.get_key(word)
+            for name in command.subcommand_names:
+                if self.get_key(name) == key:
+                    return command.get_subcommand(name)
+
+        return subcommand
+
+    @staticmethod
+    def _get_option_by_word(
+        options: list[Option],
+    ):
+        option_by_word = {}
+        for option in options:
+            option_by_word.setdefault(option.name, option)
+            if option.long:
+                option_by_word.setdefault(option.long, option)
+
+        return option_by_word
+
+    @classmethod
+    def from_config_loader(
+        cls,
+        config_loader: ConfigLoader,
+    ):
+        """
+        builds a rule set from a configuration file
+        :param config_loader: loader of the configuration file
+        :return: the rule set containing all sections of the configuration
+        """
+        return cls(
+            default=config_loader.get_default(),
+            commands=config_loader.get_commands(),
+            options=config_loader.get_options(option_type="command_option_rules"),
+            global_options=config_loader.get_options(option_type="global_option_rules"),
+            file_completion_limit=config_loader.get_file_completion_limit(),
+            file_completion_timeout=config_loader.get_file_completion_timeout(),
+            latency_budget=config_loader.get_latency_budget(),
+            fuzzy_matching=config_loader.get_fuzzy_matching(),
+            fuzzy_matching_limit=config_loader.get_fuzzy_matching_limit(),
+            ignore_case=config_loader.get_ignore_case(),
+            abbreviations=config_loader.get_abbreviations(),
+            usage_ranking=config_loader.get_usage_ranking(),
+            # relative paths (shards, value files) depend on where the configuration is, not only on its content
+            fingerprint=hashlib.sha256(
+                os.path.abspath(config_loader.config_path).encode() + b"\0" + config_loader.content
+            ).hexdigest(),
+        )
+
+
+def get_cache_dir():
+    """
+    :return: the directory compiled configurations are cached in - $XDG_CACHE_HOME/autocompletion or
+        ~/.cache/autocompletion if XDG_CACHE_HOME is not set
+    """
+    cache_home = os.environ.get("XDG_CACHE_HOME") or os.path.join(
+        os.path.expanduser("~"), ".cache"
+    )
+    return os.path.join(cache_home, "autocompletion")
+
+
+def _get_cache_path(
+    config_path: str,
+    cache_dir: str | None,
+    suffix: str = "index",
+):
+    """
+    :return: the path of the cache file of a configuration file, one cache file per absolute configuration path
+    """
+    if cache_dir is None:
+        cache_dir = get_cache_dir()
+
+    config_key = hashlib.sha256(os.path.abspath(config_path).encode()).hexdigest()
+    return os.path.join(cache_dir, f"{config_key}.{suffix}")
+
+
+def _write_atomic(
+    path: str,
+    *objects,
+):
+    """
+    pickles objects into a file, see _write_bytes_atomic
+    :param path: path of the file to write
+    :param objects: objects pickled one after another into the file
+    """
+    _write_bytes_atomic(
+        path,
+        b"".join(pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL) for obj in objects),
+    )
+
+
+def _write_bytes_atomic(
+    path: str,
+    data: bytes,
+):
+    """
+    writes a file, the file is written to a temporary file in the same directory first and then renamed so that
+    concurrent readers either see the old or the new file but never a half written one
+    :param path: path of the file to write
+    :param data: content of the file
+    """
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as tmp_file:
+            tmp_file.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+def load_rules(
+    config_path: str,
+    use_cache: bool = True,
+    cache_dir: str | None = None,
+):
+    """
+    loads the rule set of a configuration file, if possible from its rule index (see load_rule_index)
+    :param config_path: path to the configuration file
+    :param use_cache: if False the configuration is always parsed and no index is read or written
+    :param cache_dir: directory of the cache, defaults to get_cache_dir()
+    :return: the rule set of the configuration, a MappedRuleSet if it was loaded from the index
+    """
+    if not use_cache:
+        return RuleSet.from_config_loader(config_loader=ConfigLoader(config_path=config_path))
+
+    return load_rule_index(config_path=config_path, cache_dir=cache_dir)
+
+
+# binary rule index, see write_rule_index
+RULE_INDEX_MAGIC = b"ACRI"
+RULE_INDEX_VERSION = 1
+_INDEX_SECTIONS = [
+    "meta",
+    "strings",
+    "states",
+    "next_tokens",
+    "completion",
+    "words",
+    "command_words",
+    "option_words",
+    "global_option_words",
+    "fuzzy_groups",
+    "fuzzy_entries",
+]
+_INDEX_HEADER = struct.Struct("<4sI" + "QQ" * len(_INDEX_SECTIONS))
+# kind, name, long, min_amnt, max_amnt, first next token, amount of next tokens, parameter type options (JSON),
+# subcommand rules (JSON), configuration directory, shard file
+_INDEX_STATE = struct.Struct("<BIIIIiiIIIIIIIIII")
+# string
+_INDEX_STRING = struct.Struct("<II")
+# key (see RuleSet.get_key), word, position, left out once typed
+_INDEX_COMPLETION = struct.Struct("<IIIIIB")
+# string, state
+_INDEX_WORD = struct.Struct("<III")
+# character mask, first entry, amount of entries
+_INDEX_FUZZY_GROUP = struct.Struct("<QII")
+# completion record
+_INDEX_FUZZY_ENTRY = struct.Struct("<I")
+
+_KIND_START = 0
+_KIND_COMMAND = 1
+_KIND_OPTION = 2
+_KIND_GLOBAL_OPTION = 3
+_KIND_SHARDED_COMMAND = 4
+
+
+def _dump_parameter_type_options(
+    parameter_type_options: list[ParameterTypeOptions],
+):
+    """
+    :return: the parameter type options as in the configuration, see _parse_parameter_type_options
+    """
+    type_options = []
+    for parameter_type_option in parameter_type_options:
+        type_option = {
+            "type": parameter_type_option.parameter_type,
+            "optional": parameter_type_option.optional,
+        }
+        if parameter_type_option.provider is not None:
+            type_option["provider"] = vars(parameter_type_option.provider)
+        if isinstance(parameter_type_option.values, ValueList):
+            type_option["values"] = list(parameter_type_option.values.values)
+        elif isinstance(parameter_type_option.values, ValueFile):
+            type_option["values_file"] = parameter_type_option.values.path
+        type_options.append(type_option)
+
+    return json.dumps(type_options)
+
+
+def write_rule_index(
+    rules: RuleSet,
+    path: str,
+    source: dict | None = None,
+):
+    """
+    writes the rules into a binary index that MappedRuleSet can query without loading it
+    the index is made of sections of fixed size records that refer to strings in a string table by offset and length:
+        - states: the states of the transition table, the subcommands of a command are stored as in the configuration
+          and of sharded commands only the shard file
+        - next_tokens: the tokens following the states, each state refers to a range of them
+        - completion: all names and long forms sorted by their UTF-8 bytes, with their position in the rules
+        - words: typed word -> state, sorted - once for all rules and once per kind of rule
+        - fuzzy_groups/fuzzy_entries: the completion records grouped like in FuzzyIndex, only if fuzzy matching is
+          enabled
+    :param rules: the rules to write
+    :param path: path of the index file
+    :param source: stat and hash of the configuration the rules were built from, stored in the index
+    """
+    strings = bytearray()
+    string_offsets = {}
+
+    def add_string(string):
+        encoded = string.encode()
+        if encoded not in string_offsets:
+            string_offsets[encoded] = len(strings)
+            strings.extend(encoded)
+        return string_offsets[encoded], len(encoded)
+
+    transitions = rules.transitions
+    states = bytearray()
+    next_tokens = bytearray()
+    next_token_count = 0
+    for state, rule in enumerate(transitions.rules):
+        subcommand_rules, config_dir, shard_path = {}, "", ""
+        if rule is None:
+            kind, name, long, parameter_type_options = _KIND_START, "", "", []
+        elif isinstance(rule, ShardedCommand):
+            kind, name, long, parameter_type_options = _KIND_SHARDED_COMMAND, rule.name, "", []
+            shard_path = rule.shard_path
+        elif isinstance(rule, Command):
+            kind, name, long, parameter_type_options = _KIND_COMMAND, rule.name, "", rule.parameter_type_options
+            subcommand_rules, config_dir = rule.subcommand_rules, rule.config_dir
+        else:
+            kind = _KIND_GLOBAL_OPTION if rule.global_option else _KIND_OPTION
+            name, long, parameter_type_options = rule.name, rule.long or "", rule.parameter_type_options
+
+        for token in transitions.next_tokens[state]:
+            next_tokens.extend(_INDEX_STRING.pack(*add_string(token)))
+        states.extend(
+            _INDEX_STATE.pack(
+                kind,
+                *add_string(name),
+                *add_string(long),
+                transitions.min_amnt[state],
+                transitions.max_amnt[state],
+                next_token_count,
+                len(transitions.next_tokens[state]),
+                *add_string(_dump_parameter_type_options(parameter_type_options)),
+                *add_string(json.dumps(subcommand_rules)),
+                *add_string(config_dir),
+                *add_string(shard_path),
+            )
+        )
+        next_token_count += len(transitions.next_tokens[state])
+
+    completion = bytearray()
+    fuzzy_groups = {}
+    for record, (key, (position, word, skip_typed)) in enumerate(
+        sorted(
+            zip(rules.completion_index.keys, rules.completion_index.values),
+            key=lambda entry: entry[0].encode(),
+        )
+    ):
+        completion.extend(_INDEX_COMPLETION.pack(*add_string(key), *add_string(word), position, skip_typed))
+        if rules.fuzzy_matching:
+            fuzzy_groups.setdefault(_get_character_mask(word), []).append(record)
+
+    fuzzy_group_records = bytearray()
+    fuzzy_entries = bytearray()
+    fuzzy_entry_count = 0
+    for mask, records in fuzzy_groups.items():
+        fuzzy_group_records.extend(_INDEX_FUZZY_GROUP.pack(mask, fuzzy_entry_count, len(records)))
+        for record in records:
+            fuzzy_entries.extend(_INDEX_FUZZY_ENTRY.pack(record))
+        fuzzy_entry_count += len(records)
+
+    def pack_words(state_by_word):
+        words = bytearray()
+        for word, state in sorted(state_by_word.items(), key=lambda entry: entry[0].encode()):
+            words.extend(_INDEX_WORD.pack(*add_string(word), state))
+        return words
+
+    sections = {
+        "meta": json.dumps(
+            {
+                "default": rules.default,
+                "file_completion_limit": rules.file_completion_limit,
+                "file_completion_timeout": rules.file_completion_timeout,
+                "latency_budget": rules.latency_budget,
+                "fuzzy_matching": rules.fuzzy_matching,
+                "fuzzy_matching_limit": rules.fuzzy_matching_limit,
+                "ignore_case": rules.ignore_case,
+                "abbreviations": rules.abbreviations,
+                "usage_ranking": rules.usage_ranking,
+                "fingerprint": rules.fingerprint,
+                "commands": len(rules.commands),
+                "options": len(rules.options),
+                "global_options": len(rules.global_options),
+                "source": source,
+            }
+        ).encode(),
+        "states": states,
+        "next_tokens": next_tokens,
+        "completion": completion,
+        "words": pack_words(transitions.state_by_word),
+        "command_words": pack_words(transitions.command_states),
+        "option_words": pack_words(transitions.option_states),
+        "global_option_words": pack_words(transitions.global_option_states),
+        "fuzzy_groups": fuzzy_group_records,
+        "fuzzy_entries": fuzzy_entries,
+    }
+    sections["strings"] = strings
+
+    data = bytearray(_INDEX_HEADER.size)
+    section_table = []
+    for name in _INDEX_SECTIONS:
+        section_table.extend([len(data), len(sections[name])])
+        data.extend(sections[name])
+    _INDEX_HEADER.pack_into(data, 0, RULE_INDEX_MAGIC, RULE_INDEX_VERSION, *section_table)
+
+    _write_bytes_atomic(path, bytes(data))
+
+
+class _MappedSequence:
+    def __init__(
+        self,
+        length: int,
+        get_item,
+    ):
+        """
+        read only sequence whose items are read from a rule index when accessed
+        :param length: amount of items
+        :param get_item: function returning the item at a position
+        """
+        self.length = length
+        self.get_item = get_item
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, position):
+        if not 0 <= position < self.length:
+            raise IndexError(position)
+        return self.get_item(position)
+
+    def __iter__(self):
+        return (self.get_item(position) for position in range(self.length))
+
+
+class _MappedWords:
+    def __init__(
+        self,
+        rules,
+        section: str,
+        get_value=None,
+    ):
+        """
+        read only mapping of the words of a section of a rule index, looked up with a binary search
+        :param rules: the MappedRuleSet of the index
+        :param section: the section of _INDEX_WORD records
+        :param get_value: function converting the state of a word to the returned value, the state if not set
+        """
+        self.rules = rules
+        self.offset, length = rules.sections[section]
+        self.length = length // _INDEX_WORD.size
+        self.get_value = get_value
+
+    def _find(self, word):
+        encoded = word.encode()
+        buffer = self.rules.buffer
+        low, high = 0, self.length
+        while low < high:
+            middle = (low + high) // 2
+            string_offset, string_length, state = _INDEX_WORD.unpack_from(
+                buffer, self.offset + middle * _INDEX_WORD.size
+            )
+            string_offset += self.rules.strings_offset
+            found = buffer[string_offset:string_offset + string_length]
+            if found == encoded:
+                return state
+            if found < encoded:
+                low = middle + 1
+            else:
+                high = middle
+        return None
+
+    def get(self, word, default=None):
+        state = self._find(word)
+        if state is None:
+            return default
+        return self.get_value(state) if self.get_value is not None else state
+
+    def __getitem__(self, word):
+        value = self.get(word)
+        if value is None:
+            raise KeyError(word)
+        return value
+
+    def __contains__(self, word):
+        return self._find(word) is not None
+
+
+class _MappedCompletionIndex:
+    def __init__(
+        self,
+        rules,
+    ):
+        """
+        the completion index (see PrefixIndex) of a rule index, also answers if a word is an exact name/long form
+        :param rules: the MappedRuleSet of the index
+        """
+        self.rules = rules
+        self.offset, length = rules.sections["completion"]
+        self.length = length // _INDEX_COMPLETION.size
+
+    def __len__(self):
+        return self.length
+
+    def _get_key(self, position):
+        key_offset, key_length = _INDEX_COMPLETION.unpack_from(
+            self.rules.buffer, self.offset + position * _INDEX_COMPLETION.size
+        )[:2]
+        key_offset += self.rules.strings_offset
+        return self.rules.buffer[key_offset:key_offset + key_length]
+
+    def _get_entry(self, position):
+        """
+        :return: (key, position, word, left out once typed) of an entry
+        """
+        key_offset, key_length, word_offset, word_length, word_position, skip_typed = _INDEX_COMPLETION.unpack_from(
+            self.rules.buffer, self.offset + position * _INDEX_COMPLETION.size
+        )
+        key_offset += self.rules.strings_offset
+        return (
+            self.rules.buffer[key_offset:key_offset + key_length],
+            word_position,
+            self.rules.get_string(word_offset, word_length),
+            bool(skip_typed),
+        )
+
+    def _lower_bound(self, encoded):
+        low, high = 0, self.length
+        while low < high:
+            middle = (low + high) // 2
+            if self._get_key(middle) < encoded:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def find(
+        self,
+        prefix: str,
+    ):
+        """
+        :param prefix: the prefix keys have to start with
+        :return: a generator of (position, word, left out once typed) of all words whose key starts with the prefix
+        """
+        encoded = prefix.encode()
+        position = self._lower_bound(encoded)
+        while position < self.length:
+            key, word_position, word, skip_typed = self._get_entry(position)
+            if not key.startswith(encoded):
+                break
+            yield word_position, word, skip_typed
+            position += 1
+
+    def __contains__(self, key):
+        encoded = key.encode()
+        position = self._lower_bound(encoded)
+        return position < self.length and self._get_key(position) == encoded
+
+
+class _MappedFuzzyIndex:
+    def __init__(
+        self,
+        rules,
+    ):
+        """
+        the fuzzy index (see FuzzyIndex) of a rule index
+        :param rules: the MappedRuleSet of the index
+        """
+        self.rules = rules
+
+    def find(
+        self,
+        query: str,
+        limit: int,
+    ):
+        """
+        :param query: the started word
+        :param limit: maximum amount of returned matches
+        :return: the (position, word, left out once typed) of the best matching words, best first
+        """
+        buffer = self.rules.buffer
+        groups_offset, groups_length = self.rules.sections["fuzzy_groups"]
+        entries_offset = self.rules.sections["fuzzy_entries"][0]
+        completion_index = self.rules.completion_index
+        query_mask = _get_character_mask(query)
+
+        def candidates():
+            for mask, first, count in _INDEX_FUZZY_GROUP.iter_unpack(
+                memoryview(buffer)[groups_offset:groups_offset + groups_length]
+            ):
+                if query_mask & ~mask:
+                    continue
+                for entry in range(first, first + count):
+                    (record,) = _INDEX_FUZZY_ENTRY.unpack_from(buffer, entries_offset + entry * _INDEX_FUZZY_ENTRY.size)
+                    _, position, word, skip_typed = completion_index._get_entry(record)
+                    yield word, (position, word, skip_typed)
+
+        return _rank_fuzzy_matches(query=query, candidates=candidates(), limit=limit)
+
+
+class _MappedTransitionTable:
+    START = TransitionTable.START
+
+    def __init__(
+        self,
+        rules,
+    ):
+        """
+        the transition table (see TransitionTable) of a rule index
+        :param rules: the MappedRuleSet of the index
+        """
+        self.rules = _MappedSequence(rules.state_count, rules.get_rule)
+        self.next_tokens = _MappedSequence(rules.state_count, rules.get_next_tokens)
+        self.parameter_types = _MappedSequence(
+            rules.state_count,
+            lambda state: tuple(
+                parameter_type_option.parameter_type
+                for parameter_type_option in rules.get_parameter_type_options(state)
+            ),
+        )
+        self.min_amnt = _MappedSequence(rules.state_count, lambda state: rules._get_state_record(state)[5])
+        self.max_amnt = _MappedSequence(rules.state_count, lambda state: rules._get_state_record(state)[6])
+        self.state_by_word = _MappedWords(rules, "words")
+        self.command_states = _MappedWords(rules, "command_words")
+        self.option_states = _MappedWords(rules, "option_words")
+        self.global_option_states = _MappedWords(rules, "global_option_words")
+        # rules are built once per state, see MappedRuleSet.get_rule
+        self.state_by_rule = rules.state_by_rule
+
+    def __len__(self):
+        return len(self.rules)
+
+    get_state = TransitionTable.get_state
+
+
+class MappedRuleSet:
+    def __init__(
+        self,
+        buffer,
+    ):
+        """
+        the rules of a rule index (see write_rule_index), queried in place - only the records a completion looks at are
+        read, so loading costs nothing no matter how large the configuration is and all processes mapping the same index
+        share its pages
+        offers the same attributes as RuleSet, so it can be used wherever a RuleSet is
+        :param buffer: the content of the index, usually a memory map
+        :raises ValueError: if the buffer is no rule index of this version
+        """
+        if len(buffer) < _INDEX_HEADER.size:
+            raise ValueError("rule index is truncated")
+        header = _INDEX_HEADER.unpack_from(buffer, 0)
+        if header[0] != RULE_INDEX_MAGIC or header[1] != RULE_INDEX_VERSION:
+            raise ValueError("no rule index of this version")
+
+        self.buffer = buffer
+        self.sections = {
+            name: (header[2 + 2 * i], header[3 + 2 * i])
+            for i, name in enumerate(_INDEX_SECTIONS)
+        }
+        self.strings_offset = self.sections["strings"][0]
+        self.states_offset, states_length = self.sections["states"]
+        self.state_count = states_length // _INDEX_STATE.size
+        self._rule_cache = {}
+        # id of a built rule -> state, see TransitionTable.get_state
+        self.state_by_rule = {}
+
+        offset, length = self.sections["meta"]
+        meta = json.loads(buffer[offset:offset + length])
+        self.source = meta["source"]
+        self.default = ParameterTypes(meta["default"])
+        self.file_completion_limit = meta["file_completion_limit"]
+        self.file_completion_timeout = meta["file_completion_timeout"]
+        self.latency_budget = meta["latency_budget"]
+        self.fuzzy_matching = meta["fuzzy_matching"]
+        self.fuzzy_matching_limit = meta["fuzzy_matching_limit"]
+        self.ignore_case = meta["ignore_case"]
+        self.abbreviations = meta["abbreviations"]
+        self.usage_ranking = meta["usage_ranking"]
+        self.fingerprint = meta["fingerprint"]
+
+        # states are ordered like the rules: start, commands, options, global options
+        first_option = 1 + meta["commands"]
+        first_global_option = first_option + meta["options"]
+        self.commands = _MappedSequence(meta["commands"], lambda position: self.get_rule(1 + position))
+        self.options = _MappedSequence(meta["options"], lambda position: self.get_rule(first_option + position))
+        self.global_options = _MappedSequence(
+            meta["global_options"],
+            lambda position: self.get_rule(first_global_option + position),
+        )
+
+        self.completion_index = _MappedCompletionIndex(self)
+        self.exact_words = self.completion_index
+        self.fuzzy_index = _MappedFuzzyIndex(self) if self.fuzzy_matching else None
+        self.transitions = _MappedTransitionTable(self)
+        self.command_by_word = _MappedWords(self, "command_words", self.get_rule)
+        self.option_by_word = _MappedWords(self, "option_words", self.get_rule)
+        self.global_option_by_word = _MappedWords(self, "global_option_words", self.get_rule)
+
+    get_key = RuleSet.get_key
+    resolve_word = RuleSet.resolve_word
+    get_subcommand = RuleSet.get_subcommand
+
+    @classmethod
+    def open(
+        cls,
+        path: str,
+    ):
+        """
+        :param path: path of the index file
+        :return: the rules of the memory mapped index
+        :raises OSError: if the index can not be read
+        :raises ValueError: if the file is no rule index of this version
+        """
+        with open(path, "rb") as index_file:
+            return cls(mmap.mmap(index_file.fileno(), 0, access=mmap.ACCESS_READ))
+
+    def get_string(
+        self,
+        offset: int,
+        length: int,
+    ):
+        offset += self.strings_offset
+        return self.buffer[offset:offset + length].decode()
+
+    def _get_state_record(
+        self,
+        state: int,
+    ):
+        """
+        :return: the unpacked _INDEX_STATE record of a state
+        """
+        return _INDEX_STATE.unpack_from(self.buffer, self.states_offset + state * _INDEX_STATE.size)
+
+    def get_next_tokens(
+        self,
+        state: int,
+    ):
+        first, count = self._get_state_record(state)[7:9]
+        offset = self.sections["next_tokens"][0] + first * _INDEX_STRING.size
+        return tuple(
+            self.get_string(*_INDEX_STRING.unpack_from(self.buffer, offset + i * _INDEX_STRING.size))
+            for i in range(count)
+        )
+
+    def get_parameter_type_options(
+        self,
+        state: int,
+    ):
+        return _parse_parameter_type_options(
+            type_options=json.loads(self.get_string(*self._get_state_record(state)[9:11])),
+            config_dir="",
+        )
+
+    def get_rule(
+        self,
+        state: int,
+    ):
+        """
+        :return: the command/option of a state, built from the index the first time it is asked for
+        """
+        rule = self._rule_cache.get(state)
+        if rule is not None or state == TransitionTable.START:
+            return rule
+
+        kind, name_offset, name_length, long_offset, long_length, min_amnt, max_amnt = self._get_state_record(state)[:7]
+        if kind == _KIND_SHARDED_COMMAND:
+            rule = ShardedCommand(
+                name=self.get_string(name_offset, name_length),
+                shard_path=self.get_string(*self._get_state_record(state)[15:17]),
+            )
+        elif kind == _KIND_COMMAND:
+            subcommand_rules = json.loads(self.get_string(*self._get_state_record(state)[11:13]))
+            rule = Command(
+                # the next tokens of a command are its subcommands followed by its options
+                options=list(self.get_next_tokens(state)[len(subcommand_rules):]),
+                name=self.get_string(name_offset, name_length),
+                param_min_amnt=min_amnt,
+                param_max_amnt=max_amnt,
+                parameter_type_options=self.get_parameter_type_options(state),
+                subcommand_rules=subcommand_rules,
+                config_dir=self.get_string(*self._get_state_record(state)[13:15]),
+            )
+        else:
+            rule = Option(
+                long=self.get_string(long_offset, long_length),
+                global_option=kind == _KIND_GLOBAL_OPTION,
+                name=self.get_string(name_offset, name_length),
+                param_min_amnt=min_amnt,
+                param_max_amnt=max_amnt,
+                parameter_type_options=self.get_parameter_type_options(state),
+            )
+        self._rule_cache[state] = rule
+        self.state_by_rule[id(rule)] = state
+
+        return rule
+
+
+def compile_rule_index(
+    config_path: str,
+    cache_dir: str | None = None,
+):
+    """
+    builds the rule set of a configuration file and writes it to the rule index
+    :param config_path: path to the configuration file
+    :param cache_dir: directory of the cache, defaults to get_cache_dir()
+    :return: the rules of the written index, the built RuleSet if the index can not be written
+    """
+    config_stat = os.stat(config_path)
+    config_loader = ConfigLoader(config_path=config_path)
+    rules = RuleSet.from_config_loader(config_loader=config_loader)
+    index_path = _get_cache_path(config_path=config_path, cache_dir=cache_dir)
+    try:
+        write_rule_index(
+            rules=rules,
+            path=index_path,
+            source={
+                "mtime_ns": config_stat.st_mtime_ns,
+                "size": config_stat.st_size,
+                "sha256": hashlib.sha256(config_loader.content).hexdigest(),
+            },
+        )
+        return MappedRuleSet.open(index_path)
+    except OSError:
+        # a cache that can not be written only costs time, completion still works
+        return rules
+
+
+def _write_rule_index_source(
+    rules: MappedRuleSet,
+    path: str,
+    source: dict,
+):
+    """
+    writes a rule index again with another source, the sections behind the meta section are moved by the change of its
+    length
+    :param rules: the rules of the index
+    :param path: path of the index file
+    :param source: stat and hash of the configuration, see write_rule_index
+    """
+    meta_offset, meta_length = rules.sections["meta"]
+    meta = json.loads(rules.buffer[meta_offset:meta_offset + meta_length])
+    meta["source"] = source
+    encoded_meta = json.dumps(meta).encode()
+    shift = len(encoded_meta) - meta_length
+
+    data = bytearray(rules.buffer[:meta_offset])
+    data.extend(encoded_meta)
+    data.extend(rules.buffer[meta_offset + meta_length:])
+    section_table = []
+    for name in _INDEX_SECTIONS:
+        offset, length = rules.sections[name]
+        section_table.extend([offset + shift if offset > meta_offset else offset, length])
+    _INDEX_HEADER.pack_into(data, 0, RULE_INDEX_MAGIC, RULE_INDEX_VERSION, *section_table)
+
+    _write_bytes_atomic(path, bytes(data))
+
+
+def load_rule_index(
+    config_path: str,
+    cache_dir: str | None = None,
+):
+    """
+    memory maps the rule index of a configuration file
+    the index is valid if mtime and size of the configuration file did not change, if only the mtime changed the content
+    hash decides - any change of the configuration rebuilds the index
+    :param config_path: path to the configuration file
+    :param cache_dir: directory of the cache, defaults to get_cache_dir()
+    :return: the rules of the index
+    """
+    config_stat = os.stat(config_path)
+    index_path = _get_cache_path(config_path=config_path, cache_dir=cache_dir)
+    try:
+        rules = MappedRuleSet.open(index_path)
+        source = rules.source
+        if source["size"] == config_stat.st_size:
+            if source["mtime_ns"] == config_stat.st_mtime_ns:
+                return rules
+            content = ConfigLoader(config_path=config_path).content
+            if source["sha256"] == hashlib.sha256(content).hexdigest():
+                # content is unchanged but the file was touched, refresh the source so the hash is not needed again
+                try:
+                    _write_rule_index_source(
+                        rules=rules,
+                        path=index_path,
+                        source={**source, "mtime_ns": config_stat.st_mtime_ns},
+                    )
+                except OSError:
+                    pass
+                return rules
+    except (OSError, ValueError, KeyError):
+        # missing, outdated or unreadable index - rebuild it
+        pass
+
+    return compile_rule_index(config_path=config_path, cache_dir=cache_dir)
+
+
+def _scan_directory(
+    directory: str,
+    prefix: str,
+):
+    """
+    reads a directory
+    :param directory: the directory to read
+    :param prefix: only entries starting with the prefix are returned
+    :return: a generator of (name, is directory) of the entries, in the order the directory is read
+    :raises OSError: if the directory does not exist or can not be read
+    """
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if not entry.name.startswith(prefix):
+                continue
+            # the type of an entry is known from reading the directory, no stat needed (except for symlinks)
+            try:
+                is_dir = entry.is_dir()
+            except OSError:
+                is_dir = False
+            yield entry.name, is_dir
+
+
+def _collect_within(
+    iterable,
+    timeout: float,
+):
+    """
+    collects the items of an iterable on a worker thread for at most timeout seconds - a worker that is stuck (e.g. on a
+    hanging network filesystem) is left behind and stops as soon as it gets to the next item
+    :param iterable: the items to collect
+    :param timeout: time in seconds
+    :return: a list of the items collected in time and if all items were collected
+    :raises Exception: the exception of the iterable if it failed in time
+    """
+    items = []
+    errors = []
+    finished = threading.Event()
+    stopped = threading.Event()
+
+    def collect():
+        try:
+            for item in iterable:
+                if stopped.is_set():
+                    return
+                items.append(item)
+        except Exception as e:
+            # handed to the caller, an exception left on the worker thread would only be printed to stderr
+            errors.append(e)
+        finally:
+            finished.set()
+
+    threading.Thread(target=collect, daemon=True).start()
+    if finished.wait(timeout):
+        if errors:
+            raise errors[0]
+        return items, True
+
+    stopped.set()
+    return list(items), False
+
+
+def _iter_within(
+    iterable,
+    timeout: float,
+):
+    """
+    collects the items of an iterable on a worker thread for at most timeout seconds like _collect_within, but passes
+    every item on as soon as it is collected
+    :param iterable: the items to collect
+    :param timeout: time in seconds
+    :return: a generator of the items collected in time, returning the amount of items and if all items were collected
+    """
+    items = queue.Queue()
+    stopped = threading.Event()
+    end = object()
+
+    def collect():
+        try:
+            for item in iterable:
+                if stopped.is_set():
+                    return
+                items.put(item)
+        finally:
+            items.put(end)
+
+    threading.Thread(target=collect, daemon=True).start()
+    deadline = time.monotonic() + timeout
+    count = 0
+    try:
+        while True:
+            try:
+                item = items.get(timeout=max(deadline - time.monotonic(), 0))
+            except queue.Empty:
+                return count, False
+            if item is end:
+                return count, True
+            count += 1
+            yield item
+    finally:
+        # also stops the worker if the items are not needed anymore
+        stopped.set()
+
+
+class CompletionScheduler:
+    def __init__(
+        self,
+        budget: float,
+    ):
+        """
+        runs independent parts of a completion (sources) at the same time, each on its own thread
+        sources that are not done once the budget is used up are dropped, their threads are left behind (daemon threads,
+        so they never keep the process alive)
+        :param budget: time in seconds all sources together may take
+        """
+        self.budget = budget
+
+    def iter_results(
+        self,
+        sources: dict,
+    ):
+        """
+        :param sources: name -> function without arguments returning the result of the source
+        :return: a generator of (name, result) of the sources that are done in time, in the order they are done - it
+            ends once all sources are done or the budget is used up
+        :raises Exception: the exception of a source that failed in time
+        """
+        deadline = time.monotonic() + self.budget
+        done = queue.Queue()
+
+        def run_source(name, source):
+            try:
+                result = source()
+            except Exception as e:
+                done.put((name, None, e))
+                return
+            done.put((name, result, None))
+
+        for name, source in sources.items():
+            threading.Thread(target=run_source, args=(name, source), daemon=True).start()
+
+        for _ in range(len(sources)):
+            try:
+                name, result, error = done.get(timeout=max(deadline - time.monotonic(), 0))
+            except queue.Empty:
+                return
+            if error is not None:
+                raise error
+            yield name, result
+
+    def run(
+        self,
+        sources: dict,
+    ):
+        """
+        :param sources: name -> function without arguments returning the result of the source
+        :return: name -> result of all sources that were done in time and the names of the dropped sources
+        :raises Exception: the exception of a source that failed in time
+        """
+        results = dict(self.iter_results(sources))
+        dropped = [name for name in sources if name not in results]
+        return results, dropped
+
+
+class DirectoryListingCache:
+    def __init__(
+        self,
+        max_directories: int = 64,
+        max_entries: int = 1_000_000,
+        cache_dir: str | None = None,
+        min_persisted_entries: int = 256,
+    ):
+        """
+        cache of directory listings (name and if the entry is a directory), a listing is valid as long as the mtime of
+        the directory did not change - which happens whenever an entry is added, removed or renamed
+        the least recently used listings are dropped once more than max_directories listings or more than max_entries
+        entries in total are cached. the cache can be shared by any amount of threads
+        :param max_directories: maximum amount of cached listings, in memory and on disk
+        :param max_entries: maximum amount of entries of all listings kept in memory
+        :param cache_dir: if set, listings are also written to this directory (one file per listed directory) so they
+            are still cached for completions running in other processes later
+        :param min_persisted_entries: only listings with at least this many entries are written to disk, smaller
+            directories are read faster than a cache file
+        """
+        self.max_directories = max_directories
+        self.max_entries = max_entries
+        self.cache_dir = cache_dir
+        self.min_persisted_entries = min_persisted_entries
+        # absolute directory path -> (mtime, names, is directory for each name, positions of the names sorted by name)
+        self.listings = collections.OrderedDict()
+        self.entry_count = 0
+        self.lock = threading.Lock()
+
+    def iter_entries(
+        self,
+        directory: str,
+        prefix: str,
+    ):
+        """
+        a directory that is not cached is read while the matching entries are passed on, like without the cache - its
+        listing is only cached once it was read to the end, so stopping early (e.g. at the file completion limit) still
+        saves reading the rest of a large directory
+        :param directory: the directory to list
+        :param prefix: only entries starting with the prefix are returned
+        :return: a generator of (name, is directory) of the matching entries, in the order the directory is read - the
+            same whether the listing was cached or not
+        :raises OSError: if the directory does not exist or can not be read
+        """
+        directory = os.path.abspath(directory)
+        mtime = os.stat(directory).st_mtime_ns
+
+        listing = self._get_cached_listing(directory=directory, mtime=mtime)
+        if listing is None:
+            entries = []
+            for name, is_dir in _scan_directory(directory, ""):
+                entries.append((name, is_dir))
+                if name.startswith(prefix):
+                    yield name, is_dir
+            self._cache_listing(directory=directory, mtime=mtime, entries=entries)
+            return
+
+        _, names, is_dirs, by_name = listing
+        matches = []
+        position = bisect.bisect_left(by_name, prefix, key=names.__getitem__)
+        while position < len(by_name) and names[by_name[position]].startswith(prefix):
+            matches.append(by_name[position])
+            position += 1
+        for match in sorted(matches):
+            yield names[match], is_dirs[match]
+
+    def _get_cached_listing(
+        self,
+        directory: str,
+        mtime: int,
+    ):
+        """
+        :return: the cached listing of the directory (see _cache_listing), None if it is not cached for this mtime
+        """
+        with self.lock:
+            listing = self.listings.get(directory)
+            if listing is not None and listing[0] == mtime:
+                self.listings.move_to_end(directory)
+                return listing
+
+        listing = self._load_listing(directory=directory, mtime=mtime)
+        if listing is not None:
+            self._add_listing(directory=directory, listing=listing)
+        return listing
+
+    def _cache_listing(
+        self,
+        directory: str,
+        mtime: int,
+        entries: list,
+    ):
+        """
+        :param entries: (name, is directory) of all entries of the directory, in the order the directory is read
+        """
+        names = tuple(name for name, _ in entries)
+        # the entries keep the order of the directory, the positions sorted by name find the entries of a prefix
+        listing = (
+            mtime,
+            names,
+            tuple(is_dir for _, is_dir in entries),
+            tuple(sorted(range(len(names)), key=names.__getitem__)),
+        )
+        # an entry added within the same timestamp tick as the directory was read would not change the mtime, so a
+        # directory that is still being changed is not cached
+        if time.time_ns() - mtime < 2 * 10**9:
+            return
+
+        self._save_listing(directory=directory, listing=listing)
+        self._add_listing(directory=directory, listing=listing)
+
+    def _add_listing(
+        self,
+        directory: str,
+        listing: tuple,
+    ):
+        if len(listing[1]) > self.max_entries:
+            return
+
+        with self.lock:
+            previous = self.listings.pop(directory, None)
+            if previous is not None:
+                self.entry_count -= len(previous[1])
+            self.listings[directory] = listing
+            self.entry_count += len(listing[1])
+
+            while len(self.listings) > self.max_directories or self.entry_count > self.max_entries:
+                _, evicted = self.listings.popitem(last=False)
+                self.entry_count -= len(evicted[1])
+
+    def _get_listing_path(
+        self,
+        directory: str,
+    ):
+        return os.path.join(self.cache_dir, hashlib.sha256(directory.encode()).hexdigest())
+
+    def _load_listing(
+        self,
+        directory: str,
+        mtime: int,
+    ):
+        if self.cache_dir is None:
+            return None
+
+        listing_path = self._get_listing_path(directory)
+        try:
+            with open(listing_path, "rb") as listing_file:
+                listing = pickle.load(listing_file)
+            if listing[0] != mtime:
+                return None
+            # the mtime of the cache file marks when it was used last, for dropping the least recently used ones
+            os.utime(listing_path)
+        except Exception:
+            return None
+
+        return listing
+
+    def _save_listing(
+        self,
+        directory: str,
+        listing: tuple,
+    ):
+        if self.cache_dir is None or not (self.min_persisted_entries <= len(listing[1]) <= self.max_entries):
+            return
+
+        try:
+            _write_atomic(self._get_listing_path(directory), listing)
+            _prune_cache_dir(cache_dir=self.cache_dir, max_files=self.max_directories)
+        except OSError:
+            # a listing that can not be written or removed only costs time, completion still works
+            pass
+
+
+class ProviderCache:
+    def __init__(
+        self,
+        max_entries: int = 256,
+        cache_dir: str | None = None,
+    ):
+        """
+        cache of the values of DYNAMIC parameter providers, values are kept for the ttl of their provider and the least
+        recently used ones are dropped once more than max_entries are cached. the cache can be shared by any amount of
+        threads
+        :param max_entries: maximum amount of cached provider values, in memory and on disk
+        :param cache_dir: if set, values are also written to this directory (one file per provider and working
+            directory) so they are still cached for completions running in other processes later
+        """
+        self.max_entries = max_entries
+        self.cache_dir = cache_dir
+        # (provider key, working directory) -> (expiry time, values)
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def get_values(
+        self,
+        provider: Provider,
+        cwd: str | None,
+    ):
+        """
+        :param provider: the provider of the values
+        :param cwd: working directory of the completion
+        :return: a list of the provided values, the provider is only run if its values are not cached - None if the
+            provider failed or did not finish in time, which is not cached so the provider is run again next time
+        """
+        cwd = os.path.abspath(cwd or ".")
+        key = (provider.key, cwd)
+        now = time.time()
+
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] > now:
+                self.entries.move_to_end(key)
+                return entry[1]
+
+        entry = self._load_entry(key=key, now=now)
+        if entry is None:
+            values = provider.get_values(cwd)
+            if values is None:
+                return None
+            entry = (now + provider.ttl, values)
+            self._save_entry(key=key, entry=entry)
+
+        with self.lock:
+            self.entries[key] = entry
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+        return entry[1]
+
+    def _get_entry_path(
+        self,
+        key: tuple,
+    ):
+        return os.path.join(self.cache_dir, hashlib.sha256(json.dumps(key).encode()).hexdigest())
+
+    def _load_entry(
+        self,
+        key: tuple,
+        now: float,
+    ):
+        if self.cache_dir is None:
+            return None
+
+        entry_path = self._get_entry_path(key)
+        try:
+            with open(entry_path, "rb") as entry_file:
+                entry = pickle.load(entry_file)
+            if entry[0] <= now:
+                os.unlink(entry_path)
+                return None
+            # the mtime of the cache file marks when it was used last, for dropping the least recently used ones
+            os.utime(entry_path)
+        except Exception:
+            return None
+
+        return entry
+
+    def _save_entry(
+        self,
+        key: tuple,
+        entry: tuple,
+    ):
+        if self.cache_dir is None:
+            return
+
+        try:
+            _write_atomic(self._get_entry_path(key), entry)
+            _prune_cache_dir(cache_dir=self.cache_dir, max_files=self.max_entries)
+        except OSError:
+            pass
+
+
+def _prune_cache_dir(
+    cache_dir: str,
+    max_files: int,
+):
+    """
+    removes the least recently used files (oldest mtime) of a cache directory, until at most max_files are left
+    """
+    cache_files = os.listdir(cache_dir)
+    if len(cache_files) <= max_files:
+        return
+
+    cache_paths = [os.path.join(cache_dir, cache_file) for cache_file in cache_files]
+    cache_paths.sort(key=lambda cache_path: os.stat(cache_path).st_mtime_ns)
+    for cache_path in cache_paths[: len(cache_paths) - max_files]:
+        os.unlink(cache_path)
+
+
+class ResultCache:
+    def __init__(
+        self,
+        max_entries: int = RESULT_CACHE_SIZE,
+        path: str | None = None,
+    ):
+        """
+        cache of the completions of commands/options (started word, next after the last command/option, unused commands
+        and global options) - they only depend on the rules and the typed words, file paths and the values of DYNAMIC
+        and ENUM parameters are never cached. entries are keyed by the fingerprint of the rules, so completions of a
+        changed configuration never hit entries of the old one. the least recently used entries are dropped once more
+        than max_entries are cached. the cache can be shared by any amount of threads
+        :param max_entries: maximum amount of cached completions
+        :param path: if set, the cache is loaded from this file and written to it by save()
+        """
+        self.max_entries = max_entries
+        self.path = path
+        # (fingerprint, typed words) -> source name -> completed words
+        self.entries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        if path is not None:
+            self._load()
+
+    def get(
+        self,
+        fingerprint: str,
+        args: tuple,
+    ):
+        """
+        :param fingerprint: fingerprint of the rules
+        :param args: the typed words
+        :return: the cached completion of every source by source name, None if not cached
+        """
+        with self.lock:
+            results = self.entries.get((fingerprint, args))
+            if results is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.entries.move_to_end((fingerprint, args))
+            return results
+
+    def put(
+        self,
+        fingerprint: str,
+        args: tuple,
+        results: dict,
+    ):
+        """
+        :param fingerprint: fingerprint of the rules
+        :param args: the typed words
+        :param results: the completion of every source by source name
+        """
+        with self.lock:
+            self.entries[fingerprint, args] = {name: tuple(completion) for name, completion in results.items()}
+            self.entries.move_to_end((fingerprint, args))
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def invalidate(
+        self,
+        fingerprint: str,
+    ):
+        """
+        drops all completions of a configuration, e.g. once it changed
+        :param fingerprint: fingerprint of the rules of the configuration
+        """
+        with self.lock:
+            for key in [key for key in self.entries if key[0] == fingerprint]:
+                del self.entries[key]
+
+    def save(self):
+        """
+        writes the cache to its path
+        """
+        with self.lock:
+            entries = list(self.entries.items())
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        _write_atomic(self.path, CACHE_FORMAT_VERSION, entries)
+
+    def _load(self):
+        try:
+            with open(self.path, "rb") as cache_file:
+                if pickle.load(cache_file) != CACHE_FORMAT_VERSION:
+                    return
+                entries = pickle.load(cache_file)
+        except Exception:
+            return
+
+        self.entries.update(entries[-self.max_entries:])
+
+
+# history path -> (key of the snapshot and log files, scores) of the usage histories read by this process
+_usage_scores = {}
+_usage_scores_lock = threading.Lock()
+
+
+class UsageHistory:
+    def __init__(
+        self,
+        path: str,
+        half_life: float = USAGE_HALF_LIFE,
+        compact_size: int = USAGE_COMPACT_SIZE,
+    ):
+        """
+        how often and how recently commands/options were used, kept on disk in two files:
+            - path.log: one line per use ("time\tname"), only ever appended to - every use is written with a single
+              append, so shells recording at the same time do not mix up their lines
+            - path.snapshot: the decayed score of every name at the time of the last compaction
+        every use scores 1 and counts half after every half_life. once the log is larger than compact_size it is added
+        to the snapshot and started anew, so reading the history only reads the small snapshot and a short log
+        :param path: path of the history files, without suffix
+        :param half_life: time in seconds after which a use counts half
+        :param compact_size: size in bytes the log may grow to before it is compacted
+        """
+        self.path = path
+        self.half_life = half_life
+        self.compact_size = compact_size
+        self.log_path = f"{path}.log"
+        self.snapshot_path = f"{path}.snapshot"
+        self.lock_path = f"{path}.lock"
+
+    def record(
+        self,
+        names: list[str],
+        now: float | None = None,
+    ):
+        """
+        records a use of each name
+        :param names: names of the used commands/options
+        :param now: time of the use, defaults to the current time
+        """
+        now = time.time() if now is None else now
+        # names containing a separator would break the log, they are not recorded
+        data = "".join(f"{now:.3f}\t{name}\n" for name in names if "\t" not in name and "\n" not in name).encode()
+        if not data:
+            return
+
+        os.makedirs(os.path.dirname(self.log_path), exist_ok=True)
+        # any amount of processes may append at the same time, but not while the log is moved away for compacting -
+        # a use appended to the moved log after it was read would get lost
+        with open(self.lock_path, "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_SH)
+            fd = os.open(self.log_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+            try:
+                os.write(fd, data)
+                size = os.fstat(fd).st_size
+            finally:
+                os.close(fd)
+
+        if size > self.compact_size:
+            try:
+                self.compact(now=now)
+            except (OSError, pickle.PickleError):
+                # the use is recorded in the log, recording must never fail the hook of the shell - a log left behind
+                # is added by the next compaction
+                pass
+
+    def get_scores(self):
+        """
+        the scores are kept by this process as long as the snapshot and the log do not change, so a daemon only reads
+        the history again after a use was recorded
+        :return: the score of every used name (relative to each other, names that were not used have none) - shared
+            by all callers, it must not be changed
+        """
+        # taken before reading, a use recorded while reading changes the key and the history is read again next time
+        files_key = (self._get_file_key(self.snapshot_path), self._get_file_key(self.log_path))
+        with _usage_scores_lock:
+            cached = _usage_scores.get(self.path)
+        if cached is not None and cached[0] == files_key:
+            return cached[1]
+
+        reference, scores = self._load_snapshot()
+        self._add_log(
+            scores=scores,
+            reference=reference,
+            log_path=self.log_path,
+        )
+        with _usage_scores_lock:
+            _usage_scores[self.path] = (files_key, scores)
+        return scores
+
+    @staticmethod
+    def _get_file_key(
+        path: str,
+    ):
+        """
+        :return: what changes whenever the file is written or replaced, None if there is no file
+        """
+        try:
+            file_stat = os.stat(path)
+        except OSError:
+            return None
+        return file_stat.st_ino, file_stat.st_mtime_ns, file_stat.st_size
+
+    def compact(
+        self,
+        now: float | None = None,
+    ):
+        """
+        adds the log to the snapshot and starts a new log, skipped if another process is compacting or appending at the
+        same time (the log is compacted by a later record then)
+        :param now: time the snapshot is decayed to, defaults to the current time
+        """
+        now = time.time() if now is None else now
+        os.makedirs(os.path.dirname(self.lock_path), exist_ok=True)
+        with open(self.lock_path, "a") as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                return
+
+            compacting_path = f"{self.log_path}.compacting"
+            # a log left behind by a compaction that failed is added first, moving the log would replace it
+            if os.path.exists(compacting_path):
+                self._compact_log(log_path=compacting_path, now=now)
+
+            # uses recorded from now on go to a new log
+            try:
+                os.replace(self.log_path, compacting_path)
+            except FileNotFoundError:
+                return
+            self._compact_log(log_path=compacting_path, now=now)
+
+    def _compact_log(
+        self,
+        log_path: str,
+        now: float,
+    ):
+        """
+        adds a log to the snapshot and removes it, only while the compaction lock is held
+        """
+        reference, scores = self._load_snapshot()
+        self._add_log(
+            scores=scores,
+            reference=reference,
+            log_path=log_path,
+        )
+        decay = 0.5 ** ((now - reference) / self.half_life)
+        # names that have not been used for a long time are dropped
+        scores = {name: score * decay for name, score in scores.items() if score * decay >= 0.01}
+        _write_atomic(self.snapshot_path, (now, scores))
+        os.unlink(log_path)
+
+    def _load_snapshot(self):
+        """
+        :return: the time of the snapshot and the scores at that time - the current time and no scores if there is none
+        """
+        try:
+            with open(self.snapshot_path, "rb") as snapshot:
+                reference, scores = pickle.load(snapshot)
+            return reference, scores
+        except Exception:
+            return time.time(), {}
+
+    def _add_log(
+        self,
+        scores: dict,
+        reference: float,
+        log_path: str,
+    ):
+        """
+        adds the uses of a log to scores at the time reference
+        """
+        try:
+            with open(log_path, "rb") as log:
+                lines = log.read().decode(errors="replace").splitlines()
+        except OSError:
+            return
+
+        for line in lines:
+            timestamp, _, name = line.partition("\t")
+            try:
+                score = 0.5 ** ((reference - float(timestamp)) / self.half_life)
+            except (ValueError, OverflowError):
+                # a broken line, e.g. the last line of a log written by a process that got killed
+                continue
+            scores[name] = scores.get(name, 0) + score
+
+
+def get_usage_history(
+    config_path: str,
+    cache_dir: str | None = None,
+):
+    """
+    :param config_path: path to the configuration file
+    :param cache_dir: directory of the cache, defaults to get_cache_dir()
+    :return: the usage history of a configuration, in the directory usage of the cache
+    """
+    return UsageHistory(
+        path=_get_cache_path(
+            config_path=config_path,
+            cache_dir=os.path.join(cache_dir or get_cache_dir(), "usage"),
+            suffix="history",
+        )
+    )
+
+
+def record_usage(
+    args: list[str],
+    rules: RuleSet,
+    usage_history: UsageHistory,
+):
+    """
+    records the commands/options contained in the typed words as used, e.g. from a hook of the shell that runs before a
+    command line is executed
+    :param args: the typed words
+    :param rules: the loaded rules
+    :param usage_history: the history the uses are recorded in
+    """
+    names = []
+    for word in args:
+        state = rules.transitions.state_by_word.get(rules.resolve_word(word) or word)
+        if state is not None:
+            names.append(rules.transitions.rules[state].name)
+
+    usage_history.record(names)
+
+
+class ParseState:
+    def __init__(self):
+        """
+        state of a left to right parse of typed words, see AutoCompletion.parse_input
+        a state can be continued with further words, so an input that only grew does not get parsed again
+        """
+        self.words = ()
+        # the last typed command and the amount of parameters typed for it
+        self.command = None
+        self.command_parameter_count = 0
+        # the last typed option or global option and the amount of parameters typed for it
+        self.option = None
+        self.option_parameter_count = 0
+        # names of all typed commands and global options
+        self.used = set()
+        # set once a command kept in a shard file was typed, the parse of the words after it depends on the shard
+        self.sharded = False
+
+    def copy(self):
+        state = ParseState()
+        state.words = self.words
+        state.command = self.command
+        state.command_parameter_count = self.command_parameter_count
+        state.option = self.option
+        state.option_parameter_count = self.option_parameter_count
+        state.used = set(self.used)
+        state.sharded = self.sharded
+        return state
+
+    def advance(
+        self,
+        rules: RuleSet,
+        word: str,
+    ):
+        """
+        parses the next typed word
+        a subcommand of the active command takes precedence over any other rule of the same name, a word that is no
+        command/option is a parameter of the open option, once the option has all of its parameters it
+        is closed and further parameters belong to the command
+        :param rules: the rules the words are parsed with
+        :param word: the typed word
+        """
+        if self.command is not None and not self.parameter_required:
+            subcommand = rules.get_subcommand(self.command, word)
+            if subcommand is not None:
+                self.command = subcommand
+                self.command_parameter_count = 0
+                self.option = None
+                return
+
+        transitions = rules.transitions
+        state = transitions.state_by_word.get(rules.resolve_word(word) or word)
+        rule = transitions.rules[state] if state is not None else None
+
+        if isinstance(rule, Command):
+            self.command = rule
+            self.command_parameter_count = 0
+            self.option = None
+            self.used.add(rule.name)
+            if isinstance(rule, ShardedCommand):
+                self.sharded = True
+        elif rule is not None:
+            if rule.global_option:
+                self.used.add(rule.name)
+            self.option = rule
+            self.option_parameter_count = 0
+        elif self.option is not None and self.option_parameter_count < self.option.param_max_amnt:
+            self.option_parameter_count += 1
+        else:
+            self.option = None
+            if self.command is not None:
+                self.command_parameter_count += 1
+
+    @property
+    def open_option(self):
+        """
+        :return: the last typed option if it can take further parameters, else None
+        """
+        if self.option is not None and self.option_parameter_count < self.option.param_max_amnt:
+            return self.option
+        return None
+
+    @property
+    def open_command(self):
+        """
+        :return: the last typed command if it can take further parameters, else None
+        """
+        if self.command is not None and self.command_parameter_count < self.command.param_max_amnt:
+            return self.command
+        return None
+
+    @property
+    def parameter_required(self):
+        """
+        :return: True if the open option has not been given its minimum amount of parameters yet, so nothing but one of
+            its parameters can follow
+        """
+        return self.option is not None and self.option_parameter_count < self.option.param_min_amnt
+
+    @property
+    def parameter_rule(self):
+        """
+        :return: the command/option the next parameter belongs to, None if no parameter can follow
+        """
+        return self.open_option or self.open_command
+
+
+class AutoCompletion:
+    def __init__(
+        self,
+        config_path,
+        args,
+        use_cache=True,
+        cache_dir=None,
+        rules=None,
+        cwd=None,
+        listing_cache=None,
+        provider_cache=None,
+        parse_state=None,
+        usage_history=None,
+        result_cache=None,
+        deadline=None,
+    ):
+        """
+        initializes completion - an instance holds the state of a single completion, the rules it completes with can be
+        shared between any amount of instances
+            - sets config file that should be used
+            - loads commands, global options and options from configuration file
+        :param config_path:
+            - if this variable is set, this configuration gets used (mainly for test purposes)
+            - if this variable is not set, the configuration is set statically (for Elektra project set using KDB)
+        :param args:
+            this variable should only be set for testing from pytests
+            - if this variable is set, the autocompletion will be done with using this list as the previously typed commands/options
+            - if this variable is not set, the autocompletion will be done based on the arguements passed via command line
+        :param use_cache: if set the rules are memory mapped from the rule index, see load_rules
+        :param cache_dir: directory of the rule index, defaults to get_cache_dir()
+        :param rules: already loaded rules of the configuration, if set the configuration file is not read
+        :param cwd: directory file paths are completed relative to, defaults to the current working directory
+        :param listing_cache: cache of directory listings used for completing file paths, if not set directories are
+            read on every completion
+        :param provider_cache: cache of the values of DYNAMIC parameter providers, if not set providers are run on every
+            completion
+        :param parse_state: parse of previously typed words (see parse_input), continued if the input starts with them
+        :param usage_history: history the completions are ranked by if the configuration sets usage_ranking
+        :param result_cache: cache of the completions of commands/options, if not set they are completed every time
+        :param deadline: time (time.monotonic()) the completion has to be done by - providers and file completion still
+            running then are cut short and partial is set, None for no deadline
+        """
+        if config_path:
+            self.config_path = config_path
+        else:
+            self.config_path = "config.json"
+            # TODO set using kdb
+
+        if rules is None:
+            rules = load_rules(
+                config_path=self.config_path,
+                use_cache=use_cache,
+                cache_dir=cache_dir,
+            )
+        self.rules = rules
+        self.cwd = cwd
+        self.listing_cache = listing_cache
+        self.provider_cache = provider_cache
+        self.usage_history = usage_history
+        self.result_cache = result_cache
+        self.deadline = deadline
+        # parse of the typed words, the last one after complete() ran
+        self.parse_state = parse_state
+        # set if any part of the completion was cut short, e.g. file completion that ran into its timeout
+        self.partial = False
+        # set if a source stopped at its limit, e.g. file completion that found file_completion_limit paths
+        self.limited = False
+        # set after complete() if the completion of a longer started word is the completion filtered by that word, see
+        # CompletionSession
+        self.filterable = False
+        if args is None:
+            # when in command line read in args
+            self.current_input = sys.argv[1:]
+        else:
+            # only for testing via pytest
+            self.current_input = args
+
+        if len(self.current_input) > 0:
+            self.current_word = self.current_input[-1]
+        else:
+            self.current_word = None
+
+    @property
+    def default(self):
+        return self.rules.default
+
+    @property
+    def commands(self):
+        return self.rules.commands
+
+    @property
+    def options(self):
+        return self.rules.options
+
+    @property
+    def global_options(self):
+        return self.rules.global_options
+
+    def get_commands(self):
+        """
+        get commands form the config file
+        :return: a list of all commands
+        """
+        return list(self.rules.commands)
+
+    def get_options(
+        self,
+        option_type,
+    ):
+        """
+        get options form the config file
+        :param option_type:
+            command_option_rules for options following a command
+            global_option_rules for gloabl options
+        :return: a list of all options of that option_type, no duplicates
+        """
+        if option_type == "global_option_rules":
+            return list(self.rules.global_options)
+        if option_type == "command_option_rules":
+            return list(self.rules.options)
+        return []
+
+    def iter_file_paths(
+        self,
+        current_word: str | None,
+    ):
+        """
+        completes a file path - the directory part of the current word is listed and only entries starting with the rest
+        of the word are returned, while the directory is still being read (or from the listing cache if it is set)
+        :param current_word: the started file path, None or an empty word lists the working directory
+        :return: a generator of the completed paths (directory part as typed), directories end with a /
+        """
+        current_word = current_word or ""
+        # "src/aut" -> "src/", "aut"   "src/" -> "src/", ""   "aut" -> "", "aut"
+        prefix = os.path.basename(current_word)
+        typed_directory = current_word[: len(current_word) - len(prefix)]
+
+        directory = os.path.expanduser(typed_directory) or "."
+        if self.cwd is not None:
+            directory = os.path.join(self.cwd, directory)
+
+        try:
+            if self.listing_cache is not None:
+                entries = self.listing_cache.iter_entries(directory, prefix)
+            else:
+                entries = _scan_directory(directory, prefix)
+            for name, is_dir in entries:
+                yield typed_directory + name + ("/" if is_dir else "")
+        except OSError:
+            # the directory does not exist or can not be read, nothing to complete
+            return
+
+    def complete_file_path(
+        self,
+        current_word: str | None,
+        limit: int | None = None,
+        timeout: float | None = None,
+    ):
+        """
+        completes a file path, see iter_file_paths
+        :param current_word: the started file path, None or an empty word lists the working directory
+        :param limit: maximum amount of completed paths, reading the directory stops once it is reached - defaults to
+            the file_completion_limit of the configuration
+        :param timeout: time in seconds the directory may be read for, the paths found until then are returned and
+            partial is set - defaults to the file_completion_timeout of the configuration
+        :return: a list of the completed paths
+        """
+        return list(
+            self.iter_complete_file_path(
+                current_word=current_word,
+                limit=limit,
+                timeout=timeout,
             )
+        )
+
+    def iter_complete_file_path(
+        self,
+        current_word: str | None,
+        limit: int | None = None,
+        timeout: float | None = None,
+    ):
+        """
+        completes a file path like complete_file_path, but every path is passed on as soon as it is read
+        :return: a generator of the completed paths
+        """
+        if limit is None:
+            limit = self.rules.file_completion_limit
+        if timeout is None:
+            timeout = self.rules.file_completion_timeout
+        if self.deadline is not None:
+            timeout = self.get_remaining_time(timeout)
+
+        file_paths = itertools.islice(self.iter_file_paths(current_word), limit)
+        if timeout is None:
+            count = 0
+            for file_path in file_paths:
+                count += 1
+                yield file_path
+        else:
+            count, finished = yield from _iter_within(file_paths, timeout)
+            if not finished:
+                self.partial = True
+
+        if count >= limit:
+            self.limited = True
+
+    def complete_dynamic(
+        self,
+        rule: CommandOptionBase | None,
+        current_word: str | None,
+    ):
+        """
+        completes the DYNAMIC parameters of a command/option with the values of their providers, the providers of all
+        DYNAMIC parameters are run at the same time
+        :param rule: the command or option the parameter belongs to
+        :param current_word: the started parameter, None or an empty word for all values
+        :return: a list of the provided values starting with the current word
+        """
+        if rule is None:
+            return []
+
+        providers = [
+            parameter_type_option.provider
+            for parameter_type_option in rule.parameter_type_options
+            if parameter_type_option.parameter_type == ParameterTypes.dynamic
+            and parameter_type_option.provider is not None
+        ]
+        if not providers:
+            return []
+
+        def provider_source(provider):
+            if self.provider_cache is not None:
+                return lambda: self.provider_cache.get_values(provider=provider, cwd=self.cwd)
+            return lambda: provider.get_values(cwd=self.cwd)
+
+        # every provider enforces its own timeout, the budget only catches providers that do not return at all
+        results, dropped = CompletionScheduler(
+            budget=self.get_remaining_time(max(provider.timeout for provider in providers) + 0.1)
+        ).run({position: provider_source(provider) for position, provider in enumerate(providers)})
+        if dropped:
+            self.partial = True
+
+        prefix = current_word or ""
+        completion = []
+        for position in range(len(providers)):
+            completion.extend(value for value in results.get(position) or [] if value.startswith(prefix))
+
+        return completion
+
+    def get_remaining_time(
+        self,
+        timeout: float | None,
+    ):
+        """
+        :param timeout: time in seconds a part of the completion may take, None for no limit
+        :return: the timeout, shortened to the time left until the deadline of the completion if that is earlier
+        """
+        if self.deadline is None:
+            return timeout
+
+        remaining = max(self.deadline - time.monotonic(), 0)
+        return remaining if timeout is None else min(timeout, remaining)
+
+    def complete_enum(
+        self,
+        rule: CommandOptionBase | None,
+        current_word: str | None,
+        limit: int = ENUM_COMPLETION_LIMIT,
+    ):
+        """
+        completes the ENUM parameters of a command/option with their values
+        :param rule: the command or option the parameter belongs to
+        :param current_word: the started parameter, None or an empty word for all values
+        :param limit: maximum amount of values completed per parameter
+        :return: a list of the values starting with the current word
+        """
+        if rule is None:
+            return []
+
+        completion = []
+        for parameter_type_option in rule.parameter_type_options:
+            if parameter_type_option.parameter_type != ParameterTypes.enum or parameter_type_option.values is None:
+                continue
+            try:
+                values = parameter_type_option.values.find(prefix=current_word or "", limit=limit)
+            except OSError:
+                # a missing value file completes nothing
+                continue
+            if len(values) >= limit:
+                self.limited = True
+            completion.extend(values)
+
+        return completion
+
+    def complete_current(
+        self,
+        current_word,
+        input=None,
+    ):
+        """
+        completes an input, that has already been started to be typed, if the command/option is already complete it will
+        not be returned - instead the option or command will be returned. does not take into consideration already typed
+        commands/options/parameters, so if a command gets typed before and the option would not be valid it will still
+        be completed
+        :param current_word: the started word
+        :param input: the words typed so far, commands and global options contained in it are not completed again
+        :return: a list of possible completions (strings, last command, last global option, last option) of the current
+            word and a bool if the current word is an exact match
+        """
+        if current_word is None:
+            return [], False
+
+        typed = self._get_typed_words(input)
+        # the index returns the matches ordered by word, sorting by position restores the order of the rules
+        completion = [
+            word
+            for _, word, skip_typed in sorted(self.rules.completion_index.find(self.rules.get_key(current_word)))
+            if not (skip_typed and word in typed)
+        ]
+        exact_match = self.rules.get_key(current_word) in self.rules.exact_words
+
+        return completion, exact_match
+
+    def _get_typed_words(
+        self,
+        input,
+    ):
+        """
+        :param input: the words typed so far, the last one is the current word
+        :return: the names/long forms the typed words stand for (see RuleSet.resolve_word), words that stand for none
+            as typed
+        """
+        if not input:
+            return set()
+        typed = {self.rules.resolve_word(word) or word for word in input[:-1]}
+        # the current word is still being typed, it is not resolved as an abbreviation of what it completes to
+        typed.add(self.rules.resolve_word(input[-1], abbreviations=False) or input[-1])
+        return typed
+
+    def complete_fuzzy(
+        self,
+        current_word,
+        input=None,
+    ):
+        """
+        completes a started word with all names/long forms it starts (see complete_current), followed by the ones it
+        only fuzzy matches (see _score_fuzzy_match) - the best matches first - commands and global options contained in
+        the input are not completed again
+        :param current_word: the started word
+        :param input: the words typed so far
+        :return: a list of the prefix completions and at most fuzzy_matching_limit fuzzy completions
+        """
+        if not current_word:
+            return []
+
+        completion = self.complete_current(current_word=current_word, input=input)[0]
+        prefix_matches = set(completion)
+        typed = self._get_typed_words(input)
+        # prefix matches and typed words that are left out are asked for on top, so that the limit still holds without
+        # them
+        matches = self.rules.fuzzy_index.find(
+            query=current_word,
+            limit=self.rules.fuzzy_matching_limit + len(prefix_matches) + len(typed),
+        )
+        fuzzy_completion = [
+            word
+            for _, word, skip_typed in matches
+            if word not in prefix_matches and not (skip_typed and word in typed)
+        ]
+
+        return completion + fuzzy_completion[:self.rules.fuzzy_matching_limit]
+
+    def get_last_command_global_option(
+        self,
+        current_input,
+    ):
+        """
+        gets last command, option or global option - whichever appears later in input and all following input
+        :param current_input: parameters passed by command line script, those are the entered words in order by the user
+        :return: either command or option (as a tuple - COMMAND, OPTION) - max one will be not none
+        """
+        for word in reversed(current_input):
+            word = self.rules.resolve_word(word) or word
+            command = self.rules.command_by_word.get(word)
+            if command is not None:
+                return command, None
+
+            global_option = self.rules.global_option_by_word.get(word)
+            if global_option is not None:
+                return None, global_option
+
+            option = self.rules.option_by_word.get(word)
             if option is not None:
                 return None, option
 
@@ -412,137 +3362,892 @@ class AutoCompletion:
         command_options = []
 
         for word in current_input:
-            command = next(
-                (command for command in self.commands if command.name == word),
-                None,
-            )
+            word = self.rules.resolve_word(word) or word
+            command = self.rules.command_by_word.get(word)
             if command is not None:
                 command_options.append(command)
 
-            global_option = next(
-                (
-                    option
-                    for option in self.global_options
-                    if option.name == word or option.long == word
-                ),
-                None,
-            )
+            global_option = self.rules.global_option_by_word.get(word)
             if global_option is not None:
                 command_options.append(global_option)
 
-            option = next(
-                (
-                    option
-                    for option in self.options
-                    if option.name == word or option.long == word
-                ),
-                None,
-            )
+            option = self.rules.option_by_word.get(word)
             if option is not None:
                 command_options.append(option)
 
         return command_options
 
+    def parse_input(
+        self,
+        words,
+        state=None,
+    ):
+        """
+        parses the typed words from left to right in one pass, keeping track of the active command, the open option and
+        how many parameters they have been given
+        :param words: the typed words, without the word that is being completed
+        :param state: a previous parse, it is continued if the words start with the words it parsed
+        :return: the ParseState after the last word
+        """
+        words = tuple(words)
+        if state is not None and words[:len(state.words)] == state.words:
+            state = state.copy()
+        else:
+            state = ParseState()
+
+        for word in words[len(state.words):]:
+            state.advance(rules=self.rules, word=word)
+        state.words = words
+
+        return state
+
     def complete_next(
         self,
         last_word_command,
         last_word_option,
-        input,
+        input=None,
+        parameter_count=0,
     ):
         """
-        this function could be extended to contain completion for parameters, currently will only complete the options
-        for the last command and the types of parameters that could be added for the given option/command
+        completes what can be typed after a command/option: the subcommands and options of a command and the types of
+        parameters of the command/option, as long as it has been given less than its maximum amount of parameters
         :param last_word_command: the last command that was contained in the user input
         :param last_word_option: the last option/global option that was contained in the user input
         only one of the parameters will get passed, as it only makes sense completing the last
+        :param input: the words typed so far, if no command/option is passed the commands and global options contained
+            in it are not completed again
+        :param parameter_count: the amount of parameters already typed for the command/option
         :return: a list of strings, containing all options and parameter types that could be typed after the last option
         or command
         """
+        transitions = self.rules.transitions
         completion: list[str] = []
 
-        if last_word_command is not None:
-            completion.extend(last_word_command.options)
+        if last_word_command is not None or last_word_option is not None:
+            rule = last_word_command or last_word_option
+            state = transitions.get_state(rule)
+            if state is not None:
+                completion.extend(transitions.next_tokens[state])
+                if parameter_count < transitions.max_amnt[state]:
+                    completion.extend(transitions.parameter_types[state])
+            else:
+                # subcommands and sharded commands are not part of the transition table
+                completion.extend(rule.subcommand_names)
+                completion.extend(rule.options)
+                if parameter_count < rule.param_max_amnt:
+                    for parameter_type_option in rule.parameter_type_options:
+                        completion.append(parameter_type_option.parameter_type)
+
+        else:
+            # typed long forms count as their names
+            used = set(input) if input else set()
+            for word in list(used):
+                state = transitions.state_by_word.get(self.rules.resolve_word(word) or word)
+                if state is not None:
+                    used.add(transitions.rules[state].name)
+            completion.extend(
+                token for token in transitions.next_tokens[TransitionTable.START] if token not in used
+            )
+
+        return completion
+
+    def complete(self):
+        """
+        runs the whole completion for current_input, see iter_complete
+        :return: a list of all completions, without duplicates
+        """
+        return list(self.iter_complete())
+
+    def iter_complete(self):
+        """
+        runs the whole completion for current_input
+        the completion is made up of independent sources (started word, next after the last command/option, unused
+        commands and global options, file paths) - if the configuration sets a latency_budget they are run at the same
+        time and sources that miss the budget are dropped (and partial is set), otherwise one after another
+        the completions of commands/options are passed on first, before the providers of DYNAMIC parameters are waited
+        for - then the values of DYNAMIC and ENUM parameters follow, and file paths while the directory is still being
+        read (unless they were read within the latency_budget already). partial is only final once all completions
+        were taken
+        :return: a generator of all completions, without duplicates
+        """
+        previous_state = self.parse_input(
+            words=self.current_input[:-1],
+            state=self.parse_state,
+        )
+        # subcommands of the active command are only known once the words before the current word are parsed
+        subcommand_names = previous_state.command.subcommand_names if previous_state.command is not None else ()
+        exact_match = self.current_word is not None and (
+            self.rules.get_key(self.current_word) in self.rules.exact_words
+            or (
+                previous_state.command is not None
+                and self.rules.get_subcommand(previous_state.command, self.current_word) is not None
+            )
+        )
+        # if the current word was not an exact match, meaning the last word has been finished completion will continue
+        completing_next = exact_match or not self.current_word or self.current_word.strip() == ''
+        # an exact match is parsed as typed, otherwise the current word is a started word (or none) and the completion
+        # depends on the words before it
+        self.parse_state = previous_state
+        if exact_match:
+            self.parse_state = self.parse_input(
+                words=self.current_input,
+                state=previous_state,
+            )
+        state = self.parse_state
+        parameter_rule = state.parameter_rule
+        parameter_word = None if completing_next else self.current_word
+
+        # the last given string will be completed at first with all specified commands, global options and options
+        # if the command/option is already complete it will not show up in this list but instead as command or option
+        # if this list is not empty, only those options will show up as the current word is not complete
+        # an empty word is not completed with every name, only with what can follow the words before it
+        sources = {}
+        if not completing_next or exact_match:
+            def current_source():
+                typed_keys = {self.rules.get_key(word) for word in self.current_input}
+                completion = [
+                    name
+                    for name in subcommand_names
+                    if self.rules.get_key(name).startswith(self.rules.get_key(self.current_word))
+                    and self.rules.get_key(name) not in typed_keys
+                ]
+                if self.rules.fuzzy_matching and not exact_match:
+                    completion.extend(
+                        self.complete_fuzzy(
+                            current_word=self.current_word,
+                            input=self.current_input,
+                        )
+                    )
+                    return completion
+
+                completion.extend(
+                    self.complete_current(
+                        current_word=self.current_word,
+                        input=self.current_input,
+                    )[0]
+                )
+                return completion
+
+            sources["current"] = current_source
+        if completing_next:
+            def next_source():
+                completion = []
+                if state.open_option is not None:
+                    completion.extend(
+                        self.complete_next(
+                            last_word_command=None,
+                            last_word_option=state.open_option,
+                            parameter_count=state.option_parameter_count,
+                        )
+                    )
+                # an option missing parameters can only be followed by one of them
+                if state.command is not None and not state.parameter_required:
+                    completion.extend(
+                        self.complete_next(
+                            last_word_command=state.command,
+                            last_word_option=None,
+                            parameter_count=state.command_parameter_count,
+                        )
+                    )
+                return completion
+
+            sources["next"] = next_source
+        sources["dynamic"] = lambda: self.complete_dynamic(
+            rule=parameter_rule,
+            current_word=parameter_word,
+        )
+        sources["enum"] = lambda: self.complete_enum(
+            rule=parameter_rule,
+            current_word=parameter_word,
+        )
+        if completing_next and not state.parameter_required:
+            # adding all commands & global options that have not yet been used
+            sources["unused"] = lambda: self.complete_next(
+                last_word_option=None,
+                last_word_command=None,
+                input=state.used,
+            )
 
-            for parameter_type_option in last_word_command.parameter_type_options:
-                completion.append(parameter_type_option.parameter_type)
+        # the completions of commands/options are the same for the same rules and words - unless they depend on a shard
+        # file, which can change without the configuration changing
+        use_result_cache = self.result_cache is not None and self.rules.fingerprint is not None and not state.sharded
+        cached_results = None
+        if use_result_cache:
+            cached_results = self.result_cache.get(self.rules.fingerprint, tuple(self.current_input))
+            for name, cached in (cached_results or {}).items():
+                sources[name] = lambda cached=cached: cached
 
-        elif last_word_option is not None:
-            for parameter_type_option in last_word_option.parameter_type_options:
-                completion.append(parameter_type_option.parameter_type)
+        def file_source():
+            return self.complete_file_path(parameter_word)
 
+        # the completions of commands/options only take a lookup, they are passed on before the values of parameters are
+        # waited for (providers may take up to their timeout)
+        option_sources = [name for name in ["current", "next", "unused"] if name in sources]
+        if self.rules.latency_budget is None:
+            scheduled = (
+                (name, sources[name]())
+                for name in option_sources + [name for name in sources if name not in option_sources]
+            )
         else:
-            for option in self.global_options:
-                if option.name not in input and option.long not in input:
-                    completion.append(option.name)
+            # file paths are only needed if the next parameter can be a file or if nothing else can be completed and
+            # the default is FILE - they are read right away in case they are needed, as they take the longest
+            next_rules = []
+            if completing_next:
+                next_rules.append(state.open_option)
+                if not state.parameter_required:
+                    next_rules.append(state.open_command)
+            if self.default == ParameterTypes.file or any(
+                parameter_type_option.parameter_type == ParameterTypes.file
+                for rule in next_rules
+                if rule is not None
+                for parameter_type_option in rule.parameter_type_options
+            ):
+                sources["files"] = file_source
 
-            for command in self.commands:
-                if command.name not in input:
-                    completion.append(command.name)
+            scheduled = CompletionScheduler(budget=self.rules.latency_budget).iter_results(sources)
 
-        return completion
+        results = {}
+
+        def take_results(names):
+            while not all(name in results for name in names):
+                try:
+                    name, result = next(scheduled)
+                except StopIteration:
+                    return
+                results[name] = result
+
+        take_results(option_sources)
+        if use_result_cache and cached_results is None and all(name in results for name in option_sources):
+            self.result_cache.put(
+                self.rules.fingerprint,
+                tuple(self.current_input),
+                {name: results[name] for name in option_sources},
+            )
+
+        option_completion = []
+        for name in option_sources:
+            option_completion.extend(results.get(name, []))
+        # any type can not really be completed in any meaningful way
+        # file type completed below, dynamic and enum types completed with the values of their providers/value lists,
+        # removing types - the command and its open option may both have added them
+        completion = [c for c in option_completion if c not in PARAMETER_TYPE_NAMES]
+
+        # most used commands/options first, the sort is stable so everything else keeps its order
+        if self.rules.usage_ranking and self.usage_history is not None:
+            scores = self.usage_history.get_scores()
+            transitions = self.rules.transitions
+
+            def get_score(word):
+                # uses are recorded under the rule name, long forms are ranked the same as their rule
+                state = transitions.state_by_word.get(word)
+                return scores.get(transitions.rules[state].name if state is not None else word, 0)
+
+            if scores:
+                completion.sort(key=lambda c: -get_score(c))
+
+        # duplicates need to be removed
+        completed = set()
+        for word in completion:
+            if word not in completed:
+                completed.add(word)
+                yield word
+
+        take_results(sources)
+        if self.rules.latency_budget is not None and any(
+            name not in results for name in sources if name != "files"
+        ):
+            self.partial = True
+
+        value_completion = results.get("dynamic", []) + results.get("enum", [])
+
+        # if the current word cannot be completed with options completion will be attempted via the default completion
+        # specified in the config
+        file_paths = []
+        if ParameterTypes.file in option_completion or (
+            not option_completion and not value_completion and self.default == ParameterTypes.file
+        ):
+            if self.rules.latency_budget is None:
+                file_paths = self.iter_complete_file_path(parameter_word)
+            elif "files" in results:
+                file_paths = results["files"]
+            else:
+                self.partial = True
+
+        for word in itertools.chain(value_completion, file_paths):
+            if word not in completed:
+                completed.add(word)
+                yield word
+
+        # every source completes a started word with what starts with it (unless matched fuzzy, case insensitive or cut
+        # short), so what a longer word completes to is a part of this completion
+        self.filterable = (
+            not completing_next
+            and not self.rules.fuzzy_matching
+            and not self.rules.ignore_case
+            and not self.partial
+            and not self.limited
+        )
+
+def complete(
+    args: list[str],
+    rules: RuleSet | str,
+    cwd: str | None = None,
+    listing_cache: DirectoryListingCache | None = None,
+    provider_cache: ProviderCache | None = None,
+    usage_history: UsageHistory | None = None,
+    result_cache: ResultCache | None = None,
+):
+    """
+    completes the typed words - the same completion the script prints, but without starting a process
+    :param args: the typed words, the last one is the word that gets completed
+    :param rules: the loaded rules (see load_rules) or the path to a configuration file that gets loaded
+    :param cwd: directory file paths are completed relative to, defaults to the current working directory
+    :param listing_cache: cache of directory listings used for completing file paths
+    :param provider_cache: cache of the values of DYNAMIC parameter providers
+    :param usage_history: history the completions are ranked by if the configuration sets usage_ranking
+    :param result_cache: cache of the completions of commands/options
+    :return: a list of all completions, without duplicates
+    """
+    return complete_with_status(
+        args=args,
+        rules=rules,
+        cwd=cwd,
+        listing_cache=listing_cache,
+        provider_cache=provider_cache,
+        usage_history=usage_history,
+        result_cache=result_cache,
+    )[0]
+
+
+def complete_with_status(
+    args: list[str],
+    rules: RuleSet | str,
+    cwd: str | None = None,
+    listing_cache: DirectoryListingCache | None = None,
+    provider_cache: ProviderCache | None = None,
+    usage_history: UsageHistory | None = None,
+    result_cache: ResultCache | None = None,
+    deadline: float | None = None,
+):
+    """
+    completes the typed words, see complete
+    :param args: the typed words, the last one is the word that gets completed
+    :param rules: the loaded rules (see load_rules) or the path to a configuration file that gets loaded
+    :param cwd: directory file paths are completed relative to, defaults to the current working directory
+    :param listing_cache: cache of directory listings used for completing file paths
+    :param provider_cache: cache of the values of DYNAMIC parameter providers
+    :param usage_history: history the completions are ranked by if the configuration sets usage_ranking
+    :param result_cache: cache of the completions of commands/options
+    :param deadline: time (time.monotonic()) the completion has to be done by, see AutoCompletion
+    :return: a list of all completions, without duplicates, and if the completion is partial (cut short by a timeout)
+    """
+    if isinstance(rules, str):
+        config_path = rules
+        rules = load_rules(config_path=config_path)
+    else:
+        config_path = None
 
-if __name__ == "__main__":
-    input = sys.argv[1:]
-    config_path = None
-    # if the first input argument is --test_autocompletion_config the second argument will be used as the path to the
-    # test config to be used will probably only be used for test purposes
-    if len(input) > 1 and input[0] == "--test_autocompletion_config":
-        config_path = input[1]
     autocompletion = AutoCompletion(
         config_path=config_path,
-        args=None,
+        args=list(args),
+        rules=rules,
+        cwd=cwd,
+        listing_cache=listing_cache,
+        provider_cache=provider_cache,
+        usage_history=usage_history,
+        result_cache=result_cache,
+        deadline=deadline,
     )
+    completion = autocompletion.complete()
+    return completion, autocompletion.partial
+
+
+def write_completion(
+    completion,
+    output,
+    output_mode: str = "lines",
+    get_partial=None,
+):
+    """
+    writes completions to a binary stream as they are completed, each one followed by the delimiter of the output mode
+    and flushed right away - so a shell can show the first completions while slower sources are still running
+    completions containing the delimiter can not be told apart from two completions and are left out, like empty ones
+    :param completion: iterable of the completions, e.g. AutoCompletion.iter_complete()
+    :param output: the binary stream, e.g. sys.stdout.buffer
+    :param output_mode: "lines" (newline delimited) or "nul" (NUL delimited), "+status" appended (e.g. "nul+status")
+        writes an empty completion and "complete" or "partial" after the completions
+    :param get_partial: function returning if the completion is partial, called after all completions were written
+    :raises ValueError: if the output mode is not known
+    """
+    mode, _, status = output_mode.partition("+")
+    if mode not in OUTPUT_DELIMITERS or status not in ["", "status"]:
+        raise ValueError(f"unknown output mode {output_mode}")
+    delimiter = OUTPUT_DELIMITERS[mode]
+
+    for word in completion:
+        word = word.encode()
+        if word and delimiter not in word:
+            output.write(word + delimiter)
+            output.flush()
 
-    completion = []
+    if status:
+        output.write(delimiter + (b"partial" if get_partial and get_partial() else b"complete") + delimiter)
+        output.flush()
 
-    # the last given string will be completed at first with all specified commands, global options and options
-    # if the command/option is already complete it will not show up in this list but instead as command or option
-    # if this list is not empty, only those options will show up as the current word is not complete
-    completion_main, exact_match = autocompletion.complete_current(
-        current_word=autocompletion.current_word,
-        input=input,
+
+def stream_completion(
+    args: list[str],
+    rules: RuleSet | str,
+    output,
+    output_mode: str = "lines",
+    cwd: str | None = None,
+    listing_cache: DirectoryListingCache | None = None,
+    provider_cache: ProviderCache | None = None,
+    usage_history: UsageHistory | None = None,
+):
+    """
+    completes the typed words like complete, writing every completion as soon as it is completed, see write_completion
+    :param args: the typed words, the last one is the word that gets completed
+    :param rules: the loaded rules (see load_rules) or the path to a configuration file that gets loaded
+    :param output: the binary stream the completions are written to
+    :param output_mode: how the completions are written, see write_completion
+    :param cwd: directory file paths are completed relative to, defaults to the current working directory
+    :param listing_cache: cache of directory listings used for completing file paths
+    :param provider_cache: cache of the values of DYNAMIC parameter providers
+    :param usage_history: history the completions are ranked by if the configuration sets usage_ranking
+    """
+    if isinstance(rules, str):
+        config_path = rules
+        rules = load_rules(config_path=config_path)
+    else:
+        config_path = None
+
+    autocompletion = AutoCompletion(
+        config_path=config_path,
+        args=list(args),
+        rules=rules,
+        cwd=cwd,
+        listing_cache=listing_cache,
+        provider_cache=provider_cache,
+        usage_history=usage_history,
+    )
+    write_completion(
+        completion=autocompletion.iter_complete(),
+        output=output,
+        output_mode=output_mode,
+        get_partial=lambda: autocompletion.partial,
     )
-    completion.extend(completion_main)
 
-    # if the current word was not an exact match, meaning the last word has been finished completion will continue
-    if exact_match or not autocompletion.current_word or autocompletion.current_word.strip() == '':
-        last_command, last_option = autocompletion.get_last_command_global_option(
-            current_input=autocompletion.current_input
-        )
 
-        completion_next = autocompletion.complete_next(
-            last_word_option=last_option,
-            last_word_command=last_command,
-            input=input,
+class CompletionSession:
+    def __init__(self):
+        """
+        the completions of one shell, one after another - pressing tab again after typing more of the current word only
+        filters the previous completion, after typing more words the parse of the unchanged words before them is
+        continued. only changing a word before the current word (or the rules or working directory) completes anew
+        """
+        self.args = None
+        self.rules = None
+        self.cwd = None
+        self.completion = None
+        self.filterable = False
+        self.parse_state = None
+        # a shell completing twice at the same time (e.g. tab pressed twice quickly) gets its completions one after
+        # another
+        self.lock = threading.Lock()
+
+    def complete(
+        self,
+        args: list[str],
+        rules: RuleSet,
+        cwd: str | None = None,
+        listing_cache: DirectoryListingCache | None = None,
+        provider_cache: ProviderCache | None = None,
+        usage_history: UsageHistory | None = None,
+        result_cache: ResultCache | None = None,
+        deadline: float | None = None,
+    ):
+        """
+        completes the typed words, see complete_with_status
+        :return: a list of all completions, without duplicates, and if the completion is partial
+        """
+        args = list(args)
+        with self.lock:
+            if self._extends_current_word(args, rules, cwd):
+                # names typed in another case were completed if case is ignored, they are filtered the same way
+                current_key = rules.get_key(args[-1])
+                completion = [c for c in self.completion if rules.get_key(c).startswith(current_key)]
+                # a word nothing starts with is completed with the default, which is left to a full completion
+                if completion:
+                    self.args = args
+                    return completion, False
+
+            autocompletion = AutoCompletion(
+                config_path=None,
+                args=args,
+                rules=rules,
+                cwd=cwd,
+                listing_cache=listing_cache,
+                provider_cache=provider_cache,
+                parse_state=self.parse_state if rules is self.rules else None,
+                usage_history=usage_history,
+                result_cache=result_cache,
+                deadline=deadline,
+            )
+            completion = autocompletion.complete()
+
+            self.args = args
+            self.rules = rules
+            self.cwd = cwd
+            self.completion = completion
+            self.filterable = autocompletion.filterable
+            self.parse_state = autocompletion.parse_state
+            return completion, autocompletion.partial
+
+    def _extends_current_word(
+        self,
+        args: list[str],
+        rules: RuleSet,
+        cwd: str | None,
+    ):
+        """
+        :return: True if args only differ from the previous completion by more typed characters of the current word
+            and the previous completion can be filtered for them
+        """
+        if not self.filterable or rules is not self.rules or cwd != self.cwd:
+            return False
+        if not args or len(args) != len(self.args) or args[:-1] != self.args[:-1]:
+            return False
+        if not args[-1].startswith(self.args[-1]):
+            return False
+        # a typed directory completes with its entries, which are not part of the completion of its parent directory
+        if os.sep in args[-1][len(self.args[-1]):]:
+            return False
+
+        # an exact match is completed with what follows it, not filtered
+        command = self.parse_state.command
+        return rules.get_key(args[-1]) not in rules.exact_words and (
+            command is None or rules.get_subcommand(command, args[-1]) is None
         )
-        completion.extend(completion_next)
 
-        # adding all commands & global options that have not yet been used
-        completion_next = autocompletion.complete_next(
-            last_word_option=None,
-            last_word_command=None,
-            input=input,
+
+def get_socket_path():
+    """
+    :return: the path of the unix domain socket of the completion daemon - $AUTOCOMPLETION_SOCKET if set, otherwise
+        autocompletion.sock in $XDG_RUNTIME_DIR or a per user socket in the temporary directory
+        (autocompletion_client.py computes the same path)
+    """
+    if os.environ.get("AUTOCOMPLETION_SOCKET"):
+        return os.environ["AUTOCOMPLETION_SOCKET"]
+    if os.environ.get("XDG_RUNTIME_DIR"):
+        return os.path.join(os.environ["XDG_RUNTIME_DIR"], "autocompletion.sock")
+    return os.path.join(tempfile.gettempdir(), f"autocompletion-{os.getuid()}.sock")
+
+
+class CompletionRequestHandler(socketserver.StreamRequestHandler):
+    """
+    answers a single completion request of the daemon
+    request: one line of JSON - {"config_path": absolute path, "args": typed words, "cwd": working directory of the
+        shell, "session": optional id of the shell, consecutive completions of a session build on each other (see
+        CompletionSession), "timeout": optional time in seconds the client waits for the answer, the completion is cut
+        short after DAEMON_RESPONSE_SHARE of it}
+    response: one line of JSON - {"completion": list of completions, "partial": if the completion was cut short} or
+        {"error": message}
+    """
+
+    # a client that does not send its request in time is dropped instead of blocking the daemon
+    timeout = 1.0
+
+    def handle(self):
+        try:
+            request = json.loads(self.rfile.readline())
+            deadline = None
+            if request.get("timeout") is not None:
+                deadline = time.monotonic() + request["timeout"] * DAEMON_RESPONSE_SHARE
+            complete_function = complete_with_status
+            if request.get("session") is not None:
+                complete_function = self.server.get_session(
+                    session_id=str(request["session"]),
+                    config_path=request["config_path"],
+                ).complete
+            completion, partial = complete_function(
+                args=request["args"],
+                rules=self.server.get_rules(request["config_path"]),
+                cwd=request.get("cwd"),
+                listing_cache=self.server.listing_cache,
+                provider_cache=self.server.provider_cache,
+                usage_history=get_usage_history(
+                    config_path=request["config_path"],
+                    cache_dir=self.server.cache_dir,
+                ),
+                result_cache=self.server.result_cache,
+                deadline=deadline,
+            )
+            response = {"completion": completion, "partial": partial}
+        except Exception as e:
+            response = {"error": f"{type(e).__name__}: {e}"}
+
+        try:
+            self.wfile.write(json.dumps(response).encode() + b"\n")
+        except (BrokenPipeError, ConnectionResetError):
+            # the client gave up waiting, e.g. a client only checking if the daemon is running
+            pass
+
+
+class CompletionServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(
+        self,
+        socket_path: str,
+        config_paths: list[str] = (),
+        use_cache: bool = True,
+        cache_dir: str | None = None,
+        result_cache_path: str | None = None,
+    ):
+        """
+        completion daemon - keeps the rules of all configurations it was asked for loaded and answers completion
+        requests over a unix domain socket, see CompletionRequestHandler for the protocol
+        every request is answered in its own thread, all threads share the loaded rules
+        :param socket_path: path of the socket to listen on, a stale socket file of a daemon that is gone is replaced
+        :param config_paths: configurations loaded right away
+        :param use_cache: if set the rules are memory mapped from the rule index, see load_rules
+        :param cache_dir: directory of the rule index and the directory listings, defaults to get_cache_dir()
+        :param result_cache_path: if set, the result cache is loaded from this file and written to it once the daemon
+            stops, so it starts out warm the next time
+        """
+        self.use_cache = use_cache
+        self.cache_dir = cache_dir
+        # listings of large directories are also written to disk, a restarted daemon does not read them again
+        self.listing_cache = DirectoryListingCache(cache_dir=os.path.join(cache_dir or get_cache_dir(), "listings"))
+        self.provider_cache = ProviderCache()
+        self.result_cache = ResultCache(path=result_cache_path)
+        # absolute config path -> (mtime, size, rules, sharded commands), a configuration loaded by two requests at
+        # the same time is loaded twice and the last one is kept
+        self.loaded_rules = {}
+        # (session id, absolute config path) -> CompletionSession, least recently used first
+        self.sessions = collections.OrderedDict()
+        self.sessions_lock = threading.Lock()
+        for config_path in config_paths:
+            self.get_rules(config_path)
+
+        _remove_stale_socket(socket_path)
+        # the socket is only accessible for the user running the daemon
+        umask = os.umask(0o077)
+        try:
+            super().__init__(socket_path, CompletionRequestHandler)
+        finally:
+            os.umask(umask)
+
+    def get_rules(
+        self,
+        config_path: str,
+    ):
+        """
+        :param config_path: path to the configuration file
+        :return: the loaded rules of the configuration, reloaded if the configuration changed since it was loaded
+        """
+        config_path = os.path.abspath(config_path)
+        config_stat = os.stat(config_path)
+        loaded = self.loaded_rules.get(config_path)
+        # shards are not part of the configuration file, rules with a changed shard are loaded anew instead of changing
+        # the rules that other requests are completing with - continued sessions of the old rules then complete anew
+        if (
+            loaded is None
+            or loaded[:2] != (config_stat.st_mtime_ns, config_stat.st_size)
+            or any([command.shard_changed() for command in loaded[3]])
+        ):
+            rules = load_rules(
+                config_path=config_path,
+                use_cache=self.use_cache,
+                cache_dir=self.cache_dir,
+            )
+            # completions of the old configuration are never hit again, they only take up space
+            if loaded is not None and loaded[2].fingerprint != rules.fingerprint:
+                self.result_cache.invalidate(loaded[2].fingerprint)
+            sharded_commands = [command for command in rules.commands if isinstance(command, ShardedCommand)]
+            loaded = (config_stat.st_mtime_ns, config_stat.st_size, rules, sharded_commands)
+            self.loaded_rules[config_path] = loaded
+
+        return loaded[2]
+
+    def get_session(
+        self,
+        session_id: str,
+        config_path: str,
+    ):
+        """
+        :param session_id: id of the shell, e.g. its process id
+        :param config_path: path to the configuration file
+        :return: the completion session of the shell, a new one if the shell did not complete before - at most
+            SESSION_LIMIT sessions are kept
+        """
+        key = (session_id, os.path.abspath(config_path))
+        with self.sessions_lock:
+            session = self.sessions.get(key)
+            if session is None:
+                session = CompletionSession()
+                self.sessions[key] = session
+                if len(self.sessions) > SESSION_LIMIT:
+                    self.sessions.popitem(last=False)
+            self.sessions.move_to_end(key)
+            return session
+
+    def server_close(self):
+        super().server_close()
+        try:
+            os.unlink(self.server_address)
+        except OSError:
+            pass
+        if self.result_cache.path is not None:
+            try:
+                self.result_cache.save()
+            except OSError:
+                pass
+
+
+class ForkingCompletionServer(socketserver.ForkingMixIn, CompletionServer):
+    """
+    fork server - the rules are loaded once in this process, every completion request is then answered by a forked child
+    that starts out with the loaded rules (shared copy on write) and exits afterwards, so a crashing completion or any
+    state of a completion never affects other completions
+    configurations passed as config_paths are kept up to date in the parent, configurations only requested later are
+    loaded by each child itself - for the same reason completion sessions and the result cache do not outlive a
+    request, every completion starts anew (with the result cache as it was loaded)
+    """
+
+    def __init__(
+        self,
+        socket_path: str,
+        config_paths: list[str] = (),
+        use_cache: bool = True,
+        cache_dir: str | None = None,
+        result_cache_path: str | None = None,
+    ):
+        super().__init__(
+            socket_path=socket_path,
+            config_paths=config_paths,
+            use_cache=use_cache,
+            cache_dir=cache_dir,
+            result_cache_path=result_cache_path,
         )
-        completion.extend(completion_next)
+        # objects that exist before forking are never touched by the garbage collector of a child, so their memory pages
+        # stay shared with the parent
+        gc.freeze()
+
+    def process_request(
+        self,
+        request,
+        client_address,
+    ):
+        # reload changed configurations before forking, so children do not all load them on their own
+        for config_path, (mtime, size, *_) in list(self.loaded_rules.items()):
+            try:
+                self.get_rules(config_path)
+            except OSError:
+                continue
+            if self.loaded_rules[config_path][:2] != (mtime, size):
+                gc.freeze()
 
-    # if the current word cannot be completed with options completion will be attempted via the default completion specified in the config
-    if len(completion) == 0:
-        completion.append(autocompletion.default)
+        super().process_request(request, client_address)
 
-    if ParameterTypes.file in completion:
-        if exact_match or not autocompletion.current_word or autocompletion.current_word.strip() == '':
-            completion.extend(autocompletion.complete_file_path(None))
-        else:
-            completion.extend(autocompletion.complete_file_path(autocompletion.current_word))
 
-    # any type can not really be completed in any meaningful way
-    # file type completed above, removing type
-    if ParameterTypes.any.value in completion:
-        completion.remove(ParameterTypes.any)
-    if ParameterTypes.file.value in completion:
-        completion.remove(ParameterTypes.file)
+def _remove_stale_socket(
+    socket_path: str,
+):
+    """
+    removes the socket file of a daemon that is not running anymore
+    :raises OSError: if a daemon is still listening on the socket
+    """
+    if not os.path.exists(socket_path):
+        return
+
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        try:
+            client.connect(socket_path)
+        except ConnectionRefusedError:
+            os.unlink(socket_path)
+            return
+
+    raise OSError(f"a completion daemon is already listening on {socket_path}")
+
+
+if __name__ == "__main__":
+    input = sys.argv[1:]
+    config_path = None
+    # if the first input argument is --test_autocompletion_config the second argument will be used as the path to the
+    # test config to be used will probably only be used for test purposes
+    if len(input) > 1 and input[0] == "--test_autocompletion_config":
+        config_path = input[1]
+        input = input[2:]
+    # if the (next) input argument is --autocompletion_output the completions are written one after another as they are
+    # completed in the output mode given as the following argument (lines, nul, lines+status or nul+status, see
+    # write_completion) instead of printed as a list once all are completed
+    output_mode = None
+    if len(input) > 1 and input[0] == "--autocompletion_output":
+        output_mode = input[1]
+        input = input[2:]
+    # if the first input argument is --compile_autocompletion_config the configuration at the given path (or the default
+    # configuration) is compiled into the rule index, later completions then load the compiled rules
+    if len(input) > 0 and input[0] == "--compile_autocompletion_config":
+        compile_rule_index(config_path=input[1] if len(input) > 1 else "config.json")
+        sys.exit(0)
+    # if the first input argument is --autocompletion_daemon the completion daemon is started, listening on the socket
+    # path given as second argument or get_socket_path() - the configuration is loaded right away
+    # --autocompletion_fork_server starts the fork server instead, which answers each request in a forked child
+    if len(input) > 0 and input[0] in ["--autocompletion_daemon", "--autocompletion_fork_server"]:
+        server_class = CompletionServer
+        if input[0] == "--autocompletion_fork_server":
+            server_class = ForkingCompletionServer
+
+        with server_class(
+            socket_path=input[1] if len(input) > 1 else get_socket_path(),
+            config_paths=[config_path or "config.json"],
+            result_cache_path=os.path.join(get_cache_dir(), "results.pickle"),
+        ) as server:
+            # terminating the daemon removes its socket the same way as an interrupt does
+            signal.signal(signal.SIGTERM, signal.default_int_handler)
+            try:
+                server.serve_forever()
+            except KeyboardInterrupt:
+                pass
+        sys.exit(0)
+    # if the first input argument is --record_autocompletion_usage the following words are recorded as used for the
+    # usage ranking, meant to be run by a hook of the shell before a command line is executed
+    if len(input) > 0 and input[0] == "--record_autocompletion_usage":
+        record_usage(
+            args=input[1:],
+            rules=load_rule_index(config_path=config_path or "config.json"),
+            usage_history=get_usage_history(config_path=config_path or "config.json"),
+        )
+        sys.exit(0)
+
+    # listings of large directories that were read to the end are cached on disk, so repeated completions in them do not
+    # read them again - a directory that is not cached is still only read up to the file completion limit
+    listing_cache = DirectoryListingCache(cache_dir=os.path.join(get_cache_dir(), "listings"))
+    provider_cache = ProviderCache(cache_dir=os.path.join(get_cache_dir(), "providers"))
+    # the rules are memory mapped from the rule index, all shells completing with the same configuration share it
+    rules = load_rule_index(config_path=config_path or "config.json")
+    usage_history = get_usage_history(config_path=config_path or "config.json")
+    if output_mode is not None:
+        stream_completion(
+            args=input,
+            rules=rules,
+            output=sys.stdout.buffer,
+            output_mode=output_mode,
+            listing_cache=listing_cache,
+            provider_cache=provider_cache,
+            usage_history=usage_history,
+        )
+        sys.exit(0)
 
-    # duplicates need to be removed
-    completion = list(dict.fromkeys(completion))
     # print to command line - the command line scripts then need to read this from there
-    print(completion)
+    print(
+        complete(
+            args=input,
+            rules=rules,
+            listing_cache=listing_cache,
+            provider_cache=provider_cache,
+            usage_history=usage_history,
+        )
+    )
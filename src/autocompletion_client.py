@@ -0,0 +1,221 @@
+import json
+import os
+import socket
+import sys
+import tempfile
+
+# the client gets started on every completion, it only imports the standard library modules needed to talk to the
+# daemon - autocompletion itself is only imported if the daemon is not running
+
+CONNECT_TIMEOUT = 0.05
+# the daemon is told how long the client waits and cuts the completion short before
+# (autocompletion.DAEMON_RESPONSE_SHARE)
+RESPONSE_TIMEOUT = 1.0
+# same as autocompletion.OUTPUT_DELIMITERS
+OUTPUT_DELIMITERS = {"lines": b"\n", "nul": b"\0"}
+
+
+def get_socket_path():
+    """
+    :return: the path of the unix domain socket of the completion daemon, same as autocompletion.get_socket_path()
+    """
+    if os.environ.get("AUTOCOMPLETION_SOCKET"):
+        return os.environ["AUTOCOMPLETION_SOCKET"]
+    if os.environ.get("XDG_RUNTIME_DIR"):
+        return os.path.join(os.environ["XDG_RUNTIME_DIR"], "autocompletion.sock")
+    return os.path.join(tempfile.gettempdir(), f"autocompletion-{os.getuid()}.sock")
+
+
+def get_session_id():
+    """
+    :return: the id of the completion session - $AUTOCOMPLETION_SESSION if set, otherwise the process id of the shell
+        that started the client
+    """
+    return os.environ.get("AUTOCOMPLETION_SESSION") or str(os.getppid())
+
+
+def request_completion(
+    config_path: str,
+    args: list[str],
+    socket_path: str | None = None,
+    session_id: str | None = None,
+):
+    """
+    asks the completion daemon for the completion of the typed words
+    :param config_path: path to the configuration file
+    :param args: the typed words
+    :param socket_path: socket of the daemon, defaults to get_socket_path()
+    :param session_id: completions of the same session build on each other in the daemon, None completes anew
+    :return: a list of all completions, empty if the daemon does not answer in time
+    :raises OSError: if the daemon is not running or fails to complete
+    """
+    return request_completion_with_status(
+        config_path=config_path,
+        args=args,
+        socket_path=socket_path,
+        session_id=session_id,
+    )[0]
+
+
+def request_completion_with_status(
+    config_path: str,
+    args: list[str],
+    socket_path: str | None = None,
+    session_id: str | None = None,
+):
+    """
+    asks the completion daemon for the completion of the typed words, see request_completion
+    :return: a list of all completions and if the completion is partial - no completions (partial) if the daemon does
+        not answer in time, completing again in this process would only take even longer
+    :raises OSError: if the daemon is not running or fails to complete
+    """
+    request = {
+        "config_path": os.path.abspath(config_path),
+        "args": args,
+        "cwd": os.getcwd(),
+        "timeout": RESPONSE_TIMEOUT,
+    }
+    if session_id is not None:
+        request["session"] = session_id
+
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        client.settimeout(CONNECT_TIMEOUT)
+        client.connect(socket_path or get_socket_path())
+        client.settimeout(RESPONSE_TIMEOUT)
+        try:
+            client.sendall(json.dumps(request).encode() + b"\n")
+
+            response = b""
+            while not response.endswith(b"\n"):
+                data = client.recv(65536)
+                if not data:
+                    raise ConnectionError("completion daemon closed the connection")
+                response += data
+        except TimeoutError:
+            return [], True
+
+    response = json.loads(response)
+    if "error" in response:
+        raise OSError(f"completion daemon failed: {response['error']}")
+
+    return response["completion"], response.get("partial", False)
+
+
+def complete_in_process(
+    config_path: str,
+    args: list[str],
+):
+    """
+    completes the typed words without the daemon
+    :param config_path: path to the configuration file
+    :param args: the typed words
+    :return: a list of all completions
+    """
+    if __package__:
+        from . import autocompletion
+    else:
+        import autocompletion
+
+    return autocompletion.complete(args=args, rules=config_path)
+
+
+def complete(
+    config_path: str,
+    args: list[str],
+    socket_path: str | None = None,
+    session_id: str | None = None,
+):
+    """
+    completes the typed words using the daemon, falls back to completing in this process if the daemon is not available
+    :param config_path: path to the configuration file
+    :param args: the typed words
+    :param socket_path: socket of the daemon, defaults to get_socket_path()
+    :param session_id: id of the completion session, see request_completion
+    :return: a list of all completions
+    """
+    try:
+        return request_completion(
+            config_path=config_path,
+            args=args,
+            socket_path=socket_path,
+            session_id=session_id,
+        )
+    except (OSError, ValueError):
+        return complete_in_process(
+            config_path=config_path,
+            args=args,
+        )
+
+
+def write_completion(
+    completion: list[str],
+    partial: bool,
+    output,
+    output_mode: str,
+):
+    """
+    writes completions to a binary stream like autocompletion.write_completion
+    :param completion: the completions
+    :param partial: if the completion is partial
+    :param output: the binary stream, e.g. sys.stdout.buffer
+    :param output_mode: "lines" or "nul", optionally followed by "+status"
+    :raises ValueError: if the output mode is not known
+    """
+    mode, _, status = output_mode.partition("+")
+    if mode not in OUTPUT_DELIMITERS or status not in ["", "status"]:
+        raise ValueError(f"unknown output mode {output_mode}")
+    delimiter = OUTPUT_DELIMITERS[mode]
+
+    output.write(b"".join(word.encode() + delimiter for word in completion if word and delimiter not in word.encode()))
+    if status:
+        output.write(delimiter + (b"partial" if partial else b"complete") + delimiter)
+    output.flush()
+
+
+def stream_in_process(
+    config_path: str,
+    args: list[str],
+    output,
+    output_mode: str,
+):
+    """
+    completes the typed words without the daemon, writing every completion as soon as it is completed
+    :param config_path: path to the configuration file
+    :param args: the typed words
+    :param output: the binary stream the completions are written to
+    :param output_mode: how the completions are written, see write_completion
+    """
+    if __package__:
+        from . import autocompletion
+    else:
+        import autocompletion
+
+    autocompletion.stream_completion(args=args, rules=config_path, output=output, output_mode=output_mode)
+
+
+if __name__ == "__main__":
+    input = sys.argv[1:]
+    config_path = "config.json"
+    # same as for autocompletion.py, if the first input argument is --test_autocompletion_config the second argument
+    # will be used as the path to the config
+    if len(input) > 1 and input[0] == "--test_autocompletion_config":
+        config_path = input[1]
+        input = input[2:]
+    # same as for autocompletion.py, --autocompletion_output writes the completions in the given output mode - the
+    # answer of the daemon is written at once, without the daemon completions are written as they are completed
+    if len(input) > 1 and input[0] == "--autocompletion_output":
+        output_mode = input[1]
+        input = input[2:]
+        try:
+            completion, partial = request_completion_with_status(
+                config_path=config_path,
+                args=input,
+                session_id=get_session_id(),
+            )
+        except (OSError, ValueError):
+            stream_in_process(config_path=config_path, args=input, output=sys.stdout.buffer, output_mode=output_mode)
+        else:
+            write_completion(completion=completion, partial=partial, output=sys.stdout.buffer, output_mode=output_mode)
+        sys.exit(0)
+
+    print(complete(config_path=config_path, args=input, session_id=get_session_id()))
@@ -1,12 +1,85 @@
+import asyncio
+import io
+import itertools
+import json
+import os
+import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
 import pytest
 
-from src import AutoCompletion, Command, ParameterTypeOptions, ParameterTypes, Option
+from src import (
+    AutoCompletion,
+    Command,
+    ConfigLoader,
+    MappedRuleSet,
+    ParameterTypeOptions,
+    ParameterTypes,
+    Option,
+    RuleSet,
+    complete,
+    complete_with_status,
+)
+from src import autocompletion as autocompletion_module
+from src.autocompletion import (
+    CompletionScheduler,
+    CompletionSession,
+    DirectoryListingCache,
+    FuzzyIndex,
+    PrefixIndex,
+    Provider,
+    ParseState,
+    ProviderCache,
+    ResultCache,
+    TransitionTable,
+    UsageHistory,
+    ValueFile,
+    compile_rule_index,
+    get_cache_dir,
+    get_usage_history,
+    load_rule_index,
+    load_rules,
+    record_usage,
+    stream_completion,
+    write_completion,
+)
 
 
 # executing tests currently in directory autoCompletion
 # pytest tests/autocompletion_test.py
 
 
+# providers of the DYNAMIC parameters in config_5.json
+provider_calls = []
+provider_delay = 0
+# if set, the providers wait for each other before providing their values
+provider_barrier = None
+
+
+def provide_hosts(cwd):
+    provider_calls.append("hosts")
+    time.sleep(provider_delay)
+    if provider_barrier is not None:
+        provider_barrier.wait()
+    return ["build-1", "build-2"]
+
+
+def provide_local_hosts(cwd):
+    provider_calls.append("local_hosts")
+    time.sleep(provider_delay)
+    if provider_barrier is not None:
+        provider_barrier.wait()
+    return ["localhost", "build-1"]
+
+
+def provide_broken_hosts(cwd):
+    provider_calls.append("broken_hosts")
+    yield "build-1"
+    raise RuntimeError("no hosts")
+
+
 class TestAutocompletion:
     # -------------------------------- TEST CONFIGURATION/SETUP -------------------------------- #
     @pytest.mark.unit
@@ -302,6 +375,151 @@ class TestAutocompletion:
         for option in autocompletion.global_options:
             assert option in expected_options
 
+    @pytest.mark.unit
+    def test_config_parsed_once(self, monkeypatch):
+        parse_count = 0
+        json_loads = json.loads
+
+        def counting_loads(*args, **kwargs):
+            nonlocal parse_count
+            parse_count += 1
+            return json_loads(*args, **kwargs)
+
+        monkeypatch.setattr(json, "loads", counting_loads)
+
+        autocompletion = AutoCompletion(
+            config_path="tests/test_configs/config_1.json",
+            args=[],
+            use_cache=False,
+        )
+        autocompletion.get_commands()
+        autocompletion.get_options(option_type="command_option_rules")
+        autocompletion.get_options(option_type="global_option_rules")
+
+        assert parse_count == 1
+        assert len(autocompletion.commands) == 2
+        assert len(autocompletion.options) == 2
+        assert len(autocompletion.global_options) == 2
+
+    @pytest.mark.unit
+    def test_config_loader_lazy_sections(self):
+        config_loader = ConfigLoader(config_path="tests/test_configs/config_1.json")
+
+        assert config_loader._sections == {}
+
+        commands = config_loader.get_commands()
+
+        assert list(config_loader._sections) == ["command_rules"]
+        assert config_loader.get_commands() is commands
+        assert config_loader.get_default() == ParameterTypes.file
+
+    @pytest.mark.unit
+    def test_load_rules_from_cache(self, monkeypatch, tmp_path):
+        config_path = str(tmp_path / "config.json")
+        shutil.copy("tests/test_configs/config_1.json", config_path)
+
+        compile_rule_index(config_path=config_path)
+        assert len(os.listdir(get_cache_dir())) == 1
+
+        def failing_build(*args, **kwargs):
+            raise AssertionError("rules should be loaded from the index")
+
+        monkeypatch.setattr(RuleSet, "from_config_loader", failing_build)
+
+        autocompletion = AutoCompletion(
+            config_path=config_path,
+            args=[],
+        )
+
+        assert [command.name for command in autocompletion.commands] == ["c_1", "c_2"]
+        assert [option.long for option in autocompletion.global_options] == [
+            "--global_option_1",
+            "--global_option_2",
+        ]
+        assert autocompletion.default == ParameterTypes.file
+
+    @pytest.mark.unit
+    def test_load_rules_cache_invalidated(self, tmp_path):
+        config_path = str(tmp_path / "config.json")
+        shutil.copy("tests/test_configs/config_1.json", config_path)
+
+        assert len(load_rules(config_path=config_path).commands) == 2
+
+        shutil.copy("tests/test_configs/config_3.json", config_path)
+
+        assert len(load_rules(config_path=config_path).commands) == 5
+        # the temporary files of the atomic writes are never left behind
+        assert len(os.listdir(get_cache_dir())) == 1
+
+    @pytest.mark.unit
+    def test_load_rules_cache_touched(self, monkeypatch, tmp_path):
+        config_path = str(tmp_path / "config.json")
+        shutil.copy("tests/test_configs/config_1.json", config_path)
+        load_rules(config_path=config_path)
+
+        config_stat = os.stat(config_path)
+        os.utime(config_path, ns=(config_stat.st_atime_ns, config_stat.st_mtime_ns + 10**9))
+        monkeypatch.setattr(RuleSet, "from_config_loader", None)
+
+        assert len(load_rules(config_path=config_path).commands) == 2
+        # the index is refreshed, the content of the configuration is not hashed again
+        monkeypatch.setattr(ConfigLoader, "content", None)
+
+        assert len(load_rules(config_path=config_path).commands) == 2
+
+    @pytest.mark.unit
+    def test_rules_read_only(self):
+        rules = load_rules(config_path="tests/test_configs/config_1.json", use_cache=False)
+
+        with pytest.raises(AttributeError):
+            rules.commands = []
+        with pytest.raises(AttributeError):
+            rules.default = ParameterTypes.any
+
+        assert isinstance(rules.commands, tuple)
+
+    @pytest.mark.unit
+    def test_shared_rules_threads(self):
+        rules = load_rules(config_path="tests/test_configs/config_1.json")
+        inputs = [["c"], ["c_1"], ["c_2", "-"], ["--global_option_"], ["-go_1", "-o"], []] * 50
+
+        def complete(args):
+            return AutoCompletion(
+                config_path="tests/test_configs/config_1.json",
+                args=args,
+                rules=rules,
+            ).complete()
+
+        expected = [complete(args) for args in inputs]
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            completed = list(executor.map(complete, inputs))
+
+        assert completed == expected
+
+    @pytest.mark.unit
+    def test_shared_rules_asyncio(self):
+        rules = load_rules(config_path="tests/test_configs/config_1.json")
+
+        async def complete(args):
+            autocompletion = AutoCompletion(
+                config_path="tests/test_configs/config_1.json",
+                args=args,
+                rules=rules,
+            )
+            await asyncio.sleep(0)
+            return autocompletion.current_word, autocompletion.complete_current(
+                current_word=autocompletion.current_word,
+                input=autocompletion.current_input,
+            )
+
+        async def complete_all():
+            return await asyncio.gather(complete(["c_"]), complete(["--g"]))
+
+        assert asyncio.run(complete_all()) == [
+            ("c_", (["c_1", "c_2"], False)),
+            ("--g", (["--global_option_1", "--global_option_2"], False)),
+        ]
+
     @pytest.mark.unit
     def test_get_command_option_list_1(self):
         autocompletion = AutoCompletion(
@@ -665,6 +883,52 @@ class TestAutocompletion:
         for command in completed:
             assert command in expected
 
+    @pytest.mark.unit
+    def test_complete_current_order_and_typed(self):
+        autocompletion = AutoCompletion(
+            config_path="tests/test_configs/config_1.json",
+            args=[],
+        )
+
+        completed, exact_match = autocompletion.complete_current(
+            current_word="-",
+            input=["-go_1", "c_1"],
+        )
+
+        assert completed == [
+            "-o_1",
+            "--option_1",
+            "-o_2",
+            "--option_2",
+            "--global_option_1",
+            "-go_2",
+            "--global_option_2",
+        ]
+        assert not exact_match
+
+    @pytest.mark.unit
+    def test_complete_current_exact_match(self):
+        autocompletion = AutoCompletion(
+            config_path="tests/test_configs/config_1.json",
+            args=[],
+        )
+
+        assert autocompletion.complete_current(current_word="--option_1") == (["--option_1"], True)
+        assert autocompletion.complete_current(current_word="c_1", input=["c_1"]) == ([], True)
+        assert autocompletion.complete_current(current_word="c_3") == ([], False)
+
+    @pytest.mark.unit
+    def test_prefix_index_find(self):
+        prefix_index = PrefixIndex(
+            [("bc", 1), ("abd", 2), ("abc", 3), ("ab", 4), ("abc", 5)]
+        )
+
+        assert list(prefix_index.find("ab")) == [4, 3, 5, 2]
+        assert list(prefix_index.find("abc")) == [3, 5]
+        assert list(prefix_index.find("b")) == [1]
+        assert list(prefix_index.find("c")) == []
+        assert len(list(prefix_index.find(""))) == 5
+
     @pytest.mark.unit
     def test_complete_next_command_1(self):
         autocompletion = AutoCompletion(
@@ -945,3 +1209,1180 @@ class TestAutocompletion:
 
         assert command.name == "c_1"
         assert option is None
+
+    @pytest.mark.unit
+    def test_complete_file_path_directory(self):
+        autocompletion = AutoCompletion(
+            config_path="tests/test_configs/config_1.json",
+            args=[],
+        )
+
+        completed = autocompletion.complete_file_path("tests/test_dir/")
+
+        assert sorted(completed) == [
+            "tests/test_dir/dir_in_dir/",
+            "tests/test_dir/other_dir_in_dir/",
+            "tests/test_dir/other_file.txt",
+        ]
+
+    @pytest.mark.unit
+    def test_complete_file_path_prefix(self):
+        autocompletion = AutoCompletion(
+            config_path="tests/test_configs/config_1.json",
+            args=[],
+        )
+
+        assert sorted(autocompletion.complete_file_path("tests/test_dir/o")) == [
+            "tests/test_dir/other_dir_in_dir/",
+            "tests/test_dir/other_file.txt",
+        ]
+        assert autocompletion.complete_file_path("tests/test_dir/other_f") == ["tests/test_dir/other_file.txt"]
+        assert autocompletion.complete_file_path("tests/test_dir/x") == []
+
+    @pytest.mark.unit
+    def test_complete_file_path_cwd(self):
+        autocompletion = AutoCompletion(
+            config_path="tests/test_configs/config_1.json",
+            args=[],
+            cwd="tests/test_dir",
+        )
+
+        assert autocompletion.complete_file_path("dir") == ["dir_in_dir/"]
+        assert sorted(autocompletion.complete_file_path(None)) == [
+            "dir_in_dir/",
+            "other_dir_in_dir/",
+            "other_file.txt",
+        ]
+
+    @pytest.mark.unit
+    def test_complete_file_path_missing_directory(self):
+        autocompletion = AutoCompletion(
+            config_path="tests/test_configs/config_1.json",
+            args=[],
+        )
+
+        assert autocompletion.complete_file_path("does/not/exist") == []
+
+    @pytest.mark.unit
+    def test_complete_file_path_limit(self, tmp_path):
+        for i in range(20):
+            (tmp_path / f"file_{i}").touch()
+        autocompletion = AutoCompletion(
+            config_path="tests/test_configs/config_1.json",
+            args=[],
+            cwd=str(tmp_path),
+        )
+
+        assert len(autocompletion.complete_file_path("file_", limit=5)) == 5
+        assert len(autocompletion.complete_file_path("file_1")) == 11
+
+    @pytest.mark.unit
+    def test_complete_file_path_limit_config(self, tmp_path):
+        config_path = str(tmp_path / "config.json")
+        with open(config_path, "w") as config:
+            json.dump({"default": "FILE", "file_completion_limit": 2}, config)
+
+        completed = complete(args=["tests/test_dir/"], rules=config_path)
+
+        assert len(completed) == 2
+
+    @staticmethod
+    def _make_directory(path, names, mtime_ns=10**18):
+        path.mkdir()
+        for name in names:
+            (path / name).touch()
+        # listings of directories that were changed within the last seconds are not cached
+        os.utime(path, ns=(mtime_ns, mtime_ns))
+        return str(path)
+
+    @pytest.mark.unit
+    def test_listing_cache_hit(self, monkeypatch, tmp_path):
+        directory = self._make_directory(tmp_path / "dir", ["b", "a", "ab"])
+        listing_cache = DirectoryListingCache()
+        scanned = list(listing_cache.iter_entries(directory, ""))
+
+        def failing_scandir(*args, **kwargs):
+            raise AssertionError("listing should be cached")
+
+        monkeypatch.setattr(os, "scandir", failing_scandir)
+
+        # the cached listing keeps the order the directory was read in
+        assert list(listing_cache.iter_entries(directory, "")) == scanned
+        assert list(listing_cache.iter_entries(directory, "a")) == [entry for entry in scanned if entry[0] != "b"]
+        assert list(listing_cache.iter_entries(directory, "c")) == []
+
+    @pytest.mark.unit
+    def test_listing_cache_stopped_early(self, tmp_path):
+        directory = self._make_directory(tmp_path / "dir", [f"file_{i}" for i in range(10)])
+        listing_cache = DirectoryListingCache()
+
+        assert len(list(itertools.islice(listing_cache.iter_entries(directory, "file_"), 3))) == 3
+        assert len(listing_cache.listings) == 0
+
+        assert len(list(listing_cache.iter_entries(directory, "file_"))) == 10
+        assert listing_cache.entry_count == 10
+
+    @pytest.mark.unit
+    def test_listing_cache_invalidated(self, tmp_path):
+        directory = self._make_directory(tmp_path / "dir", ["a"])
+        listing_cache = DirectoryListingCache()
+
+        assert list(listing_cache.iter_entries(directory, "")) == [("a", False)]
+
+        (tmp_path / "dir" / "b").mkdir()
+        os.utime(directory, ns=(10**18 + 1, 10**18 + 1))
+
+        assert sorted(listing_cache.iter_entries(directory, "")) == [("a", False), ("b", True)]
+
+    @pytest.mark.unit
+    def test_listing_cache_recently_changed(self, tmp_path):
+        directory = str(tmp_path)
+        listing_cache = DirectoryListingCache()
+
+        list(listing_cache.iter_entries(directory, ""))
+
+        assert len(listing_cache.listings) == 0
+
+    @pytest.mark.unit
+    def test_listing_cache_eviction(self, tmp_path):
+        directories = [self._make_directory(tmp_path / f"dir_{i}", ["a", "b"]) for i in range(4)]
+        listing_cache = DirectoryListingCache(max_directories=2)
+
+        for directory in directories + [directories[2]]:
+            list(listing_cache.iter_entries(directory, ""))
+
+        assert list(listing_cache.listings) == [directories[3], directories[2]]
+
+        listing_cache = DirectoryListingCache(max_entries=5)
+        for directory in directories:
+            list(listing_cache.iter_entries(directory, ""))
+
+        assert list(listing_cache.listings) == [directories[2], directories[3]]
+        assert listing_cache.entry_count == 4
+
+    @pytest.mark.unit
+    def test_listing_cache_persisted(self, monkeypatch, tmp_path):
+        directory = self._make_directory(tmp_path / "dir", [f"file_{i}" for i in range(10)])
+        cache_dir = str(tmp_path / "listings")
+
+        scanned = list(DirectoryListingCache(cache_dir=cache_dir, min_persisted_entries=5).iter_entries(directory, ""))
+        monkeypatch.setattr(os, "scandir", None)
+        loaded = list(DirectoryListingCache(cache_dir=cache_dir, min_persisted_entries=5).iter_entries(directory, ""))
+
+        assert loaded == scanned
+        assert len(os.listdir(cache_dir)) == 1
+
+    @pytest.mark.unit
+    def test_complete_file_path_listing_cache(self):
+        autocompletion = AutoCompletion(
+            config_path="tests/test_configs/config_1.json",
+            args=[],
+            listing_cache=DirectoryListingCache(),
+        )
+        scanned = autocompletion.complete_file_path("tests/test_dir/o")
+
+        assert sorted(scanned) == [
+            "tests/test_dir/other_dir_in_dir/",
+            "tests/test_dir/other_file.txt",
+        ]
+        assert autocompletion.complete_file_path("tests/test_dir/o") == scanned
+        assert autocompletion.complete_file_path("tests/missing/o") == []
+
+    @staticmethod
+    def _slow_scan_directory(directory, prefix):
+        # stand in for a directory on a slow network filesystem, every entry takes 50ms to read
+        for i in range(100):
+            time.sleep(0.05)
+            name = f"file_{i}"
+            if name.startswith(prefix):
+                yield name, False
+
+    @pytest.mark.unit
+    def test_complete_file_path_timeout(self, monkeypatch):
+        monkeypatch.setattr(autocompletion_module, "_scan_directory", self._slow_scan_directory)
+        autocompletion = AutoCompletion(
+            config_path="tests/test_configs/config_1.json",
+            args=[],
+        )
+
+        start = time.monotonic()
+        completed = autocompletion.complete_file_path("slow/", timeout=0.3)
+
+        # reading the whole directory takes 5s
+        assert time.monotonic() - start < 2.5
+        assert 0 < len(completed) < 100
+        assert completed[0] == "slow/file_0"
+        assert autocompletion.partial
+
+    @pytest.mark.unit
+    def test_complete_file_path_within_timeout(self):
+        autocompletion = AutoCompletion(
+            config_path="tests/test_configs/config_1.json",
+            args=[],
+        )
+
+        completed = autocompletion.complete_file_path("tests/test_dir/o", timeout=5)
+
+        assert sorted(completed) == ["tests/test_dir/other_dir_in_dir/", "tests/test_dir/other_file.txt"]
+        assert not autocompletion.partial
+
+    @pytest.mark.unit
+    def test_complete_timeout_config(self, monkeypatch, tmp_path):
+        monkeypatch.setattr(autocompletion_module, "_scan_directory", self._slow_scan_directory)
+        config_path = self._write_config(tmp_path, file_completion_timeout=0.2)
+
+        start = time.monotonic()
+        completed, partial = complete_with_status(args=["-go_2", ""], rules=config_path)
+
+        assert time.monotonic() - start < 2.5
+        assert partial
+        # commands and options are completed no matter how long reading the directory takes
+        assert completed[:3] == ["-go_1", "c_1", "c_2"]
+        assert "file_0" in completed
+
+    @pytest.mark.unit
+    def test_scheduler_runs_sources_at_same_time(self):
+        # every source waits for the others, run one after the other they would fail
+        barrier = threading.Barrier(3, timeout=2)
+
+        def waiting_source(result):
+            def source():
+                barrier.wait()
+                return result
+            return source
+
+        results, dropped = CompletionScheduler(budget=5).run(
+            {"a": waiting_source(["a"]), "b": waiting_source(["b"]), "c": waiting_source(["c"])}
+        )
+
+        assert results == {"a": ["a"], "b": ["b"], "c": ["c"]}
+        assert dropped == []
+
+    @pytest.mark.unit
+    def test_scheduler_drops_late_sources(self):
+        finished = threading.Event()
+
+        def late_source():
+            finished.wait(timeout=5)
+            return ["late"]
+
+        start = time.monotonic()
+        results, dropped = CompletionScheduler(budget=0.1).run(
+            {"fast": lambda: ["fast"], "late": late_source}
+        )
+        finished.set()
+
+        # the late source would only finish after 5s
+        assert time.monotonic() - start < 2.5
+        assert results == {"fast": ["fast"]}
+        assert dropped == ["late"]
+
+    @pytest.mark.unit
+    def test_scheduler_source_error(self):
+        def failing_source():
+            raise ValueError("failed")
+
+        with pytest.raises(ValueError):
+            CompletionScheduler(budget=1).run({"failing": failing_source})
+
+    @staticmethod
+    def _write_config(tmp_path, **settings):
+        with open("tests/test_configs/config_1.json") as config_file:
+            config = json.load(config_file)
+        config.update(settings)
+        config_path = str(tmp_path / "config.json")
+        with open(config_path, "w") as config_file:
+            json.dump(config, config_file)
+        return config_path
+
+    @pytest.mark.unit
+    def test_complete_latency_budget_same_result(self, tmp_path):
+        config_path = self._write_config(tmp_path, latency_budget=5)
+
+        for args in [[], ["c"], ["c_1"], ["c_2", "-"], ["-go_1", ""], ["tests/test_dir/o"], ["c_1", "-o_1"]]:
+            completed, partial = complete_with_status(args=args, rules=config_path)
+
+            assert completed == complete(args=args, rules="tests/test_configs/config_1.json")
+            assert not partial
+
+    @pytest.mark.unit
+    def test_complete_latency_budget_drops_files(self, monkeypatch, tmp_path):
+        monkeypatch.setattr(autocompletion_module, "_scan_directory", self._slow_scan_directory)
+        config_path = self._write_config(tmp_path, latency_budget=0.1)
+
+        start = time.monotonic()
+        completed, partial = complete_with_status(args=["-go_2", ""], rules=config_path)
+
+        # reading the whole directory takes 5s
+        assert time.monotonic() - start < 2.5
+        assert partial
+        assert completed[:3] == ["-go_1", "c_1", "c_2"]
+        assert not any(c.startswith("file_") for c in completed)
+
+    @pytest.fixture
+    def providers(self):
+        global provider_delay, provider_barrier
+        provider_calls.clear()
+        yield
+        provider_delay = 0
+        provider_barrier = None
+
+    @pytest.mark.unit
+    def test_complete_dynamic_command(self, providers):
+        completed = complete(args=["checkout", ""], rules="tests/test_configs/config_5.json")
+        position = completed.index("main")
+
+        assert completed[position:position + 3] == ["main", "master", "dev"]
+        assert "--host" in completed
+        assert "DYNAMIC" not in completed
+
+    @pytest.mark.unit
+    def test_complete_dynamic_started_word(self, providers):
+        completed = complete(args=["checkout", "ma"], rules="tests/test_configs/config_5.json")
+
+        assert completed == ["main", "master"]
+
+    @pytest.mark.unit
+    def test_complete_dynamic_function(self, providers):
+        completed = complete(args=["checkout", "--host", "b"], rules="tests/test_configs/config_5.json")
+
+        assert completed == ["build-1", "build-2"]
+        assert sorted(provider_calls) == ["hosts", "local_hosts"]
+
+    @pytest.mark.unit
+    def test_complete_dynamic_providers_at_same_time(self, providers):
+        global provider_barrier
+        # run one after the other, the first provider would wait in vain and provide nothing
+        provider_barrier = threading.Barrier(2, timeout=0.4)
+
+        completed = complete(args=["--host", ""], rules="tests/test_configs/config_5.json")
+
+        assert completed[-3:] == ["build-1", "build-2", "localhost"]
+
+    @pytest.mark.unit
+    def test_complete_dynamic_deadline(self, providers):
+        global provider_delay
+        provider_delay = 1.5
+
+        completed, partial = complete_with_status(
+            args=["--host", ""],
+            rules="tests/test_configs/config_5.json",
+            deadline=time.monotonic() + 0.2,
+        )
+
+        # the providers would take longer than the deadline allows, their values are dropped
+        assert partial
+        assert "build-1" not in completed
+
+    @pytest.mark.unit
+    def test_complete_dynamic_timeout(self, providers):
+        global provider_delay
+        provider_delay = 1.5
+        provider = Provider(function="tests.autocompletion_test:provide_hosts", timeout=0.1)
+
+        start = time.monotonic()
+
+        assert provider.get_values(cwd=None) is None
+        assert time.monotonic() - start < 1
+        assert Provider(command=["sleep", "1"], timeout=0.1).get_values(cwd=None) is None
+        assert Provider(command=["false"]).get_values(cwd=None) is None
+
+    @pytest.mark.unit
+    def test_complete_dynamic_failing(self, providers, capsys):
+        provider = Provider(function="tests.autocompletion_test:provide_broken_hosts")
+
+        assert provider.get_values(cwd=None) is None
+        assert Provider(function="tests.missing_module:provide_hosts").get_values(cwd=None) is None
+        # the exception is not left on the worker thread, which would print it to the terminal
+        assert capsys.readouterr().err == ""
+
+    @pytest.mark.unit
+    def test_complete_dynamic_cached(self, providers):
+        provider_cache = ProviderCache()
+
+        for _ in range(3):
+            completed = complete(
+                args=["--host", "l"],
+                rules="tests/test_configs/config_5.json",
+                provider_cache=provider_cache,
+            )
+
+            assert completed == ["localhost"]
+
+        assert sorted(provider_calls) == ["hosts", "local_hosts"]
+
+    @pytest.mark.unit
+    def test_provider_cache_ttl_and_eviction(self, providers):
+        hosts = Provider(function="tests.autocompletion_test:provide_hosts", ttl=0)
+        local_hosts = Provider(function="tests.autocompletion_test:provide_local_hosts")
+        provider_cache = ProviderCache(max_entries=1)
+
+        provider_cache.get_values(provider=hosts, cwd=None)
+        provider_cache.get_values(provider=hosts, cwd=None)
+        provider_cache.get_values(provider=local_hosts, cwd=None)
+        provider_cache.get_values(provider=local_hosts, cwd="tests")
+
+        assert provider_calls == ["hosts", "hosts", "local_hosts", "local_hosts"]
+        assert list(provider_cache.entries) == [(local_hosts.key, os.path.abspath("tests"))]
+
+    @pytest.mark.unit
+    def test_provider_cache_failure_not_cached(self, providers, tmp_path):
+        global provider_delay
+        provider_delay = 0.3
+        provider = Provider(function="tests.autocompletion_test:provide_hosts", timeout=0.1)
+        provider_cache = ProviderCache(cache_dir=str(tmp_path / "providers"))
+
+        assert provider_cache.get_values(provider=provider, cwd=None) is None
+        assert provider_cache.get_values(provider=provider, cwd=None) is None
+
+        assert provider_calls == ["hosts", "hosts"]
+        assert len(provider_cache.entries) == 0
+        assert not (tmp_path / "providers").exists()
+
+    @pytest.mark.unit
+    def test_provider_cache_persisted(self, providers, tmp_path):
+        provider = Provider(function="tests.autocompletion_test:provide_hosts")
+        cache_dir = str(tmp_path / "providers")
+
+        ProviderCache(cache_dir=cache_dir).get_values(provider=provider, cwd=None)
+        values = ProviderCache(cache_dir=cache_dir).get_values(provider=provider, cwd=None)
+
+        assert values == ["build-1", "build-2"]
+        assert provider_calls == ["hosts"]
+
+    @pytest.mark.unit
+    def test_complete_enum_values(self):
+        completed = complete(args=["deploy", "p"], rules="tests/test_configs/config_6.json")
+
+        assert completed == ["preview", "production"]
+        assert "ENUM" not in complete(args=["deploy", ""], rules="tests/test_configs/config_6.json")
+
+    @pytest.mark.unit
+    def test_complete_enum_values_file(self):
+        completed = complete(args=["deploy", "--region", "eu-west"], rules="tests/test_configs/config_6.json")
+
+        assert completed == ["eu-west-1", "eu-west-2"]
+        assert complete(args=["deploy", "--region", "sa"], rules="tests/test_configs/config_6.json") == []
+
+    @pytest.mark.unit
+    def test_value_file_find(self, tmp_path):
+        values = sorted(f"value_{i:05}" for i in range(10000))
+        path = tmp_path / "values.txt"
+        path.write_text("\n".join(values))
+        value_file = ValueFile(str(path))
+
+        assert value_file.find(prefix="value_0012", limit=100) == [f"value_{i:05}" for i in range(120, 130)]
+        assert value_file.find(prefix="value_09999", limit=100) == ["value_09999"]
+        assert value_file.find(prefix="", limit=3) == values[:3]
+        assert value_file.find(prefix="value_1", limit=5) == []
+        assert value_file.find(prefix="a", limit=5) == []
+        assert value_file.find(prefix="z", limit=5) == []
+
+        path.write_text("")
+        assert ValueFile(str(path)).find(prefix="", limit=5) == []
+
+    @pytest.mark.unit
+    def test_value_file_changed(self, tmp_path):
+        path = tmp_path / "values.txt"
+        path.write_text("a\nb")
+        os.utime(path, ns=(10**18, 10**18))
+        value_file = ValueFile(str(path))
+        assert value_file.find(prefix="", limit=5) == ["a", "b"]
+        old_map = value_file._get_memory_map()
+
+        path.write_text("c\nd")
+
+        assert value_file.find(prefix="", limit=5) == ["c", "d"]
+        assert old_map.closed
+
+    @pytest.mark.unit
+    def test_parse_input(self):
+        autocompletion = AutoCompletion(
+            config_path="tests/test_configs/config_1.json",
+            args=[],
+        )
+
+        state = autocompletion.parse_input(["-go_2", "c_1", "-o_1", "a", "b", "--global_option_1"])
+
+        assert state.command.name == "c_1"
+        assert state.command_parameter_count == 1
+        assert state.option.name == "-go_1"
+        assert state.parameter_required
+        assert state.parameter_rule.name == "-go_1"
+        assert state.used == {"-go_2", "c_1", "-go_1"}
+
+    @pytest.mark.unit
+    def test_parse_input_continued(self, monkeypatch):
+        autocompletion = AutoCompletion(
+            config_path="tests/test_configs/config_1.json",
+            args=[],
+        )
+        state = autocompletion.parse_input(["c_1", "a"])
+        advanced = []
+        advance = ParseState.advance
+        monkeypatch.setattr(
+            ParseState, "advance", lambda self, rules, word: advanced.append(word) or advance(self, rules, word)
+        )
+
+        continued = autocompletion.parse_input(["c_1", "a", "b"], state=state)
+        edited = autocompletion.parse_input(["c_2", "a", "b"], state=state)
+
+        assert continued.command_parameter_count == 2
+        assert state.command_parameter_count == 1
+        assert edited.command.name == "c_2"
+        assert advanced == ["b", "c_2", "a", "b"]
+
+    @pytest.mark.unit
+    def test_complete_max_amnt_reached(self):
+        rules = load_rules(config_path="tests/test_configs/config_1.json")
+
+        completed = complete(args=["c_1", "a", "b", ""], rules=rules, cwd="tests/test_dir")
+        assert completed[:4] == ["-o_1", "-go_1", "-go_2", "c_2"]
+        # files are listed in directory order
+        assert sorted(completed[4:]) == ["dir_in_dir/", "other_dir_in_dir/", "other_file.txt"]
+        assert complete(args=["c_1", "a", "b", "c", ""], rules=rules) == ["-o_1", "-go_1", "-go_2", "c_2"]
+        # -o_1 takes one parameter, the next one belongs to c_1 again
+        assert "ANY" not in complete(args=["c_1", "-o_1", "x", ""], rules=rules)
+        assert "other_file.txt" in complete(args=["c_1", "-o_1", "x", ""], rules=rules, cwd="tests/test_dir")
+
+    @pytest.mark.unit
+    def test_complete_min_amnt_required(self):
+        completed = complete(args=["c_1", "-go_1", ""], rules="tests/test_configs/config_1.json", cwd="tests/test_dir")
+
+        assert sorted(completed) == ["dir_in_dir/", "other_dir_in_dir/", "other_file.txt"]
+
+    @pytest.mark.unit
+    def test_transition_table(self):
+        rules = load_rules(config_path="tests/test_configs/config_1.json")
+        transitions = rules.transitions
+
+        assert len(transitions) == 7
+        assert transitions.next_tokens[TransitionTable.START] == ("-go_1", "-go_2", "c_1", "c_2")
+
+        command_state = transitions.state_by_word["c_1"]
+        assert transitions.rules[command_state].name == "c_1"
+        assert transitions.next_tokens[command_state] == ("-o_1",)
+        assert transitions.parameter_types[command_state] == ("FILE", "ANY")
+        assert (transitions.min_amnt[command_state], transitions.max_amnt[command_state]) == (1, 3)
+
+        assert transitions.state_by_word["--global_option_1"] == transitions.state_by_word["-go_1"]
+        assert transitions.get_state(rules.global_options[0]) == transitions.state_by_word["-go_1"]
+
+    @pytest.mark.unit
+    def test_transition_table_state_of_colliding_name(self, tmp_path):
+        with open("tests/test_configs/config_1.json") as config_file:
+            config = json.load(config_file)
+        # the name of the added option is the long form of -o_1
+        config["command_option_rules"]["--option_1"] = {
+            "parameters": {"min_amnt": 0, "max_amnt": 0, "type_options": []},
+        }
+        config_path = str(tmp_path / "config.json")
+        with open(config_path, "w") as config_file:
+            json.dump(config, config_file)
+
+        for rules in [load_rules(config_path=config_path, use_cache=False), load_rule_index(config_path=config_path)]:
+            transitions = rules.transitions
+            states = [transitions.get_state(option) for option in rules.options]
+
+            assert [transitions.rules[state] for state in states] == list(rules.options)
+            assert transitions.max_amnt[states[0]] == 1
+            assert transitions.max_amnt[states[2]] == 0
+
+    @pytest.mark.unit
+    def test_transition_table_cached(self, tmp_path):
+        compile_rule_index(config_path="tests/test_configs/config_1.json", cache_dir=str(tmp_path))
+        rules = load_rules(config_path="tests/test_configs/config_1.json", cache_dir=str(tmp_path))
+
+        assert rules.transitions.state_by_word["-o_1"] == 3
+
+    @pytest.mark.unit
+    def test_rule_index_same_completion(self, providers):
+        inputs = [[], ["c"], ["c_1", ""], ["-go_2", ""], ["c_2", "-"], ["--global_option_"], ["c_1", "-o_1", ""]]
+        for config_path, args_list in [
+            ("tests/test_configs/config_1.json", inputs),
+            ("tests/test_configs/config_3.json", inputs),
+            ("tests/test_configs/config_5.json", [["checkout", "ma"], ["checkout", "--host", "b"]]),
+            ("tests/test_configs/config_6.json", [["deploy", "p"], ["deploy", "--region", "eu-west"]]),
+            ("tests/test_configs/config_7.json", [["remote", ""], ["remote", "remove", ""], ["remote", "add", "-"]]),
+            ("tests/test_configs/config_8.json", [[], ["deploy", "eu"], ["remote", ""], ["status", ""]]),
+        ]:
+            rules = load_rules(config_path=config_path, use_cache=False)
+            mapped_rules = load_rule_index(config_path=config_path)
+
+            assert isinstance(mapped_rules, MappedRuleSet)
+            assert list(mapped_rules.commands) == list(rules.commands)
+            assert list(mapped_rules.options) == list(rules.options)
+            assert list(mapped_rules.global_options) == list(rules.global_options)
+            assert mapped_rules.fingerprint == rules.fingerprint
+            for args in args_list:
+                assert complete(args=args, rules=mapped_rules, cwd="tests/test_dir") == complete(
+                    args=args, rules=rules, cwd="tests/test_dir"
+                )
+
+    @pytest.mark.unit
+    def test_rule_index_lookups(self):
+        rules = load_rule_index(config_path="tests/test_configs/config_1.json")
+
+        assert rules.default == ParameterTypes.file
+        assert list(rules.completion_index.find("--g")) == [
+            (7, "--global_option_1", True),
+            (9, "--global_option_2", True),
+        ]
+        assert "-o_2" in rules.exact_words
+        assert "-o_" not in rules.exact_words
+        assert rules.command_by_word["c_2"].options == ["-o_1", "-o_2"]
+        assert rules.global_option_by_word.get("--global_option_2").name == "-go_2"
+        assert rules.option_by_word.get("-go_1") is None
+
+    @pytest.mark.unit
+    def test_rule_index_rebuilt(self, tmp_path):
+        config_path = tmp_path / "config.json"
+        shutil.copy("tests/test_configs/config_1.json", config_path)
+        load_rule_index(config_path=str(config_path))
+
+        with open(config_path) as config_file:
+            config = json.load(config_file)
+        config["command_rules"]["c_3"] = config["command_rules"]["c_2"]
+        with open(config_path, "w") as config_file:
+            json.dump(config, config_file)
+        os.utime(config_path, ns=(0, 0))
+
+        assert complete(args=["c_"], rules=load_rule_index(config_path=str(config_path))) == ["c_1", "c_2", "c_3"]
+
+    @pytest.mark.unit
+    def test_complete_subcommands(self):
+        config_path = "tests/test_configs/config_7.json"
+
+        assert complete(args=["remote", ""], rules=config_path) == ["add", "remove", "set-url", "-v"]
+        assert complete(args=["remote", "re"], rules=config_path) == ["remove"]
+        assert complete(args=["remote", "remove", "o"], rules=config_path) == ["origin"]
+        assert complete(args=["remote", "set-url", ""], rules=config_path) == ["add"]
+        # outside of remote, add is the top level command that takes files
+        assert "other_file.txt" in complete(args=["add", ""], rules=config_path, cwd="tests/test_dir")
+        assert "other_file.txt" not in complete(args=["remote", "add", ""], rules=config_path, cwd="tests/test_dir")
+
+    @pytest.mark.unit
+    def test_parse_input_subcommands(self):
+        autocompletion = AutoCompletion(
+            config_path="tests/test_configs/config_7.json",
+            args=[],
+        )
+
+        state = autocompletion.parse_input(["remote", "set-url", "add", "origin"])
+
+        assert state.command.path == ("remote", "set-url", "add")
+        assert state.command_parameter_count == 1
+        assert state.used == {"remote"}
+
+    @pytest.mark.unit
+    def test_subcommands_built_lazily(self):
+        rules = ConfigLoader(config_path="tests/test_configs/config_7.json").get_commands()
+        remote = rules[0]
+
+        assert remote.subcommand_names == ("add", "remove", "set-url")
+        assert remote._subcommands == {}
+
+        set_url = remote.get_subcommand("set-url")
+
+        assert list(remote._subcommands) == ["set-url"]
+        assert set_url._subcommands == {}
+        assert remote.get_subcommand("set-url") is set_url
+        assert remote.get_subcommand("missing") is None
+
+    @pytest.mark.unit
+    def test_complete_sharded_commands(self):
+        config_path = "tests/test_configs/config_8.json"
+
+        assert complete(args=[], rules=config_path) == ["deploy", "remote", "status"]
+        assert complete(args=["deploy", "eu-w"], rules=config_path) == ["eu-west-1", "eu-west-2"]
+        assert complete(args=["remote", ""], rules=config_path) == ["remove", "deploy", "status"]
+        assert complete(args=["remote", "remove", "u"], rules=config_path) == ["upstream"]
+
+    @pytest.mark.unit
+    def test_shards_read_on_demand(self, tmp_path):
+        shutil.copytree("tests/test_configs/shards", tmp_path / "shards")
+        shutil.copy("tests/test_configs/regions.txt", tmp_path)
+        with open("tests/test_configs/config_8.json") as config_file:
+            config = json.load(config_file)
+        config["command_rules"]["missing"] = "shards/missing.json"
+        config["command_rules"]["broken"] = "shards/broken.json"
+        (tmp_path / "shards" / "broken.json").write_text('{"options": [')
+        config_path = str(tmp_path / "config.json")
+        with open(config_path, "w") as config_file:
+            json.dump(config, config_file)
+        rules = load_rules(config_path=config_path)
+
+        completed = complete(args=["deploy", "-"], rules=rules)
+
+        assert completed == ["-v", "--verbose"]
+        assert rules.command_by_word["deploy"].is_built
+        assert not rules.command_by_word["remote"].is_built
+        assert not rules.command_by_word["missing"].is_built
+        # a missing or broken shard is a command without options, parameters and subcommands
+        for name in ["missing", "broken"]:
+            assert sorted(complete(args=[name, ""], rules=rules)) == sorted(
+                {"deploy", "remote", "status", "missing", "broken"} - {name}
+            )
+            assert rules.command_by_word[name].options == ()
+
+    @pytest.mark.unit
+    def test_complete_fuzzy(self, tmp_path):
+        config_path = self._write_config(tmp_path, fuzzy_matching=True)
+
+        assert complete(args=["gopt1"], rules=config_path) == ["--global_option_1"]
+        assert complete(args=["c1"], rules=config_path) == ["c_1"]
+        # words starting with the started word rank first
+        assert complete(args=["-o"], rules=config_path)[:4] == ["-o_1", "-o_2", "--option_1", "--option_2"]
+        assert complete(args=["--global_option_1", "x", "GOPT"], rules=config_path) == ["--global_option_2"]
+
+    @pytest.mark.unit
+    def test_complete_fuzzy_limit(self, tmp_path):
+        config_path = self._write_config(tmp_path, fuzzy_matching=True, fuzzy_matching_limit=2)
+
+        assert complete(args=["opt"], rules=config_path) == ["--option_1", "--option_2"]
+        assert complete(args=["-o_1", "opt"], rules=config_path) == ["--option_1", "--option_2"]
+
+    @pytest.mark.unit
+    def test_complete_fuzzy_limit_prefix_matches(self, tmp_path):
+        config_path = self._write_config(tmp_path, fuzzy_matching=True, fuzzy_matching_limit=1)
+
+        # the limit only holds for the words the started word does not start
+        assert complete(args=["--global"], rules=config_path) == ["--global_option_1", "--global_option_2"]
+        assert complete(args=["-o_1", "-go"], rules=config_path) == ["-go_1", "-go_2", "--global_option_1"]
+
+    @pytest.mark.unit
+    def test_fuzzy_index_prefilter(self, monkeypatch):
+        scored = []
+        score_fuzzy_match = autocompletion_module._score_fuzzy_match
+        monkeypatch.setattr(
+            autocompletion_module,
+            "_score_fuzzy_match",
+            lambda query, candidate: scored.append(candidate) or score_fuzzy_match(query, candidate),
+        )
+        fuzzy_index = FuzzyIndex((word, word) for word in ["--global_option_1", "--verbose", "abc", "cab", "gpt1"])
+
+        assert fuzzy_index.find("gpt1", limit=10) == ["gpt1", "--global_option_1"]
+        assert sorted(scored) == ["--global_option_1", "gpt1"]
+        assert fuzzy_index.find("bca", limit=10) == []
+        assert fuzzy_index.find("ab", limit=1) == ["abc"]
+
+    @pytest.mark.unit
+    def test_rule_index_fuzzy(self, tmp_path):
+        config_path = self._write_config(tmp_path, fuzzy_matching=True)
+        rules = load_rules(config_path=config_path)
+        mapped_rules = load_rule_index(config_path=config_path)
+
+        for args in [["gopt1"], ["opt"], ["c_1", "o1"]]:
+            assert complete(args=args, rules=mapped_rules) == complete(args=args, rules=rules)
+
+    @pytest.mark.unit
+    def test_resolve_word(self, tmp_path):
+        rules = load_rules(config_path=self._write_config(tmp_path, ignore_case=True, abbreviations=True))
+        mapped_rules = load_rule_index(config_path=self._write_config(tmp_path, ignore_case=True, abbreviations=True))
+
+        for resolve_word in [rules.resolve_word, mapped_rules.resolve_word]:
+            assert resolve_word("--GLOBAL_OPTION_1") == "--global_option_1"
+            assert resolve_word("C_1") == "c_1"
+            assert resolve_word("--option_2") == "--option_2"
+            # ambiguous or no long form
+            assert resolve_word("--glob") is None
+            assert resolve_word("--global_option_") is None
+            assert resolve_word("-go_") is None
+            assert resolve_word("--") is None
+            assert resolve_word("--GLOBAL_OPTION_1", abbreviations=False) == "--global_option_1"
+
+        assert load_rules(config_path="tests/test_configs/config_1.json").resolve_word("C_1") is None
+
+    @pytest.mark.unit
+    def test_complete_ignore_case(self, tmp_path):
+        config_path = self._write_config(tmp_path, ignore_case=True)
+
+        assert complete(args=["C"], rules=config_path) == ["c_1", "c_2"]
+        assert complete(args=["--GLOBAL"], rules=config_path) == ["--global_option_1", "--global_option_2"]
+        assert complete(args=["C_2", ""], rules=config_path) == ["-o_1", "-o_2", "-go_1", "-go_2", "c_1"]
+        # typed words are not completed again in any case
+        assert complete(args=["--GLOBAL_OPTION_1", "x", "--global"], rules=config_path) == ["--global_option_2"]
+        assert complete(args=["-GO_1", "x", "-go"], rules=config_path) == ["-go_2"]
+
+    @pytest.mark.unit
+    def test_complete_ignore_case_subcommands(self, tmp_path):
+        with open("tests/test_configs/config_7.json") as config_file:
+            config = json.load(config_file)
+        config["ignore_case"] = True
+        config_path = str(tmp_path / "config.json")
+        with open(config_path, "w") as config_file:
+            json.dump(config, config_file)
+        rules = load_rules(config_path=config_path)
+        session = CompletionSession()
+
+        assert complete(args=["remote", "ADD", ""], rules=rules) == complete(args=["remote", "add", ""], rules=rules)
+        assert complete(args=["remote", "ADD"], rules=rules) == complete(args=["remote", "add"], rules=rules)
+        assert session.complete(args=["remote", "A"], rules=rules)[0] == ["add"]
+        assert session.complete(args=["remote", "AD"], rules=rules)[0] == ["add"]
+        # an exact match of a subcommand is completed with what follows it, not filtered
+        assert session.complete(args=["remote", "ADD"], rules=rules)[0] == complete(args=["remote", "add"], rules=rules)
+
+    @pytest.mark.unit
+    def test_abbreviations(self, tmp_path):
+        with open("tests/test_configs/config_7.json") as config_file:
+            config = json.load(config_file)
+        config["abbreviations"] = True
+        config_path = str(tmp_path / "config.json")
+        with open(config_path, "w") as config_file:
+            json.dump(config, config_file)
+        autocompletion = AutoCompletion(
+            config_path=config_path,
+            args=[],
+        )
+
+        state = autocompletion.parse_input(["remote", "--verb"])
+        command, option = autocompletion.get_last_command_global_option(["add", "--forc"])
+
+        assert state.option.name == "-v"
+        assert option.name == "-f"
+        command_option_list = autocompletion.get_command_option_list(["add", "--f", "--v"])
+        assert [rule.name for rule in command_option_list] == ["add", "-f", "-v"]
+        # a started long form is still completed, not resolved
+        assert complete(args=["remote", "--verb"], rules=config_path) == ["--verbose"]
+
+    @pytest.mark.unit
+    def test_usage_history_decay(self, tmp_path):
+        usage_history = UsageHistory(path=str(tmp_path / "history"), half_life=100)
+        now = time.time()
+
+        usage_history.record(["c_1"], now=now - 100)
+        usage_history.record(["c_2", "bad\tname"], now=now)
+        scores = usage_history.get_scores()
+
+        assert set(scores) == {"c_1", "c_2"}
+        assert scores["c_1"] == pytest.approx(scores["c_2"] / 2, rel=0.01)
+
+    @pytest.mark.unit
+    def test_usage_history_compact(self, tmp_path):
+        usage_history = UsageHistory(path=str(tmp_path / "history"), half_life=100, compact_size=100)
+        now = time.time()
+        usage_history.record(["c_1"] * 3, now=now - 100)
+        usage_history.record(["c_2"], now=now)
+        scores = usage_history.get_scores()
+
+        usage_history.record(["c_1"] * 10, now=now)
+
+        assert not os.path.exists(usage_history.log_path)
+        assert os.path.exists(usage_history.snapshot_path)
+        compacted = usage_history.get_scores()
+        assert compacted["c_1"] == pytest.approx(scores["c_1"] + 10, rel=0.01)
+        assert compacted["c_2"] == pytest.approx(scores["c_2"], rel=0.01)
+
+    @pytest.mark.unit
+    def test_usage_history_compact_failed(self, monkeypatch, tmp_path):
+        usage_history = UsageHistory(path=str(tmp_path / "history"), compact_size=100)
+        write_atomic = autocompletion_module._write_atomic
+
+        def failing_write_atomic(*args):
+            raise OSError("disk full")
+
+        monkeypatch.setattr(autocompletion_module, "_write_atomic", failing_write_atomic)
+        # recording does not fail, the moved log is left behind
+        usage_history.record(["c_1"] * 10)
+        assert os.path.exists(f"{usage_history.log_path}.compacting")
+
+        monkeypatch.setattr(autocompletion_module, "_write_atomic", write_atomic)
+        usage_history.record(["c_2"] * 10)
+
+        assert not os.path.exists(f"{usage_history.log_path}.compacting")
+        scores = usage_history.get_scores()
+        assert scores["c_1"] == pytest.approx(10, rel=0.01)
+        assert scores["c_2"] == pytest.approx(10, rel=0.01)
+
+    @pytest.mark.unit
+    def test_usage_history_scores_kept(self, monkeypatch, tmp_path):
+        usage_history = UsageHistory(path=str(tmp_path / "history"))
+        usage_history.record(["c_1"])
+        scores = usage_history.get_scores()
+
+        def failing_load_snapshot():
+            raise AssertionError("scores should be kept")
+
+        # another instance of the same history, like the daemon creates for every request
+        kept_history = UsageHistory(path=str(tmp_path / "history"))
+        monkeypatch.setattr(kept_history, "_load_snapshot", failing_load_snapshot)
+
+        assert kept_history.get_scores() is scores
+
+        usage_history.record(["c_2"])
+
+        assert set(usage_history.get_scores()) == {"c_1", "c_2"}
+
+    @pytest.mark.unit
+    def test_usage_history_concurrent_records(self, tmp_path):
+        usage_history = UsageHistory(path=str(tmp_path / "history"), compact_size=4096)
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            list(executor.map(lambda i: usage_history.record([f"c_{i % 4}"] * 5), range(200)))
+
+        scores = usage_history.get_scores()
+        assert set(scores) == {"c_0", "c_1", "c_2", "c_3"}
+        assert sum(scores.values()) == pytest.approx(1000, rel=0.01)
+
+    @pytest.mark.unit
+    def test_complete_usage_ranking(self, tmp_path):
+        config_path = self._write_config(tmp_path, usage_ranking=True)
+        rules = load_rules(config_path=config_path, use_cache=False)
+        usage_history = get_usage_history(config_path=config_path, cache_dir=str(tmp_path))
+
+        completed = complete(args=["c_2", ""], rules=rules, usage_history=usage_history)
+        assert completed == ["-o_1", "-o_2", "-go_1", "-go_2", "c_1"]
+
+        record_usage(["c_1", "--global_option_2", "unknown"], rules=rules, usage_history=usage_history)
+
+        assert usage_history.get_scores().keys() == {"c_1", "-go_2"}
+        completed = complete(args=["c_2", ""], rules=rules, usage_history=usage_history)
+        assert completed == ["-go_2", "c_1", "-o_1", "-o_2", "-go_1"]
+        completed = complete(args=["--global"], rules=rules, usage_history=usage_history)
+        assert completed == ["--global_option_2", "--global_option_1"]
+        # without usage_ranking the history is not used
+        completed = complete(args=["c_2", ""], rules="tests/test_configs/config_1.json", usage_history=usage_history)
+        assert completed[0] == "-o_1"
+
+    @pytest.mark.unit
+    def test_completion_session_same_as_complete(self):
+        rules = load_rules(config_path="tests/test_configs/config_1.json")
+        session = CompletionSession()
+        typed = [
+            ["c"], ["c_"], ["c_1"], ["c_1", ""], ["c_1", "-"], ["c_1", "-o"], ["c_1", "-o_1"],
+            ["c_1", "-o_1", "tests/"], ["c_1", "-o_1", "tests/test_d"], ["c_2", "-o_1", "tests/test_d"],
+            ["--glob"], ["--global_option_2"], ["x"], ["xy"],
+        ]
+
+        for args in typed:
+            completed, partial = session.complete(args=args, rules=rules)
+
+            assert completed == complete(args=args, rules=rules)
+            assert not partial
+
+    @pytest.mark.unit
+    def test_completion_session_directory(self):
+        rules = load_rules(config_path="tests/test_configs/config_1.json")
+        session = CompletionSession()
+
+        assert session.complete(args=["c_1", "tests/test_d"], rules=rules)[0] == ["tests/test_dir/"]
+        # the entries of a typed directory are not filtered from the completion of its parent
+        completed = session.complete(args=["c_1", "tests/test_dir/"], rules=rules)[0]
+        assert sorted(completed) == [
+            "tests/test_dir/dir_in_dir/",
+            "tests/test_dir/other_dir_in_dir/",
+            "tests/test_dir/other_file.txt",
+        ]
+        assert session.complete(args=["c_1", "tests/test_dir/o"], rules=rules)[0] == complete(
+            args=["c_1", "tests/test_dir/o"], rules=rules
+        )
+
+    @pytest.mark.unit
+    def test_completion_session_reuse(self, monkeypatch):
+        rules = load_rules(config_path="tests/test_configs/config_1.json")
+        session = CompletionSession()
+        completions = []
+        advanced = []
+        monkeypatch.setattr(
+            AutoCompletion,
+            "complete",
+            lambda self, complete=AutoCompletion.complete: completions.append(self.current_input) or complete(self),
+        )
+        monkeypatch.setattr(
+            ParseState,
+            "advance",
+            lambda self, rules, word, advance=ParseState.advance: advanced.append(word) or advance(self, rules, word),
+        )
+
+        session.complete(args=["c_2", "-"], rules=rules)
+        session.complete(args=["c_2", "-o"], rules=rules)
+        assert session.complete(args=["c_2", "-o_"], rules=rules)[0] == ["-o_1", "-o_2"]
+        assert completions == [["c_2", "-"]]
+
+        # the words before the current word are not parsed again
+        session.complete(args=["c_2", "-o_2"], rules=rules)
+        session.complete(args=["c_2", "-o_2", ""], rules=rules)
+        assert advanced == ["c_2", "-o_2"]
+
+        # a changed word before the current word is parsed anew
+        session.complete(args=["c_1", "-o_2", ""], rules=rules)
+        assert advanced == ["c_2", "-o_2", "c_1", "-o_2"]
+
+    @pytest.mark.unit
+    def test_complete_result_cache(self, monkeypatch):
+        rules = load_rules(config_path="tests/test_configs/config_1.json")
+        result_cache = ResultCache()
+        typed = [["c"], ["c_1"], ["c_2", ""], ["c_2", "-"], ["-go_2", "tests/"], ["--glob"]]
+
+        expected = [complete(args=args, rules=rules) for args in typed]
+        assert [complete(args=args, rules=rules, result_cache=result_cache) for args in typed] == expected
+        assert (result_cache.hits, result_cache.misses) == (0, len(typed))
+
+        # cached commands/options are not completed again, file paths still are
+        monkeypatch.setattr(AutoCompletion, "complete_current", None)
+        monkeypatch.setattr(AutoCompletion, "complete_next", None)
+        assert [complete(args=args, rules=rules, result_cache=result_cache) for args in typed] == expected
+        assert (result_cache.hits, result_cache.misses) == (len(typed), len(typed))
+
+    @pytest.mark.unit
+    def test_result_cache_fingerprint(self, tmp_path):
+        config_path = self._write_config(tmp_path)
+        rules = load_rules(config_path=config_path, use_cache=False)
+        result_cache = ResultCache(path=str(tmp_path / "results.pickle"))
+        complete(args=["c"], rules=rules, result_cache=result_cache)
+
+        self._write_config(tmp_path, default="ANY")
+        changed_rules = load_rules(config_path=config_path, use_cache=False)
+        complete(args=["c"], rules=changed_rules, result_cache=result_cache)
+
+        mapped_rules = load_rule_index(config_path=config_path, cache_dir=str(tmp_path))
+        assert changed_rules.fingerprint == mapped_rules.fingerprint
+        assert rules.fingerprint != changed_rules.fingerprint
+        assert result_cache.misses == 2
+
+        result_cache.invalidate(rules.fingerprint)
+        result_cache.save()
+        loaded = ResultCache(path=str(tmp_path / "results.pickle"))
+
+        assert list(loaded.entries) == [(changed_rules.fingerprint, ("c",))]
+        assert loaded.get(changed_rules.fingerprint, ("c",)) == {"current": ("c_1", "c_2")}
+
+    @pytest.mark.unit
+    def test_result_cache_sharded_command(self, tmp_path):
+        shutil.copytree("tests/test_configs/shards", tmp_path / "shards")
+        shutil.copy("tests/test_configs/regions.txt", tmp_path)
+        shutil.copy("tests/test_configs/config_8.json", tmp_path / "config.json")
+        config_path = str(tmp_path / "config.json")
+        result_cache = ResultCache()
+
+        rules = load_rules(config_path, use_cache=False)
+        assert complete(args=["deploy", ""], rules=rules, result_cache=result_cache)[0] == "-v"
+
+        with open(tmp_path / "shards" / "deploy.json") as shard_file:
+            shard = json.load(shard_file)
+        shard["options"] = []
+        with open(tmp_path / "shards" / "deploy.json", "w") as shard_file:
+            json.dump(shard, shard_file)
+
+        # the configuration itself is unchanged, completions depending on a shard are never cached
+        rules = load_rules(config_path, use_cache=False)
+        assert "-v" not in complete(args=["deploy", ""], rules=rules, result_cache=result_cache)
+        assert complete(args=["sta"], rules=rules, result_cache=result_cache) == ["status"]
+        assert list(result_cache.entries) == [(rules.fingerprint, ("sta",))]
+
+    @pytest.mark.unit
+    def test_iter_complete_before_files(self, monkeypatch):
+        passed_on = threading.Event()
+        read_after_passed_on = []
+
+        def blocked_scan_directory(directory, prefix):
+            # the directory can only be read once commands and options were passed on
+            read_after_passed_on.append(passed_on.wait(timeout=5))
+            yield "file_0", False
+
+        monkeypatch.setattr(autocompletion_module, "_scan_directory", blocked_scan_directory)
+        autocompletion = AutoCompletion(
+            config_path="tests/test_configs/config_1.json",
+            args=["-go_2", ""],
+        )
+
+        completion = autocompletion.iter_complete()
+        first = [next(completion) for _ in range(3)]
+        passed_on.set()
+
+        assert first == ["-go_1", "c_1", "c_2"]
+        assert next(completion) == "file_0"
+        assert read_after_passed_on == [True]
+
+    @pytest.mark.unit
+    @pytest.mark.parametrize("latency_budget", [None, 5])
+    def test_iter_complete_before_providers(self, monkeypatch, tmp_path, latency_budget):
+        with open("tests/test_configs/config_5.json") as config_file:
+            config = json.load(config_file)
+        config["latency_budget"] = latency_budget
+        config_path = str(tmp_path / "config.json")
+        with open(config_path, "w") as config_file:
+            json.dump(config, config_file)
+        passed_on = threading.Event()
+
+        def blocked_get_values(provider, cwd):
+            # the provider can only provide once commands and options were passed on
+            return ["main"] if passed_on.wait(timeout=5) else []
+
+        monkeypatch.setattr(Provider, "get_values", blocked_get_values)
+        autocompletion = AutoCompletion(
+            config_path=config_path,
+            args=["checkout", ""],
+        )
+
+        completion = autocompletion.iter_complete()
+        first = next(completion)
+        passed_on.set()
+
+        assert first == "--host"
+        assert list(completion) == ["main"]
+        assert not autocompletion.partial
+
+    @pytest.mark.unit
+    def test_write_completion(self):
+        output = io.BytesIO()
+        write_completion(["c_1", "", "two\nlines", "c_2"], output=output)
+        assert output.getvalue() == b"c_1\nc_2\n"
+
+        output = io.BytesIO()
+        write_completion(["c_1", "two\nlines"], output=output, output_mode="nul+status", get_partial=lambda: True)
+        assert output.getvalue() == b"c_1\0two\nlines\0\0partial\0"
+
+        with pytest.raises(ValueError):
+            write_completion([], output=output, output_mode="json")
+
+    @pytest.mark.unit
+    def test_stream_completion(self, tmp_path):
+        config_path = self._write_config(tmp_path, file_completion_timeout=1)
+
+        for args in [[], ["c"], ["c_2", "-"], ["-go_2", "tests/"], ["c_1", "-o_1", ""]]:
+            output = io.BytesIO()
+            stream_completion(args=args, rules=config_path, output=output, output_mode="lines+status")
+
+            completed, partial = complete_with_status(args=args, rules=config_path)
+            assert output.getvalue().decode().split("\n") == completed + ["", "partial" if partial else "complete", ""]
+
+    # -------------------------------- TEST COMPLETE -------------------------------- #
+    @pytest.mark.unit
+    def test_complete_current_word(self):
+        completed = complete(
+            args=["--global_option_"],
+            rules="tests/test_configs/config_1.json",
+        )
+
+        assert completed == ["--global_option_1", "--global_option_2"]
+
+    @pytest.mark.unit
+    def test_complete_next_and_files(self):
+        completed = complete(
+            args=["c_1", ""],
+            rules=load_rules(config_path="tests/test_configs/config_1.json"),
+            cwd="tests/test_dir",
+        )
+
+        assert completed[:4] == ["-o_1", "-go_1", "-go_2", "c_2"]
+        assert sorted(completed[-3:]) == ["dir_in_dir/", "other_dir_in_dir/", "other_file.txt"]
+        assert "FILE" not in completed
+        assert "ANY" not in completed
+
+    @pytest.mark.unit
+    def test_complete_default_any(self, tmp_path):
+        config_path = str(tmp_path / "config.json")
+        with open(config_path, "w") as config:
+            json.dump({"default": "ANY"}, config)
+
+        assert complete(args=["something"], rules=config_path) == []
+
+    @pytest.mark.unit
+    def test_complete_no_duplicates(self):
+        completed = complete(
+            args=["c_2", "-o_1"],
+            rules="tests/test_configs/config_1.json",
+        )
+
+        assert len(completed) == len(set(completed))
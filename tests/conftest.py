@@ -0,0 +1,7 @@
+import pytest
+
+
+@pytest.fixture(autouse=True)
+def isolated_cache_dir(tmp_path, monkeypatch):
+    # keep the compiled config cache of the tests out of the users cache directory
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "cache"))
@@ -0,0 +1,256 @@
+import gc
+import io
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+
+from src import AutoCompletion
+from src import autocompletion_client
+from src.autocompletion import CompletionServer, ForkingCompletionServer
+
+
+# executing tests currently in directory autoCompletion
+# pytest tests/daemon_test.py
+
+
+@pytest.fixture
+def daemon(tmp_path):
+    server = CompletionServer(
+        socket_path=str(tmp_path / "autocompletion.sock"),
+        config_paths=["tests/test_configs/config_1.json"],
+    )
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+
+    yield server
+
+    server.shutdown()
+    server.server_close()
+    thread.join()
+
+
+@pytest.fixture
+def fork_server(tmp_path):
+    # the fork server runs in its own process - children forked from the test process would inherit the client sockets
+    # of the test and never see them getting closed
+    socket_path = str(tmp_path / "autocompletion.sock")
+    process = subprocess.Popen(
+        [
+            sys.executable,
+            "src/autocompletion.py",
+            "--test_autocompletion_config",
+            "tests/test_configs/config_1.json",
+            "--autocompletion_fork_server",
+            socket_path,
+        ]
+    )
+    for _ in range(100):
+        if os.path.exists(socket_path):
+            break
+        time.sleep(0.05)
+
+    yield socket_path
+
+    process.terminate()
+    process.wait()
+
+    assert not os.path.exists(socket_path)
+
+
+class TestDaemon:
+    @pytest.mark.unit
+    def test_request_completion(self, daemon):
+        completed = autocompletion_client.request_completion(
+            config_path="tests/test_configs/config_1.json",
+            args=["--global_option_"],
+            socket_path=daemon.server_address,
+        )
+
+        assert completed == ["--global_option_1", "--global_option_2"]
+
+    @pytest.mark.unit
+    def test_request_completion_same_as_in_process(self, daemon):
+        for args in [[], ["c_1"], ["c_2", "-"], ["-go_2", "tests/"], ["c"]]:
+            completed = autocompletion_client.request_completion(
+                config_path="tests/test_configs/config_1.json",
+                args=args,
+                socket_path=daemon.server_address,
+            )
+            expected = AutoCompletion(
+                config_path="tests/test_configs/config_1.json",
+                args=args,
+            ).complete()
+
+            assert completed == expected
+
+    @pytest.mark.unit
+    def test_request_completion_rules_kept_loaded(self, daemon):
+        rules = daemon.get_rules("tests/test_configs/config_1.json")
+
+        autocompletion_client.request_completion(
+            config_path="tests/test_configs/config_1.json",
+            args=["c"],
+            socket_path=daemon.server_address,
+        )
+
+        assert daemon.get_rules(os.path.abspath("tests/test_configs/config_1.json")) is rules
+
+    @pytest.mark.unit
+    def test_request_completion_session(self, daemon):
+        completions = [
+            autocompletion_client.request_completion(
+                config_path="tests/test_configs/config_1.json",
+                args=args,
+                socket_path=daemon.server_address,
+                session_id=session_id,
+            )
+            for session_id, args in [("1", ["c_2", "-"]), ("2", ["c"]), ("1", ["c_2", "-o"]), ("2", ["c_1"])]
+        ]
+
+        assert completions[2] == ["-o_1", "-o_2"]
+        assert completions[3] == autocompletion_client.complete_in_process("tests/test_configs/config_1.json", ["c_1"])
+        assert [session_id for session_id, _ in daemon.sessions] == ["1", "2"]
+        assert daemon.sessions["1", os.path.abspath("tests/test_configs/config_1.json")].args == ["c_2", "-o"]
+
+    @pytest.mark.unit
+    def test_request_completion_shard_changed(self, daemon, tmp_path):
+        shutil.copytree("tests/test_configs/shards", tmp_path / "shards")
+        shutil.copy("tests/test_configs/regions.txt", tmp_path)
+        shutil.copy("tests/test_configs/config_8.json", tmp_path / "config.json")
+        config_path = str(tmp_path / "config.json")
+        request = dict(config_path=config_path, args=["deploy", ""], socket_path=daemon.server_address)
+
+        assert "-v" in autocompletion_client.request_completion(**request)
+        old_rules = daemon.get_rules(config_path)
+
+        shard_path = tmp_path / "shards" / "deploy.json"
+        with open(shard_path) as shard:
+            shard_rule = json.load(shard)
+        shard_rule["options"] = []
+        with open(shard_path, "w") as shard:
+            json.dump(shard_rule, shard)
+        shard_stat = os.stat(shard_path)
+        os.utime(shard_path, ns=(shard_stat.st_atime_ns, shard_stat.st_mtime_ns + 1_000_000_000))
+
+        assert "-v" not in autocompletion_client.request_completion(**request)
+        # the changed shard is loaded with new rules, requests still completing with the old rules are not affected
+        assert daemon.get_rules(config_path) is not old_rules
+        assert "-v" in old_rules.command_by_word["deploy"].options
+
+    @pytest.mark.unit
+    def test_request_completion_result_cache(self, daemon):
+        for _ in range(3):
+            autocompletion_client.request_completion(
+                config_path="tests/test_configs/config_1.json",
+                args=["c_2", "-"],
+                socket_path=daemon.server_address,
+            )
+
+        assert (daemon.result_cache.hits, daemon.result_cache.misses) == (2, 1)
+
+    @pytest.mark.unit
+    def test_client_output_mode(self, daemon):
+        completion, partial = autocompletion_client.request_completion_with_status(
+            config_path="tests/test_configs/config_1.json",
+            args=["c"],
+            socket_path=daemon.server_address,
+        )
+        output = io.BytesIO()
+        autocompletion_client.write_completion(completion, partial, output=output, output_mode="nul+status")
+
+        assert output.getvalue() == b"c_1\0c_2\0\0complete\0"
+
+    @pytest.mark.unit
+    def test_request_completion_no_answer(self, monkeypatch, tmp_path):
+        monkeypatch.setattr(autocompletion_client, "RESPONSE_TIMEOUT", 0.1)
+        socket_path = str(tmp_path / "autocompletion.sock")
+
+        # a daemon that accepts the connection but never answers
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as server:
+            server.bind(socket_path)
+            server.listen()
+            completed = autocompletion_client.complete(
+                config_path="tests/test_configs/config_1.json",
+                args=["c"],
+                socket_path=socket_path,
+            )
+
+        assert completed == []
+
+    @pytest.mark.unit
+    def test_request_completion_error(self, daemon):
+        with pytest.raises(OSError):
+            autocompletion_client.request_completion(
+                config_path="tests/test_configs/does_not_exist.json",
+                args=["c"],
+                socket_path=daemon.server_address,
+            )
+
+    @pytest.mark.unit
+    def test_complete_fallback_without_daemon(self, tmp_path):
+        completed = autocompletion_client.complete(
+            config_path="tests/test_configs/config_1.json",
+            args=["--global_option_"],
+            socket_path=str(tmp_path / "not_running.sock"),
+        )
+
+        assert completed == ["--global_option_1", "--global_option_2"]
+
+    @pytest.mark.unit
+    def test_stale_socket_replaced(self, tmp_path):
+        socket_path = str(tmp_path / "autocompletion.sock")
+        CompletionServer(socket_path=socket_path).socket.close()
+
+        # the socket file of the closed server is left behind, a new daemon can still be started
+        server = CompletionServer(socket_path=socket_path)
+        server.server_close()
+
+        assert not os.path.exists(socket_path)
+
+    @pytest.mark.unit
+    def test_daemon_already_running(self, daemon):
+        with pytest.raises(OSError):
+            CompletionServer(socket_path=daemon.server_address)
+
+    @pytest.mark.unit
+    def test_fork_server_request_completion(self, fork_server):
+        for args in [["--global_option_"], ["c_1"], ["c_2", "-"], ["c"]]:
+            completed = autocompletion_client.request_completion(
+                config_path="tests/test_configs/config_1.json",
+                args=args,
+                socket_path=fork_server,
+            )
+            expected = AutoCompletion(
+                config_path="tests/test_configs/config_1.json",
+                args=args,
+            ).complete()
+
+            assert completed == expected
+
+    @pytest.mark.unit
+    def test_fork_server_not_preloaded_config(self, fork_server):
+        completed = autocompletion_client.request_completion(
+            config_path="tests/test_configs/config_3.json",
+            args=["c_"],
+            socket_path=fork_server,
+        )
+
+        assert completed == ["c_2", "c_o_m_m_a_n_d_5"]
+
+    @pytest.mark.unit
+    def test_fork_server_rules_loaded_once(self, tmp_path):
+        server = ForkingCompletionServer(
+            socket_path=str(tmp_path / "autocompletion.sock"),
+            config_paths=["tests/test_configs/config_1.json"],
+        )
+        server.server_close()
+        gc.unfreeze()
+
+        assert list(server.loaded_rules) == [os.path.abspath("tests/test_configs/config_1.json")]